@@ -0,0 +1,438 @@
+'''
+    Asyncio library API for the Baines Image Quizzer setup utilities.
+
+    Installs and module connects without Qt, prompts or status-bar text, for
+    scripts and lab automation that drive many workstations from one process:
+
+        import asyncio
+        from ImageQuizzerAPI import SetupSession
+
+        async def main():
+            async with SetupSession(iMaxInstalls=4, iMaxConnects=16) as oSession:
+                lResults = await oSession.gather([oSession.install(sSource, sTarget, bStaged=True)\
+                                                  for sTarget in lTargets])
+                lInis = await oSession.gather([oSession.connect(sTarget, [sSlicer])\
+                                               for sTarget, sSlicer in zip(lTargets, lSlicers)])
+
+        asyncio.run(main())
+
+    One operation at a time:
+
+        oResult = await install(sSource, sTarget, sBackup='rename', bVerify=True)
+        lInis = await connect(sTarget)
+        async with contextlib.aclosing(installEvents(sSource, sTarget)) as itEvents:
+            async for oEvent in itEvents:
+                print(oEvent.sText)
+
+    Install options are the InstallJob attributes (see lINSTALL_OPTIONS); sBackup
+    is 'rename', 'archive' or 'none' as for setup-cli install --backup.
+
+    The blocking work (pre-flight check, InstallJob.run, connectAll) runs on
+    executor threads. Progress is posted back to the event loop as ProgressEvents,
+    throttled to one every fPROGRESS_INTERVAL seconds per install. Cancelling the
+    awaiting task cancels the install between files, waits for the copy thread
+    to stop and re-raises CancelledError - the install is left as after Ctrl-C in
+    setup-cli (a staged install keeps the existing install in place - its backup
+    is only taken at the swap - and an in-place install resumes from its journal
+    when run again).
+
+    A SetupSession bounds how many installs and connects run at once and refuses
+    a second install into a folder that is still being installed. Its connects
+    rewrite a Slicer-xxxx.ini file one at a time (a lock per ini file); the last
+    one wins, as a Slicer install knows one Image Quizzer install. connect()
+    called on its own does not lock - give each Slicer install one coroutine.
+
+    The install manager's InstallWorker runs its job through jobEvents and the
+    module connector's Connect button calls connect. This module never imports
+    PyQt5 and is bundled into the setup executables by pyinstaller.
+'''
+
+import os
+import time
+import asyncio
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageQuizzerCopyEngine import CopyCancelled
+from ImageQuizzerInstallJob import InstallJob, isPartialInstall
+from ImageQuizzerBackup import getBackupPath, BackupMoveError
+from ImageQuizzerPreflight import runPreflight
+from ImageQuizzerSlicerDiscovery import connectAll, getDefaultRoots, IniLocks, iDEFAULT_DEPTH
+from ImageQuizzerSetupOptions import sBACKUP_RENAME, sBACKUP_ARCHIVE, sBACKUP_NONE, lBACKUP_MODES
+
+
+fPROGRESS_INTERVAL = 0.2        # seconds between progress events of one install
+iDEFAULT_MAX_INSTALLS = 4
+iDEFAULT_MAX_CONNECTS = 16
+
+sEVENT_START = 'start'
+sEVENT_PROGRESS = 'progress'
+sEVENT_ARCHIVING = 'archiving'      # install done, waiting for the archive backup
+sEVENT_DONE = 'done'
+
+sOPERATION_INSTALL = 'install'
+sOPERATION_CONNECT = 'connect'
+
+# InstallJob attributes that may be passed to install() as keyword arguments
+lINSTALL_OPTIONS = ['bIncremental', 'bCompareHash', 'sCopyBackend', 'iCopyWorkers', 'sWritePolicy', 'bSnapshot',\
+                    'bDedup', 'iKeepBackups', 'bPreserveUserData', 'sBackupRoot', 'bStaged', 'bVerify', 'sProfile', 'sRulesFile']
+
+
+##########################################################################
+#
+# PreflightError
+#
+##########################################################################
+class PreflightError(Exception):
+    ''' Raised when the pre-flight check stops an install before anything was
+        changed; oReport is the PreflightReport.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, oReport):
+        super(PreflightError, self).__init__("Pre-flight check failed - " + "; ".join(oReport.lProblems))
+        self.oReport = oReport
+
+
+##########################################################################
+#
+# ProgressEvent
+#
+##########################################################################
+class ProgressEvent():
+    ''' One step of an install or connect: 'start', 'progress' (copy counters),
+        'archiving' or 'done' (oResult is the InstallResult, or the connectAll
+        results of a connect).
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sKind, sOperation, sTarget, oProgress=None, sText=None, oResult=None):
+        self.sKind = sKind
+        self.sOperation = sOperation
+        self.sTarget = sTarget
+        self.sText = sText
+        self.oResult = oResult
+        self.iFilesDone = self.iFilesTotal = self.iBytesDone = self.iBytesTotal = 0
+        self.fFraction = 1.0 if sKind == sEVENT_DONE else 0.0
+        if oProgress is not None:
+            # a copy - the CopyProgress keeps counting on the copy threads
+            self.iFilesDone, self.iFilesTotal = oProgress.iFilesDone, oProgress.iFilesTotal
+            self.iBytesDone, self.iBytesTotal = oProgress.iBytesDone, oProgress.iBytesTotal
+            self.fFraction = oProgress.getFraction()
+            if sText is None:
+                self.sText = oProgress.formatStatus()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        dEvent = {'event': self.sKind, 'operation': self.sOperation, 'target': self.sTarget, 'text': self.sText,\
+                  'files_done': self.iFilesDone, 'files_total': self.iFilesTotal,\
+                  'bytes_done': self.iBytesDone, 'bytes_total': self.iBytesTotal, 'fraction': round(self.fFraction, 4)}
+        if self.oResult is not None:
+            dEvent['result'] = self.oResult.toDict() if hasattr(self.oResult, 'toDict') else self.oResult
+        return dEvent
+
+
+##########################################################################
+#
+# InstallResult
+#
+##########################################################################
+class InstallResult():
+    ''' Outcome of an install: sStatus is 'ok', 'cancelled' (the job was cancelled
+        directly, see InstallJob.cancel) or 'failed' (the backup failed and nothing was
+        installed - oError, a BackupMoveError - or the archive backup failed after the
+        new install was put in place - oError None, see oJob.oArchiveTask.oError).
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, oJob, sStatus, sMessage, fSeconds, oPreflight=None, oError=None):
+        self.oJob = oJob
+        self.sStatus = sStatus
+        self.sMessage = sMessage
+        self.fSeconds = fSeconds
+        self.oPreflight = oPreflight
+        self.oError = oError
+        oTask = oJob.oArchiveTask
+        if oTask is not None and oTask.sStatus == 'error' and sStatus == 'ok':
+            self.sStatus = 'failed'
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        return self.sMessage
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        ''' As the JSON result of setup-cli install.
+        '''
+        oJob = self.oJob
+        dResult = {'command': 'install', 'status': self.sStatus, 'message': self.sMessage,\
+                   'source': str(oJob.sSourceDir), 'target': oJob.sInstallDir, 'backup': oJob.sBackupDir,\
+                   'conflicts': oJob.lConflicts, 'seconds': round(self.fSeconds, 3)}
+        if oJob.oVerifyReport is not None:
+            dResult['verify'] = oJob.oVerifyReport.getSummary()
+        if self.oPreflight is not None:
+            dResult['preflight'] = self.oPreflight.toDict()
+        if oJob.oBackupMove is not None:
+            dResult['backup_move'] = oJob.oBackupMove.toDict()
+        if oJob.oArchiveTask is not None:
+            dResult['archive'] = oJob.oArchiveTask.toDict()
+        dResult['perf_log'] = oJob.oPerfLog.sPath
+        return dResult
+
+
+##########################################################################
+#
+# _ProgressForwarder
+#
+##########################################################################
+class _ProgressForwarder():
+    ''' CopyProgress callback that posts a ProgressEvent to the event loop's queue
+        at most every fPROGRESS_INTERVAL seconds (and after the last file).
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, oLoop, oQueue, sTarget):
+        self.oLoop = oLoop
+        self.oQueue = oQueue
+        self.sTarget = sTarget
+        self.fLast = 0.0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, oProgress):
+        fNow = time.monotonic()
+        if fNow - self.fLast < fPROGRESS_INTERVAL and oProgress.iFilesDone < oProgress.iFilesTotal:
+            return
+        self.fLast = fNow
+        oEvent = ProgressEvent(sEVENT_PROGRESS, sOPERATION_INSTALL, self.sTarget, oProgress)
+        try:
+            self.oLoop.call_soon_threadsafe(self.oQueue.put_nowait, oEvent)
+        except RuntimeError:
+            # the event loop was closed under a cancelled install - nobody is listening
+            pass
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def makeInstallJob(sSourceDir, sInstallDir, sBackup=sBACKUP_RENAME, **dOptions):
+    ''' InstallJob for an install of sSourceDir (project folder or release archive)
+        into sInstallDir, set up as setup-cli install would: an existing install
+        (unless it is an interrupted in-place copy) is moved to a .BAK backup,
+        or archived. An incremental install is never moved to a .BAK backup.
+        Returns (job, whether the install is moved to a backup - for
+        runPreflight). Raises TypeError for an unknown option.
+    '''
+    if sBackup not in lBACKUP_MODES:
+        raise ValueError("Unknown backup mode '%s' - use one of: %s" % (sBackup, ", ".join(lBACKUP_MODES)))
+    for sOption in dOptions:
+        if sOption not in lINSTALL_OPTIONS:
+            raise TypeError("Unknown install option '%s'" % sOption)
+
+    sInstallDir = os.path.abspath(sInstallDir)
+    oJob = InstallJob(sSourceDir, sInstallDir)
+    for sOption, oValue in dOptions.items():
+        setattr(oJob, sOption, oValue)
+
+    # an interrupted in-place copy is resumed, not backed up
+    bExisting = os.path.isdir(sInstallDir) and len(os.listdir(sInstallDir)) > 0 \
+                and not (isPartialInstall(sInstallDir) and not oJob.bIncremental)
+    # an incremental install updates the install in place - renaming it away would
+    # leave every file to be copied again
+    bBackup = bExisting and sBackup == sBACKUP_RENAME and not oJob.bIncremental
+    oJob.bArchiveBackup = bExisting and sBackup == sBACKUP_ARCHIVE
+    if bBackup:
+        # the job moves the install to the backup (copied if the backup is on another drive) -
+        # first, or for a staged install once the new install is ready to swap in
+        oJob.sBackupDir = getBackupPath(sInstallDir, sBackupRoot=oJob.sBackupRoot)
+        oJob.bMoveToBackup = True
+    return oJob, bBackup
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _runJob(oJob):
+    ''' InstallJob.run on an executor thread: (status, message, error); other
+        errors are raised.
+    '''
+    try:
+        return ('ok', oJob.run(), None)
+    except CopyCancelled:
+        oProgress = oJob.oProgress
+        return ('cancelled', "Install cancelled after %d of %d files" % (oProgress.iFilesDone, oProgress.iFilesTotal),\
+                None)
+    except BackupMoveError as oError:
+        return ('failed', "Backup failed - " + str(oError), oError)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+async def jobEvents(oJob, bBackup=False, bPreflight=True, bWaitForArchive=True, oExecutor=None):
+    ''' Run an InstallJob (eg. from makeInstallJob) and yield its ProgressEvents,
+        ending with 'done'. bPreflight: check free space first (raises PreflightError).
+        bWaitForArchive: wait for an archive backup built after the install.
+        The job's progress callback is replaced.
+    '''
+    oLoop = asyncio.get_running_loop()
+    oQueue = asyncio.Queue()
+    oJob.oProgress.fnCallback = _ProgressForwarder(oLoop, oQueue, oJob.sInstallDir)
+    fStart = time.perf_counter()
+    oFuture = None
+
+    yield ProgressEvent(sEVENT_START, sOPERATION_INSTALL, oJob.sInstallDir, sText="Installing " + str(oJob.sSourceDir))
+    try:
+        oPreflight = None
+        if bPreflight:
+            oFuture = oLoop.run_in_executor(oExecutor, runPreflight, oJob, bBackup)
+            oPreflight = await asyncio.shield(oFuture)
+            if not oPreflight.isGo():
+                raise PreflightError(oPreflight)
+
+        oFuture = oLoop.run_in_executor(oExecutor, _runJob, oJob)
+        # queued after the progress events posted by the job's threads
+        oFuture.add_done_callback(lambda _: oQueue.put_nowait(None))
+        while True:
+            oEvent = await oQueue.get()
+            if oEvent is None:
+                break
+            yield oEvent
+        sStatus, sMsg, oError = oFuture.result()
+
+        oTask = oJob.oArchiveTask
+        if bWaitForArchive and oTask is not None and oTask.isRunning():
+            yield ProgressEvent(sEVENT_ARCHIVING, sOPERATION_INSTALL, oJob.sInstallDir, sText=oTask.getSummary())
+            oFuture = oLoop.run_in_executor(oExecutor, oTask.wait)
+            await asyncio.shield(oFuture)
+            sMsg = sMsg + " - " + oTask.getSummary()
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # stop between files and wait for the copy thread, so the caller never
+        # sees an install that is still being written
+        oJob.cancel()
+        if oJob.oArchiveTask is not None:
+            oJob.oArchiveTask.cancel()
+        if oFuture is not None and not oFuture.done():
+            await asyncio.wait([oFuture])
+        raise
+
+    oResult = InstallResult(oJob, sStatus, sMsg, time.perf_counter() - fStart, oPreflight, oError)
+    yield ProgressEvent(sEVENT_DONE, sOPERATION_INSTALL, oJob.sInstallDir, oJob.oProgress, sMsg, oResult)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def installEvents(sSourceDir, sInstallDir, sBackup=sBACKUP_RENAME, bPreflight=True, oExecutor=None, **dOptions):
+    ''' Async iterator of the ProgressEvents of an install (see jobEvents).
+    '''
+    oJob, bBackup = makeInstallJob(sSourceDir, sInstallDir, sBackup, **dOptions)
+    return jobEvents(oJob, bBackup, bPreflight, oExecutor=oExecutor)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+async def install(sSourceDir, sInstallDir, sBackup=sBACKUP_RENAME, bPreflight=True, fnOnEvent=None, oExecutor=None,\
+                  **dOptions):
+    ''' Install sSourceDir into sInstallDir; fnOnEvent (if set) is called on the
+        event loop with every ProgressEvent. Returns the InstallResult.
+    '''
+    oResult = None
+    async with aclosing(installEvents(sSourceDir, sInstallDir, sBackup, bPreflight, oExecutor, **dOptions)) as itEvents:
+        async for oEvent in itEvents:
+            if fnOnEvent is not None:
+                fnOnEvent(oEvent)
+            oResult = oEvent.oResult
+    return oResult
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+async def connect(sModulePath, lSlicerRoots=None, bRescan=False, fnOnEvent=None, oExecutor=None, oIniLocks=None):
+    ''' Connect the Image Quizzer install sModulePath to the Slicer installs below
+        lSlicerRoots (default: next to the install and the usual install folders).
+        Returns the connectAll results; raises SlicerConnectError as connectAll.
+        Concurrent connects that may reach the same Slicer install share oIniLocks.
+    '''
+    oLoop = asyncio.get_running_loop()
+    sModulePath = os.path.abspath(sModulePath)
+    if fnOnEvent is not None:
+        fnOnEvent(ProgressEvent(sEVENT_START, sOPERATION_CONNECT, sModulePath, sText="Connecting " + sModulePath))
+    if not lSlicerRoots:
+        lSlicerRoots = getDefaultRoots(sModulePath)
+    oFuture = oLoop.run_in_executor(oExecutor, connectAll, sModulePath, lSlicerRoots, bRescan,\
+                                    iDEFAULT_DEPTH, None, oIniLocks)
+    try:
+        lResults = await asyncio.shield(oFuture)
+    except asyncio.CancelledError:
+        # the ini files are rewritten in place - let a started connect finish
+        await asyncio.wait([oFuture])
+        raise
+    if fnOnEvent is not None:
+        iFailed = sum(1 for dIni in lResults if dIni['error'])
+        iConnected = sum(1 for dIni in lResults if dIni['ini'] is not None) - iFailed
+        sText = "%d settings file(s) connected" % iConnected + (", %d failed" % iFailed if iFailed else "")
+        fnOnEvent(ProgressEvent(sEVENT_DONE, sOPERATION_CONNECT, sModulePath, sText=sText, oResult=lResults))
+    return lResults
+
+
+##########################################################################
+#
+# SetupSession
+#
+##########################################################################
+class SetupSession():
+    ''' Runs many installs and connects in parallel, at most iMaxInstalls installs
+        and iMaxConnects connects at a time, on a thread pool of its own. Connects
+        that reach the same Slicer-xxxx.ini file rewrite it one at a time.
+        fnOnEvent (if set) receives the ProgressEvents of every operation.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, iMaxInstalls=iDEFAULT_MAX_INSTALLS, iMaxConnects=iDEFAULT_MAX_CONNECTS, fnOnEvent=None):
+        self.fnOnEvent = fnOnEvent
+        self.oInstallSlots = asyncio.Semaphore(iMaxInstalls)
+        self.oConnectSlots = asyncio.Semaphore(iMaxConnects)
+        # an operation uses one thread at a time (its archive task has a thread of its own)
+        self.oExecutor = ThreadPoolExecutor(max_workers=iMaxInstalls + iMaxConnects, thread_name_prefix='iq-api')
+        self.setActiveTargets = set()
+        self.oIniLocks = IniLocks()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    async def __aenter__(self):
+        return self
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    async def __aexit__(self, oType, oValue, oTraceback):
+        self.close()
+        return False
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        ''' Release the thread pool once the operations have finished.
+        '''
+        self.oExecutor.shutdown(wait=False)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _onEvent(self, fnOnEvent):
+        if fnOnEvent is None:
+            return self.fnOnEvent
+        if self.fnOnEvent is None:
+            return fnOnEvent
+
+        def _both(oEvent):
+            self.fnOnEvent(oEvent)
+            fnOnEvent(oEvent)
+        return _both
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    async def install(self, sSourceDir, sInstallDir, sBackup=sBACKUP_RENAME, bPreflight=True, fnOnEvent=None,\
+                      **dOptions):
+        ''' As install(), once an install slot is free. Raises ValueError if
+            sInstallDir is already being installed by this session.
+        '''
+        sKey = os.path.normcase(os.path.abspath(sInstallDir))
+        if sKey in self.setActiveTargets:
+            raise ValueError("Already installing into " + sInstallDir)
+        self.setActiveTargets.add(sKey)
+        try:
+            async with self.oInstallSlots:
+                return await install(sSourceDir, sInstallDir, sBackup, bPreflight, self._onEvent(fnOnEvent),\
+                                     self.oExecutor, **dOptions)
+        finally:
+            self.setActiveTargets.discard(sKey)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    async def connect(self, sModulePath, lSlicerRoots=None, bRescan=False, fnOnEvent=None):
+        ''' As connect(), once a connect slot is free.
+        '''
+        async with self.oConnectSlots:
+            return await connect(sModulePath, lSlicerRoots, bRescan, self._onEvent(fnOnEvent), self.oExecutor,\
+                                 self.oIniLocks)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    async def gather(self, lCoroutines):
+        ''' Results of the operations in order; an operation that raised gives its
+            exception instead, so one failed workstation does not stop the others.
+        '''
+        return await asyncio.gather(*lCoroutines, return_exceptions=True)
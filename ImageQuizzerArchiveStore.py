@@ -0,0 +1,590 @@
+'''
+    Archive backups for the Baines Image Quizzer install manager.
+
+    A .BAK folder (see ImageQuizzerBackup.py) is a full, uncompressed copy of the
+    install that takes up disk space until someone deletes it by hand. An archive
+    backup keeps only what cannot be downloaded again - the Inputs and Outputs
+    folders - in a content-addressed store next to the install (or in the backup
+    folder):
+
+        <install name>.iq-archive/
+            chunks/<ab>/<hash>                  compressed pieces of files
+            snapshots/<yyyymmdd-hhmmss>.json    one per backup: its files and their chunks
+
+    Files are cut into iCHUNK_SIZE chunks named by their BLAKE2b hash. A chunk that
+    is already in the store is not written again, so each upgrade only adds the
+    reader results (and inputs) that changed since an earlier snapshot; files with
+    the size and modification time recorded in the newest snapshot are not even
+    read. Chunks are compressed with zlib, or stored as they are when that does not
+    make them smaller.
+
+    The chunks are fixed-size rather than content-defined: the results that change
+    between upgrades are small files that Image Quizzer writes whole, and a rolling
+    hash in Python would be far slower than hashlib on gigabytes of image data.
+
+    Chunks are hashed, compressed and written by a pool of worker threads (hashlib
+    and zlib release the GIL). The install job builds the archive on a background
+    thread (ArchiveTask) once the new install is in place; the previous install is
+    kept in its .PRESERVE- folder until its snapshot has been written. A snapshot
+    file is written last, through a temporary file, so an interrupted archive leaves
+    no snapshot - only unreferenced chunks, removed by the next prune.
+
+    Usage:      >> setup-cli install --source ... --target <install folder> --backup archive
+                >> setup-cli restore <install folder> [--snapshot <name>] [--into <folder>] [--list]
+
+    This module is imported by ImageQuizzerInstallJob.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import os
+import json
+import hashlib
+import shutil
+import stat
+import threading
+import time
+import zlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageQuizzerCopyEngine import scanTree, CopyCancelled, iDEFAULT_WORKERS, iMTIME_TOLERANCE_NS
+from ImageQuizzerBackup import lUSER_DATA_DIRS, sBACKUP_DATETIME_FORMAT
+from ImageQuizzerPerfLog import PerfLog
+
+
+sSTORE_SUFFIX = '.iq-archive'
+sSNAPSHOT_FORMAT = 'iq-archive'
+iSNAPSHOT_VERSION = 1
+
+iCHUNK_SIZE = 1024 * 1024
+iCOMPRESS_LEVEL = 6
+iHASH_DIGEST_SIZE = 20          # bytes of the BLAKE2b chunk names
+
+# first byte of a chunk file
+bytesCHUNK_ZLIB = b'z'
+bytesCHUNK_STORED = b's'
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getStorePath(sInstallDir, sBackupRoot=None):
+    ''' Archive store of the install, in sBackupRoot or next to the install.
+    '''
+    sInstallDir = os.path.abspath(str(sInstallDir))
+    if sBackupRoot is None:
+        sRootDir = os.path.dirname(sInstallDir)
+    else:
+        sRootDir = os.path.abspath(str(sBackupRoot))
+    return os.path.join(sRootDir, os.path.basename(sInstallDir) + sSTORE_SUFFIX)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _hashChunk(bytesChunk):
+    return hashlib.blake2b(bytesChunk, digest_size=iHASH_DIGEST_SIZE).hexdigest()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _onRemoveError(fnFunc, sPath, tupExcInfo):
+    os.chmod(sPath, stat.S_IWRITE)
+    fnFunc(sPath)
+
+
+##########################################################################
+#
+# ArchiveStoreError
+#
+##########################################################################
+class ArchiveStoreError(Exception):
+    ''' A snapshot or chunk of the archive store is missing or damaged.
+    '''
+    pass
+
+
+##########################################################################
+#
+# ArchiveResult
+#
+##########################################################################
+class ArchiveResult():
+    ''' Files of one new snapshot and what had to be stored for it.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sSnapshot):
+        self.sSnapshot = sSnapshot
+        self.iFiles = 0
+        self.iBytes = 0
+        self.iFilesRead = 0         # new or changed since the newest snapshot
+        self.iBytesRead = 0
+        self.iChunksAdded = 0
+        self.iBytesStored = 0       # compressed bytes added to the store
+        self.fSeconds = 0.0
+        self.oLock = threading.Lock()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        return "archive snapshot %s: %d files (%.1f MB), %d new or changed, %.1f MB added to the store in %.1f s" \
+                    % (self.sSnapshot, self.iFiles, self.iBytes / 1e6, self.iFilesRead, self.iBytesStored / 1e6,\
+                       self.fSeconds)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        return {'snapshot': self.sSnapshot, 'files': self.iFiles, 'bytes': self.iBytes,\
+                'files_read': self.iFilesRead, 'bytes_read': self.iBytesRead, 'chunks_added': self.iChunksAdded,\
+                'bytes_stored': self.iBytesStored, 'seconds': round(self.fSeconds, 3)}
+
+
+##########################################################################
+#
+# RestoreResult
+#
+##########################################################################
+class RestoreResult():
+    ''' Files written by a restore, and the files left alone because they differ.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sSnapshot, sTargetDir):
+        self.sSnapshot = sSnapshot
+        self.sTargetDir = sTargetDir
+        self.iFiles = 0
+        self.iFilesRestored = 0
+        self.iBytesRestored = 0
+        self.lConflicts = []        # existing files that differ from the snapshot (kept)
+        self.fSeconds = 0.0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        sSummary = "Restored %d of %d files (%.1f MB) from archive snapshot %s into %s in %.1f s" \
+                    % (self.iFilesRestored, self.iFiles, self.iBytesRestored / 1e6, self.sSnapshot, self.sTargetDir,\
+                       self.fSeconds)
+        if self.lConflicts:
+            sSummary = sSummary + " - %d existing file(s) differ and were kept" % len(self.lConflicts)
+        return sSummary
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        return {'snapshot': self.sSnapshot, 'target': self.sTargetDir, 'files': self.iFiles,\
+                'files_restored': self.iFilesRestored, 'bytes_restored': self.iBytesRestored,\
+                'conflicts': self.lConflicts, 'seconds': round(self.fSeconds, 3)}
+
+
+##########################################################################
+#
+# ArchiveStore
+#
+##########################################################################
+class ArchiveStore():
+    ''' Content-addressed, compressed store of snapshots of an install's user data.
+        cancel() may be called from any thread; a running archive or restore then
+        raises CopyCancelled.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sStorePath, iWorkers=iDEFAULT_WORKERS):
+        self.sStorePath = sStorePath
+        self.sChunkDir = os.path.join(sStorePath, 'chunks')
+        self.sSnapshotDir = os.path.join(sStorePath, 'snapshots')
+        self.iWorkers = max(1, iWorkers)
+        self.oCancelEvent = threading.Event()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancel(self):
+        self.oCancelEvent.set()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _checkCancel(self):
+        if self.oCancelEvent.is_set():
+            raise CopyCancelled()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def listSnapshots(self):
+        ''' Snapshot names, oldest first.
+        '''
+        if not os.path.isdir(self.sSnapshotDir):
+            return []
+        return sorted(sName[:-len('.json')] for sName in os.listdir(self.sSnapshotDir) if sName.endswith('.json'))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getLatestSnapshot(self):
+        lSnapshots = self.listSnapshots()
+        if lSnapshots:
+            return lSnapshots[-1]
+        return None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def loadSnapshot(self, sName):
+        ''' The snapshot's dict: 'files' maps '/' separated paths (relative to the
+            install) to [size, mtime_ns, [chunk hashes]]; 'dirs' lists the folders.
+        '''
+        try:
+            with open(self._getSnapshotPath(sName), 'r', encoding='utf-8') as fIn:
+                dSnapshot = json.load(fIn)
+        except (OSError, ValueError) as oError:
+            raise ArchiveStoreError("Cannot read archive snapshot " + sName + ": " + str(oError))
+        if dSnapshot.get('format') != sSNAPSHOT_FORMAT or dSnapshot.get('version') != iSNAPSHOT_VERSION:
+            raise ArchiveStoreError("Not an archive snapshot (or a newer version): " + sName)
+        return dSnapshot
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getStoredBytes(self):
+        ''' (chunks, bytes) held by the store - shared by all snapshots.
+        '''
+        iChunks = 0
+        iBytes = 0
+        dFiles, _ = scanTree(self.sChunkDir)
+        for iSize, _ in dFiles.values():
+            iChunks += 1
+            iBytes += iSize
+        return iChunks, iBytes
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getSnapshotPath(self, sName):
+        return os.path.join(self.sSnapshotDir, sName + '.json')
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getChunkPath(self, sHash):
+        return os.path.join(self.sChunkDir, sHash[:2], sHash)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _putChunk(self, bytesChunk):
+        ''' Store the chunk unless it is already there. Returns (hash, bytes written).
+        '''
+        sHash = _hashChunk(bytesChunk)
+        sPath = self._getChunkPath(sHash)
+        if os.path.exists(sPath):
+            return sHash, 0
+
+        bytesCompressed = zlib.compress(bytesChunk, iCOMPRESS_LEVEL)
+        if len(bytesCompressed) < len(bytesChunk):
+            bytesStored = bytesCHUNK_ZLIB + bytesCompressed
+        else:
+            bytesStored = bytesCHUNK_STORED + bytesChunk
+
+        # a chunk only appears under its name once it is complete
+        os.makedirs(os.path.dirname(sPath), exist_ok=True)
+        sTempPath = '%s.%d.tmp' % (sPath, threading.get_ident())
+        with open(sTempPath, 'wb') as fOut:
+            fOut.write(bytesStored)
+        os.replace(sTempPath, sPath)
+        return sHash, len(bytesStored)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getChunk(self, sHash):
+        ''' Uncompressed chunk, checked against its hash.
+        '''
+        try:
+            with open(self._getChunkPath(sHash), 'rb') as fIn:
+                bytesStored = fIn.read()
+        except OSError:
+            raise ArchiveStoreError("Chunk missing from the archive: " + sHash)
+
+        try:
+            if bytesStored[:1] == bytesCHUNK_ZLIB:
+                bytesChunk = zlib.decompress(bytesStored[1:])
+            elif bytesStored[:1] == bytesCHUNK_STORED:
+                bytesChunk = bytesStored[1:]
+            else:
+                bytesChunk = None
+        except zlib.error:
+            bytesChunk = None
+        if bytesChunk is None or _hashChunk(bytesChunk) != sHash:
+            raise ArchiveStoreError("Damaged chunk in the archive: " + sHash)
+        return bytesChunk
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def archive(self, sSourceDir, lDirs=None):
+        ''' Add a snapshot of the lDirs folders (default Inputs and Outputs) of
+            sSourceDir. Returns an ArchiveResult.
+        '''
+        if lDirs is None:
+            lDirs = lUSER_DATA_DIRS
+        fStart = time.perf_counter()
+
+        sName = datetime.today().strftime(sBACKUP_DATETIME_FORMAT)
+        lSnapshots = self.listSnapshots()
+        iSuffix = 1
+        while sName in lSnapshots:
+            iSuffix += 1
+            sName = datetime.today().strftime(sBACKUP_DATETIME_FORMAT) + '-%d' % iSuffix
+        oResult = ArchiveResult(sName)
+
+        dPrevious = {}
+        if lSnapshots:
+            try:
+                dPrevious = self.loadSnapshot(lSnapshots[-1])['files']
+            except ArchiveStoreError:
+                pass    # every file is read - chunks already stored are still not written again
+
+        dFiles = {}
+        lArchiveDirs = []
+        for sDir in lDirs:
+            sDirPath = os.path.join(sSourceDir, sDir)
+            if not os.path.isdir(sDirPath):
+                continue
+            dDirFiles, lSubDirs = scanTree(sDirPath)
+            lArchiveDirs.append(sDir)
+            lArchiveDirs.extend(sDir + '/' + sSubDir.replace(os.sep, '/') for sSubDir in lSubDirs)
+            for sRelPath, tupStat in dDirFiles.items():
+                dFiles[sDir + '/' + sRelPath.replace(os.sep, '/')] = tupStat
+
+        dEntries = {}
+        lToRead = []
+        for sRelPath, (iSize, iMtime) in dFiles.items():
+            lPrevious = dPrevious.get(sRelPath)
+            if lPrevious is not None and lPrevious[0] == iSize and lPrevious[1] == iMtime:
+                dEntries[sRelPath] = lPrevious
+            else:
+                lToRead.append(sRelPath)
+
+        # largest files first so one large volume does not finish last on its own
+        lToRead.sort(key=lambda sRelPath: dFiles[sRelPath][0], reverse=True)
+        with ThreadPoolExecutor(max_workers=self.iWorkers) as oPool:
+            for sRelPath, lEntry in zip(lToRead, oPool.map(lambda sRel: self._archiveFile(sSourceDir, sRel, oResult),\
+                                                               lToRead)):
+                dEntries[sRelPath] = lEntry
+
+        self._checkCancel()
+        oResult.iFiles = len(dEntries)
+        oResult.iBytes = sum(lEntry[0] for lEntry in dEntries.values())
+        dSnapshot = {'format': sSNAPSHOT_FORMAT, 'version': iSNAPSHOT_VERSION,\
+                     'time': datetime.today().isoformat(timespec='seconds'), 'source': os.path.abspath(sSourceDir),\
+                     'chunk_size': iCHUNK_SIZE, 'dirs': lArchiveDirs, 'files': dEntries}
+        os.makedirs(self.sSnapshotDir, exist_ok=True)
+        sTempPath = self._getSnapshotPath(sName) + '.tmp'
+        with open(sTempPath, 'w', encoding='utf-8') as fOut:
+            json.dump(dSnapshot, fOut, separators=(',', ':'))
+        os.replace(sTempPath, self._getSnapshotPath(sName))
+
+        oResult.fSeconds = time.perf_counter() - fStart
+        return oResult
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _archiveFile(self, sSourceDir, sRelPath, oResult):
+        ''' Store the chunks of one file. Returns its snapshot entry [size, mtime_ns, hashes];
+            size and time are those of the file as read.
+        '''
+        self._checkCancel()
+        lHashes = []
+        iSize = 0
+        iBytesStored = 0
+        with open(os.path.join(sSourceDir, *sRelPath.split('/')), 'rb') as fIn:
+            iMtime = os.fstat(fIn.fileno()).st_mtime_ns
+            while True:
+                bytesChunk = fIn.read(iCHUNK_SIZE)
+                if not bytesChunk:
+                    break
+                self._checkCancel()
+                sHash, iStored = self._putChunk(bytesChunk)
+                lHashes.append(sHash)
+                iSize += len(bytesChunk)
+                if iStored:
+                    iBytesStored += iStored
+                    with oResult.oLock:
+                        oResult.iChunksAdded += 1
+
+        with oResult.oLock:
+            oResult.iFilesRead += 1
+            oResult.iBytesRead += iSize
+            oResult.iBytesStored += iBytesStored
+        return [iSize, iMtime, lHashes]
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def restore(self, sTargetDir, sName=None, bOverwrite=False):
+        ''' Write the files of snapshot sName (default the newest) into sTargetDir.
+            Files already there with the snapshot's size and modification time are
+            skipped. Other existing files are kept and listed as conflicts, unless
+            bOverwrite. Returns a RestoreResult.
+        '''
+        fStart = time.perf_counter()
+        if sName is None:
+            sName = self.getLatestSnapshot()
+            if sName is None:
+                raise ArchiveStoreError("No archive snapshots in " + self.sStorePath)
+        dSnapshot = self.loadSnapshot(sName)
+        oResult = RestoreResult(sName, sTargetDir)
+        oResult.iFiles = len(dSnapshot['files'])
+
+        for sDir in dSnapshot.get('dirs', []):
+            os.makedirs(os.path.join(sTargetDir, *sDir.split('/')), exist_ok=True)
+
+        lToWrite = []
+        for sRelPath, (iSize, iMtime, _) in sorted(dSnapshot['files'].items()):
+            try:
+                oStat = os.stat(os.path.join(sTargetDir, *sRelPath.split('/')))
+            except OSError:
+                lToWrite.append(sRelPath)
+                continue
+            if oStat.st_size == iSize and abs(oStat.st_mtime_ns - iMtime) <= iMTIME_TOLERANCE_NS:
+                continue
+            if bOverwrite:
+                lToWrite.append(sRelPath)
+            else:
+                oResult.lConflicts.append(sRelPath)
+
+        with ThreadPoolExecutor(max_workers=self.iWorkers) as oPool:
+            for iSize in oPool.map(lambda sRel: self._restoreFile(sTargetDir, sRel, dSnapshot['files'][sRel]), lToWrite):
+                oResult.iFilesRestored += 1
+                oResult.iBytesRestored += iSize
+
+        oResult.fSeconds = time.perf_counter() - fStart
+        return oResult
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _restoreFile(self, sTargetDir, sRelPath, lEntry):
+        ''' Rebuild one file through a temporary file, so an existing file is only
+            replaced once its archived version is complete. Returns its size.
+        '''
+        self._checkCancel()
+        iSize, iMtime, lHashes = lEntry
+        sPath = os.path.join(sTargetDir, *sRelPath.split('/'))
+        sTempPath = sPath + '.iq-restore.tmp'
+        try:
+            with open(sTempPath, 'wb') as fOut:
+                for sHash in lHashes:
+                    self._checkCancel()
+                    fOut.write(self._getChunk(sHash))
+            os.utime(sTempPath, ns=(iMtime, iMtime))
+            os.replace(sTempPath, sPath)
+        except BaseException:
+            try:
+                os.remove(sTempPath)
+            except OSError:
+                pass
+            raise
+        return iSize
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def prune(self, iKeep):
+        ''' Delete all but the newest iKeep snapshots and the chunks no other
+            snapshot uses. Returns the names of the deleted snapshots.
+        '''
+        if iKeep is None or iKeep <= 0:
+            return []
+
+        lRemove = self.listSnapshots()[:-iKeep]
+        for sName in lRemove:
+            os.remove(self._getSnapshotPath(sName))
+        if lRemove:
+            self.collectGarbage()
+        return lRemove
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def collectGarbage(self):
+        ''' Delete chunks that no snapshot refers to (left by pruned snapshots or an
+            interrupted archive). Returns the number of chunk files removed.
+            Raises ArchiveStoreError, without deleting anything, if a snapshot cannot be read.
+        '''
+        setUsed = set()
+        for sName in self.listSnapshots():
+            for _, _, lHashes in self.loadSnapshot(sName)['files'].values():
+                setUsed.update(lHashes)
+
+        iRemoved = 0
+        dChunkFiles, _ = scanTree(self.sChunkDir)
+        for sRelPath in dChunkFiles:
+            if os.path.basename(sRelPath) not in setUsed:
+                os.remove(os.path.join(self.sChunkDir, sRelPath))
+                iRemoved += 1
+        return iRemoved
+
+
+##########################################################################
+#
+# ArchiveTask
+#
+##########################################################################
+class ArchiveTask():
+    ''' Archive the user data of sSourceDir into the store, prune the store to
+        iKeep snapshots, then delete sRemoveDir (the previous install, kept until
+        its user data is safe). start() runs this on a background thread;
+        run() runs it on the calling thread.
+
+        A failed or cancelled archive leaves sRemoveDir in place.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, oStore, sSourceDir, sRemoveDir=None, iKeep=None, oPerfLog=None):
+        self.oStore = oStore
+        self.sSourceDir = sSourceDir
+        self.sRemoveDir = sRemoveDir
+        self.iKeep = iKeep
+        self.oPerfLog = oPerfLog if oPerfLog is not None else PerfLog()
+
+        self.sStatus = None         # 'ok', 'cancelled' or 'error' once done
+        self.oResult = None
+        self.lPruned = []
+        self.oError = None
+        self.oThread = None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def start(self):
+        ''' Run on a background thread, timed in a perf log session of its own.
+        '''
+        self.oThread = threading.Thread(target=self._runInBackground, name='iq-archive')
+        self.oThread.start()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _runInBackground(self):
+        try:
+            self.run()
+        finally:
+            self.oPerfLog.close(self.sStatus)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        ''' Never raises - the outcome is in sStatus, oResult and oError.
+        '''
+        try:
+            with self.oPerfLog.phase('archive') as dPhase:
+                self.oResult = self.oStore.archive(self.sSourceDir)
+                dPhase.update(files=self.oResult.iFilesRead, bytes=self.oResult.iBytesRead,\
+                              stored=self.oResult.iBytesStored, snapshot=self.oResult.sSnapshot)
+            self.lPruned = self.oStore.prune(self.iKeep)
+            if self.sRemoveDir is not None:
+                with self.oPerfLog.phase('delete', dirs=1):
+                    shutil.rmtree(self.sRemoveDir, onerror=_onRemoveError)
+            self.sStatus = 'ok'
+        except CopyCancelled:
+            self.sStatus = 'cancelled'
+        except Exception as oError:
+            self.oError = oError
+            self.sStatus = 'error'
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isDone(self):
+        return self.sStatus is not None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isRunning(self):
+        return self.oThread is not None and self.oThread.is_alive()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def wait(self, fTimeout=None):
+        ''' Wait for a started task. Returns True once it is done.
+        '''
+        if self.oThread is not None:
+            self.oThread.join(fTimeout)
+        return self.isDone()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancel(self):
+        self.oStore.cancel()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        if self.sStatus is None:
+            return "Inputs and Outputs of the previous install are being archived"
+        sKept = ""
+        if self.sRemoveDir is not None and os.path.isdir(self.sRemoveDir):
+            sKept = " - the previous install was kept in " + self.sRemoveDir
+        if self.sStatus == 'cancelled':
+            return "backup archive cancelled" + sKept
+        if self.sStatus == 'error':
+            return "backup archive failed (" + str(self.oError).split('\n', 1)[0] + ")" + sKept
+
+        sSummary = self.oResult.getSummary()
+        if self.lPruned:
+            sSummary = sSummary + ", %d old snapshot(s) removed" % len(self.lPruned)
+        return sSummary
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        dTask = {'status': self.sStatus, 'store': self.oStore.sStorePath, 'pruned': self.lPruned,\
+                 'error': str(self.oError) if self.oError is not None else None}
+        if self.oResult is not None:
+            dTask.update(self.oResult.toDict())
+        return dTask
@@ -0,0 +1,389 @@
+'''
+    Backup snapshots for the Baines Image Quizzer install manager.
+
+    A backup of an existing install is a sibling folder named
+    <install name>.BAK-<yyyymmdd-hhmmss>. It is created by renaming the install,
+    which costs no space or copying. In snapshot mode the new install is then
+    built with hard links to every file that is unchanged since that snapshot,
+    so several backups on a USB stick share the unchanged code and image data
+    instead of holding full copies.
+
+    Backups may also be kept in another folder (sBackupRoot), eg. on the local disk
+    for an install on a USB stick. A rename cannot cross volumes (EXDEV), so then
+    moveToBackup streams the install across with the zero-copy engine into a
+    '<backup>.partial' folder, checks every file's size, renames it into place and
+    only then deletes the install. A failed or cancelled move removes the partial
+    copy and leaves the install as it was.
+
+    A retention policy keeps only the newest backups and deletes the older ones.
+
+    To preserve user data, the Inputs and Outputs folders of the previous install
+    are moved into the new install with same-volume renames rather than copied.
+    A whole folder that does not exist in the new install is moved with a single
+    rename, so carrying gigabytes of reader results across is close to instant.
+
+    This module is imported by ImageQuizzerInstallManager.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import os
+import errno
+import re
+import shutil
+import stat
+import time
+from datetime import datetime
+
+from ImageQuizzerCopyEngine import createCopyEngine, scanTree, iMTIME_TOLERANCE_NS, iDEFAULT_WORKERS, \
+                                  sBACKEND_ZEROCOPY, sJOURNAL_NAME, setINTERNAL_FILES
+from ImageQuizzerPerfLog import PerfLog
+
+
+sBACKUP_SUFFIX = '.BAK-'
+sBACKUP_DATETIME_FORMAT = '%Y%m%d-%H%M%S'
+sPRESERVE_SUFFIX = '.PRESERVE-'
+sPARTIAL_SUFFIX = '.partial'
+sBACKUP_PROGRESS_LABEL = "Backing up"
+
+lUSER_DATA_DIRS = ['Inputs', 'Outputs']
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getBackupPath(sInstallDir, oDatetime=None, sBackupRoot=None):
+    ''' Return the backup folder path for the install at the given time (default now),
+        in sBackupRoot or next to the install. A '-N' suffix is added if a backup
+        was already made in the same second.
+    '''
+    if oDatetime is None:
+        oDatetime = datetime.today()
+    sInstallDir = os.path.abspath(str(sInstallDir))
+    return _getFreePath(os.path.join(_getBackupRoot(sInstallDir, sBackupRoot),\
+                        os.path.basename(sInstallDir) + sBACKUP_SUFFIX + oDatetime.strftime(sBACKUP_DATETIME_FORMAT)))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getFreePath(sBackupDir):
+    sPath = sBackupDir
+    iSuffix = 1
+    while os.path.lexists(sPath) or os.path.lexists(sPath + sPARTIAL_SUFFIX):
+        iSuffix += 1
+        sPath = sBackupDir + '-%d' % iSuffix
+    return sPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getBackupRoot(sInstallDir, sBackupRoot):
+    if sBackupRoot is None:
+        return os.path.dirname(os.path.abspath(str(sInstallDir)))
+    return os.path.abspath(str(sBackupRoot))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isSameVolume(sPath, sOtherPath):
+    ''' True if the two paths (or the nearest folders above them that exist) are
+        on the same filesystem, so one can be renamed to the other.
+    '''
+    return os.stat(_getExistingFolder(sPath)).st_dev == os.stat(_getExistingFolder(sOtherPath)).st_dev
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getExistingFolder(sPath):
+    sPath = os.path.abspath(str(sPath))
+    while not os.path.isdir(sPath) and os.path.dirname(sPath) != sPath:
+        sPath = os.path.dirname(sPath)
+    return sPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getPreservePath(sInstallDir):
+    ''' Return a temporary sibling folder name used to hold the previous install
+        while the new install is copied.
+    '''
+    sInstallDir = os.path.abspath(str(sInstallDir))
+    return os.path.join(os.path.dirname(sInstallDir),\
+                        os.path.basename(sInstallDir) + sPRESERVE_SUFFIX + datetime.today().strftime(sBACKUP_DATETIME_FORMAT))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def listBackups(sInstallDir, sBackupRoot=None):
+    ''' Return the backup folders of the install (in sBackupRoot or next to
+        the install), oldest first.
+    '''
+    sInstallDir = os.path.abspath(str(sInstallDir))
+    sParentDir = _getBackupRoot(sInstallDir, sBackupRoot)
+    if not os.path.isdir(sParentDir):
+        return []
+
+    oPattern = re.compile('^' + re.escape(os.path.basename(sInstallDir) + sBACKUP_SUFFIX) + r'(\d{8}-\d{6})(?:-(\d+))?$')
+    lBackups = []
+    with os.scandir(sParentDir) as itEntries:
+        for oEntry in itEntries:
+            oMatch = oPattern.match(oEntry.name)
+            if oMatch and oEntry.is_dir(follow_symlinks=False):
+                lBackups.append((oMatch.group(1), int(oMatch.group(2) or 1), oEntry.path))
+
+    lBackups.sort()
+    return [sPath for _, _, sPath in lBackups]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getLatestBackup(sInstallDir, sBackupRoot=None):
+    ''' Return the newest backup folder of the install or None.
+    '''
+    lBackups = listBackups(sInstallDir, sBackupRoot)
+    if lBackups:
+        return lBackups[-1]
+    return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def pruneBackups(sInstallDir, iKeep, sBackupRoot=None):
+    ''' Delete all but the newest iKeep backup folders.
+        Files hard-linked into newer snapshots or the install are not freed
+        until their last link is removed.
+
+        Returns the list of deleted folders.
+    '''
+    if iKeep is None or iKeep <= 0:
+        return []
+
+    lBackups = listBackups(sInstallDir, sBackupRoot)
+    lRemove = lBackups[:-iKeep]
+    for sBackupDir in lRemove:
+        shutil.rmtree(sBackupDir, onerror=_onRemoveError)
+    return lRemove
+
+
+##########################################################################
+#
+# BackupMoveError
+#
+##########################################################################
+class BackupMoveError(Exception):
+    ''' The install could not be moved to its backup folder. Unless the message
+        says otherwise, the install was not changed.
+    '''
+    pass
+
+
+##########################################################################
+#
+# BackupMove
+#
+##########################################################################
+class BackupMove():
+    ''' Result of moveToBackup: how the install was moved and, for a copy to
+        another volume, how much was copied and how fast.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sInstallDir, sBackupDir):
+        self.sInstallDir = sInstallDir
+        self.sBackupDir = sBackupDir
+        self.bCrossDevice = False
+        self.iFiles = 0
+        self.iBytes = 0
+        self.fSeconds = 0.0
+        self.dCopyMethods = {}      # copy method -> number of files
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getBytesPerSecond(self):
+        if self.fSeconds <= 0:
+            return 0.0
+        return self.iBytes / self.fSeconds
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        if not self.bCrossDevice:
+            return "existing install renamed to " + os.path.basename(self.sBackupDir)
+        return "existing install moved to %s on another drive (%d files, %.1f MB in %.1f s, %.1f MB/s)" \
+                    % (self.sBackupDir, self.iFiles, self.iBytes / 1e6, self.fSeconds, self.getBytesPerSecond() / 1e6)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        return {'backup': self.sBackupDir, 'cross_device': self.bCrossDevice, 'files': self.iFiles,\
+                'bytes': self.iBytes, 'seconds': round(self.fSeconds, 3),\
+                'mb_per_s': round(self.getBytesPerSecond() / 1e6, 2), 'methods': self.dCopyMethods}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def moveToBackup(sInstallDir, sBackupDir, iWorkers=iDEFAULT_WORKERS, oProgress=None, oCancelEvent=None, oPerfLog=None):
+    ''' Move the install to sBackupDir: a rename on the same volume, otherwise a
+        parallel zero-copy of the tree, checked file by file before the install
+        is deleted. Progress of a copy is reported to oProgress (CopyProgress)
+        and setting oCancelEvent stops it with CopyCancelled.
+
+        If sBackupDir has been taken in the meantime, a '-N' suffix is added
+        (see BackupMove.sBackupDir).
+
+        Returns a BackupMove. Raises BackupMoveError if the rename or copy fails
+        (eg. the backup drive is full) or the copy does not match the install; the
+        install is then left as it was.
+    '''
+    if oPerfLog is None:
+        oPerfLog = PerfLog()
+    sBackupDir = _getFreePath(sBackupDir)
+    oMove = BackupMove(sInstallDir, sBackupDir)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(sBackupDir)), exist_ok=True)
+        with oPerfLog.phase('backup_rename'):
+            os.rename(sInstallDir, sBackupDir)
+        return oMove
+    except OSError as oError:
+        if oError.errno != errno.EXDEV:
+            raise BackupMoveError("The install could not be renamed to " + sBackupDir + " (it was left as it was): "\
+                                  + str(oError))
+
+    oMove.bCrossDevice = True
+    sPartialDir = sBackupDir + sPARTIAL_SUFFIX
+    fStart = time.perf_counter()
+    try:
+        with oPerfLog.phase('backup_copy') as dPhase:
+            _copyToBackup(oMove, sPartialDir, iWorkers, oProgress, oCancelEvent)
+            dPhase.update(files=oMove.iFiles, bytes=oMove.iBytes)
+        os.rename(sPartialDir, sBackupDir)
+    except OSError as oError:
+        shutil.rmtree(sPartialDir, onerror=_onRemoveErrorIgnored)
+        raise BackupMoveError("The install could not be copied to " + sBackupDir + " (it was left as it was): "\
+                              + str(oError))
+    except BaseException:
+        shutil.rmtree(sPartialDir, onerror=_onRemoveErrorIgnored)
+        raise
+    oMove.fSeconds = time.perf_counter() - fStart
+
+    with oPerfLog.phase('backup_delete', files=oMove.iFiles):
+        try:
+            shutil.rmtree(sInstallDir, onerror=_onRemoveError)
+        except OSError as oError:
+            raise BackupMoveError("The backup in " + sBackupDir + " is complete, but the install could not be"\
+                                  " removed: " + str(oError))
+    return oMove
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _copyToBackup(oMove, sPartialDir, iWorkers, oProgress, oCancelEvent):
+    ''' Copy the install into sPartialDir and check that every file arrived with its size.
+    '''
+    sInstallDir = oMove.sInstallDir
+    oEngine = createCopyEngine(sBACKEND_ZEROCOPY, iWorkers=iWorkers)
+    oEngine.sProgressLabel = sBACKUP_PROGRESS_LABEL
+    if oProgress is not None:
+        oEngine.oProgress = oProgress
+    if oCancelEvent is not None:
+        oEngine.oCancelEvent = oCancelEvent
+    oPlan = oEngine.syncTree(sInstallDir, sPartialDir)
+
+    # the engine leaves its own files alone - the manifest of a verified install belongs to the backup
+    for sName in setINTERNAL_FILES - {sJOURNAL_NAME}:
+        if os.path.isfile(os.path.join(sInstallDir, sName)):
+            shutil.copy2(os.path.join(sInstallDir, sName), os.path.join(sPartialDir, sName))
+
+    dInstallFiles, _ = scanTree(sInstallDir)
+    dBackupFiles, _ = scanTree(sPartialDir)
+    dInstallFiles.pop(sJOURNAL_NAME, None)
+    lDiffer = sorted(sRelPath for sRelPath, tupStat in dInstallFiles.items()\
+                     if sRelPath not in dBackupFiles or dBackupFiles[sRelPath][0] != tupStat[0])
+    if lDiffer:
+        raise BackupMoveError("The copy of the install in %s does not match the install (%d file(s) differ, eg. %s)."\
+                              " The install was not changed." % (oMove.sBackupDir, len(lDiffer), lDiffer[0]))
+
+    oMove.iFiles = len(dInstallFiles)
+    oMove.iBytes = sum(iSize for iSize, _ in dInstallFiles.values())
+    oMove.dCopyMethods = oPlan.getMethodCounts()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def linkUserData(sInstallDir, sSnapshotDir, lCopyDirs=None, lDirs=None):
+    ''' Hard-link the user data folders (default Inputs and Outputs) of sInstallDir
+        into sSnapshotDir, to archive them as they were after the install changed.
+        Files below lCopyDirs are copied instead (Image Quizzer rewrites them in place).
+        Raises OSError (eg. on FAT, which has no hard links); the caller removes sSnapshotDir.
+        Returns the number of files.
+    '''
+    if lDirs is None:
+        lDirs = lUSER_DATA_DIRS
+    setCopyDirs = set(lCopyDirs or [])
+
+    iFiles = 0
+    for sDir in lDirs:
+        sDirPath = os.path.join(sInstallDir, sDir)
+        if not os.path.isdir(sDirPath):
+            continue
+        dFiles, lSubDirs = scanTree(sDirPath)
+        for sSubDir in [''] + lSubDirs:
+            os.makedirs(os.path.join(sSnapshotDir, sDir, sSubDir), exist_ok=True)
+        for sRelPath in dFiles:
+            sPath = os.path.join(sDirPath, sRelPath)
+            sSnapshotPath = os.path.join(sSnapshotDir, sDir, sRelPath)
+            if sDir in setCopyDirs:
+                shutil.copy2(sPath, sSnapshotPath)
+            else:
+                os.link(sPath, sSnapshotPath)
+        iFiles += len(dFiles)
+    return iFiles
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def moveUserData(sOldInstallDir, sNewInstallDir, lDirs=None):
+    ''' Move the user data folders (default Inputs and Outputs) of the old install
+        into the new install.
+
+        Folders missing from the new install are moved with one rename. Otherwise
+        their contents are merged entry by entry. Where both installs hold a file
+        of the same name with different contents, the user's file replaces the one
+        from the new release and the path is reported as a conflict.
+
+        Returns the list of conflicting paths (relative to the install).
+    '''
+    if lDirs is None:
+        lDirs = lUSER_DATA_DIRS
+
+    lConflicts = []
+    for sDir in lDirs:
+        sOldPath = os.path.join(sOldInstallDir, sDir)
+        if os.path.isdir(sOldPath):
+            _mergeMove(sOldPath, os.path.join(sNewInstallDir, sDir), sDir, lConflicts)
+    return lConflicts
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _mergeMove(sOldPath, sNewPath, sRelPath, lConflicts):
+
+    if not os.path.lexists(sNewPath):
+        _rename(sOldPath, sNewPath)
+        return
+
+    bOldIsDir = os.path.isdir(sOldPath)
+    bNewIsDir = os.path.isdir(sNewPath)
+
+    if bOldIsDir and bNewIsDir:
+        for sName in os.listdir(sOldPath):
+            _mergeMove(os.path.join(sOldPath, sName), os.path.join(sNewPath, sName),\
+                       os.path.join(sRelPath, sName), lConflicts)
+        return
+
+    if not bOldIsDir and not bNewIsDir:
+        oOldStat = os.stat(sOldPath)
+        oNewStat = os.stat(sNewPath)
+        if oOldStat.st_size == oNewStat.st_size and \
+                abs(oOldStat.st_mtime_ns - oNewStat.st_mtime_ns) <= iMTIME_TOLERANCE_NS:
+            return      # the same file shipped with the release - nothing to carry over
+
+    lConflicts.append(sRelPath)
+    if bNewIsDir:
+        shutil.rmtree(sNewPath, onerror=_onRemoveError)
+    else:
+        os.remove(sNewPath)
+    _rename(sOldPath, sNewPath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _rename(sOldPath, sNewPath):
+    ''' Same-volume rename; falls back to a copy if the folders are on different volumes.
+    '''
+    try:
+        os.rename(sOldPath, sNewPath)
+    except OSError as oError:
+        if oError.errno != errno.EXDEV:
+            raise
+        shutil.move(sOldPath, sNewPath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _onRemoveError(fnFunc, sPath, tupExcInfo):
+    os.chmod(sPath, stat.S_IWRITE)
+    fnFunc(sPath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _onRemoveErrorIgnored(fnFunc, sPath, tupExcInfo):
+    ''' Best-effort clean up of a partial backup - the original error is reported.
+    '''
+    try:
+        _onRemoveError(fnFunc, sPath, tupExcInfo)
+    except OSError:
+        pass
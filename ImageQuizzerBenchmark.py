@@ -0,0 +1,632 @@
+'''
+    Benchmark for the Baines Image Quizzer install manager.
+
+    Generates a synthetic project tree (many small DICOM-sized files plus a few
+    large volumes) and times the copy backends of ImageQuizzerCopyEngine against
+    the original shutil.copytree install. The 'copytree' row is the copy engine with
+    a single worker (createCopyEngine('copytree')); shutil.copytree itself is the
+    'shutil.copytree' row.
+
+    The page cache is not dropped between runs, so the source is read from memory
+    after the first run. Use a --work-dir on the device of interest (eg. a USB stick)
+    to measure the write side.
+
+    With --startup, the start-up time of the headless command line (ImageQuizzerSetupCLI)
+    is compared with loading the PyQt5 GUI tools, each in a fresh interpreter.
+
+    Suites (--suite):
+        copy     - the copy backends on one generated tree (default, as above)
+        install  - InstallJob (the work InstallerLogic.installSoftware hands to its
+                   worker thread) for every backend and install mode on each scenario:
+                       dicom    many small DICOM-sized slices
+                       volumes  a handful of large volumes
+                       deep     deeply nested folders
+                   Modes: full (new install), staged (over an existing install),
+                   incremental (1% of the files changed), noop (incremental, nothing
+                   changed) and verify (full install with hash verification).
+                   The 'copytree' backend runs shutil.copytree in the full and verify
+                   modes only - the other modes use the copy engine with one worker.
+                   Message boxes and the backup prompt are not part of the timing.
+                   MB/s counts the bytes each install copied (the 'copy' phase of its
+                   performance log) - files hard-linked from the existing install
+                   by a staged install are not counted.
+        connect  - connectAll (the logic behind the connector's Connect button) and
+                   connectIni against generated Slicer-xxxx.ini files with hundreds
+                   of AdditionalPaths entries
+        startup  - as --startup
+        write    - a full install with every write policy (see ImageQuizzerCopyEngine)
+                   into --target-dir, timed until the data is on the device: the
+                   install, then os.sync as an eject would. Run it on the kind of
+                   media the policies are for, eg. a loopback FAT image (Linux):
+                       truncate -s 4G fat.img && mkfs.vfat fat.img
+                       sudo mount -o loop,uid=$(id -u) fat.img /mnt/iqfat
+                       python ImageQuizzerBenchmark.py --suite write --target-dir /mnt/iqfat
+        all      - install, connect and startup
+
+    Trees are generated from a fixed seed at the sizes of --preset ('quick'; 'full':
+    50k slices, 2 GB volumes; 'smoke' only checks that the benchmark runs). Results are written with --json-out in a
+    stable format; --compare <earlier results> prints the change of every case
+    and exits with 1 if any case is more than --threshold percent slower, so runs
+    of two releases on the same machine can be compared.
+
+    Usage:      >> python ImageQuizzerBenchmark.py
+                >> python ImageQuizzerBenchmark.py --files 20000 --large 2 --large-size 1073741824 --work-dir E:\\bench
+                >> python ImageQuizzerBenchmark.py --startup --repeat 10
+                >> python ImageQuizzerBenchmark.py --suite all --preset full --label v2.3 --json-out bench-v2.3.json
+                >> python ImageQuizzerBenchmark.py --suite install --scenario dicom --compare bench-v2.3.json
+'''
+
+import sys, os
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from ImageQuizzerCopyEngine import CopyPlan, createCopyEngine, lCOPY_BACKENDS, lWRITE_POLICIES, iDEFAULT_WORKERS
+
+
+sRESULTS_FORMAT = 'iq-benchmark'
+iRESULTS_VERSION = 1
+iSEED = 20240201                # generated trees and ini files are the same on every run
+
+lSUITES = ['copy', 'install', 'connect', 'startup', 'write']
+lSCENARIOS = ['dicom', 'volumes', 'deep']
+lINSTALL_MODES = ['full', 'staged', 'incremental', 'noop', 'verify']
+fINCREMENTAL_CHANGED = 0.01     # share of the files changed for the incremental mode
+
+# scenario sizes
+dPRESETS = {
+    'smoke': {'dicom': {'files': 200, 'file_size': 16 * 1024},
+              'volumes': {'large': 1, 'large_size': 4 * 1024 * 1024},
+              'deep': {'chains': 5, 'depth': 10, 'files_per_level': 1, 'file_size': 4 * 1024},
+              'ini_paths': [100]},
+    'quick': {'dicom': {'files': 5000, 'file_size': 128 * 1024},
+              'volumes': {'large': 2, 'large_size': 256 * 1024 * 1024},
+              'deep': {'chains': 50, 'depth': 20, 'files_per_level': 2, 'file_size': 16 * 1024},
+              'ini_paths': [100, 500]},
+    'full':  {'dicom': {'files': 50000, 'file_size': 128 * 1024},
+              'volumes': {'large': 3, 'large_size': 2 * 1024 * 1024 * 1024},
+              'deep': {'chains': 200, 'depth': 40, 'files_per_level': 2, 'file_size': 16 * 1024},
+              'ini_paths': [100, 500, 2000]},
+    }
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def generateTree(sRootDir, iFiles, iFileSize, iLarge, iLargeSize, iFilesPerFolder=200):
+    ''' Create a synthetic Image Quizzer project under sRootDir.
+        Returns (number of files, total bytes).
+    '''
+    oRandom = random.Random(iSEED)
+    bytesBlock = oRandom.randbytes(max(iFileSize, 1))
+    iBytes = 0
+
+    for iFile in range(iFiles):
+        sFolder = os.path.join(sRootDir, 'Inputs', 'Images', 'Series%04d' % (iFile // iFilesPerFolder))
+        if iFile % iFilesPerFolder == 0:
+            os.makedirs(sFolder, exist_ok=True)
+        with open(os.path.join(sFolder, 'slice%06d.dcm' % iFile), 'wb') as fOut:
+            fOut.write(bytesBlock[:iFileSize])
+        iBytes += iFileSize
+
+    sVolumeDir = os.path.join(sRootDir, 'Inputs', 'Volumes')
+    os.makedirs(sVolumeDir, exist_ok=True)
+    bytesChunk = oRandom.randbytes(1024 * 1024)
+    for iVolume in range(iLarge):
+        with open(os.path.join(sVolumeDir, 'volume%02d.nrrd' % iVolume), 'wb') as fOut:
+            iWritten = 0
+            while iWritten < iLargeSize:
+                iCount = min(len(bytesChunk), iLargeSize - iWritten)
+                fOut.write(bytesChunk[:iCount])
+                iWritten += iCount
+        iBytes += iLargeSize
+
+    return iFiles + iLarge, iBytes
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def generateDeepTree(sRootDir, iChains, iDepth, iFilesPerLevel, iFileSize):
+    ''' Create iChains folder chains iDepth levels deep with iFilesPerLevel files
+        on every level (long paths, many folders, few files per folder).
+        Returns (number of files, total bytes).
+    '''
+    bytesBlock = random.Random(iSEED).randbytes(max(iFileSize, 1))
+    iFiles = 0
+    for iChain in range(iChains):
+        sFolder = os.path.join(sRootDir, 'Inputs', 'Nested%03d' % iChain)
+        for iLevel in range(iDepth):
+            sFolder = os.path.join(sFolder, 'level%02d' % iLevel)
+            os.makedirs(sFolder, exist_ok=True)
+            for iFile in range(iFilesPerLevel):
+                with open(os.path.join(sFolder, 'item%d.dcm' % iFile), 'wb') as fOut:
+                    fOut.write(bytesBlock[:iFileSize])
+                iFiles += 1
+    return iFiles, iFiles * iFileSize
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def generateScenario(sScenario, sSourceDir, dSizes):
+    ''' Generate the tree of a scenario of dPRESETS, with a small code folder as
+        in a real project. Returns (number of files, total bytes).
+    '''
+    sCodeDir = os.path.join(sSourceDir, 'ImageQuizzer', 'Code')
+    os.makedirs(sCodeDir, exist_ok=True)
+    for iModule in range(20):
+        with open(os.path.join(sCodeDir, 'Module%02d.py' % iModule), 'w') as fOut:
+            fOut.write("# generated\n" * 200)
+
+    if sScenario == 'dicom':
+        iFiles, iBytes = generateTree(sSourceDir, dSizes['files'], dSizes['file_size'], 0, 0)
+    elif sScenario == 'volumes':
+        iFiles, iBytes = generateTree(sSourceDir, 0, 0, dSizes['large'], dSizes['large_size'])
+    else:
+        iFiles, iBytes = generateDeepTree(sSourceDir, dSizes['chains'], dSizes['depth'],\
+                                          dSizes['files_per_level'], dSizes['file_size'])
+    return iFiles + 20, iBytes + 20 * len("# generated\n" * 200)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def changeFiles(sRootDir, fShare):
+    ''' Rewrite every 1/fShare-th file (in sorted order) with new content and
+        a new modification time. Returns the number of files changed.
+    '''
+    lFiles = []
+    for sDir, lDirs, lNames in os.walk(sRootDir):
+        lDirs.sort()
+        lFiles.extend(os.path.join(sDir, sName) for sName in sorted(lNames))
+    iStep = max(1, int(round(1 / fShare)))
+    lChanged = lFiles[::iStep]
+    for sPath in lChanged:
+        with open(sPath, 'ab') as fOut:
+            fOut.write(b'changed')
+    return len(lChanged)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def makeResult(sSuite, sCase, lSeconds, iFiles=None, iBytes=None, dExtra=None):
+    ''' One case in the results format: run times, median, min and the rates
+        at the median.
+    '''
+    fMedian = statistics.median(lSeconds)
+    dResult = {'suite': sSuite, 'case': sCase, 'runs': [round(fSeconds, 6) for fSeconds in lSeconds],\
+               'median': round(fMedian, 6), 'min': round(min(lSeconds), 6)}
+    if iFiles is not None:
+        dResult['files'] = iFiles
+        dResult['files_per_s'] = round(iFiles / fMedian, 1) if fMedian > 0 else None
+    if iBytes is not None:
+        dResult['bytes'] = iBytes
+        dResult['mb_per_s'] = round(iBytes / fMedian / 1e6, 2) if fMedian > 0 else None
+    if dExtra:
+        dResult.update(dExtra)
+    return dResult
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def timeCopy(sName, fnCopy, sTargetDir, iFiles, iBytes):
+    ''' Time one install into an empty target and return a result dictionary.
+    '''
+    if os.path.exists(sTargetDir):
+        shutil.rmtree(sTargetDir)
+
+    fStart = time.perf_counter()
+    oResult = fnCopy()
+    fSeconds = time.perf_counter() - fStart
+
+    dResult = {'name': sName,
+               'seconds': fSeconds,
+               'MBps': iBytes / fSeconds / 1e6 if fSeconds > 0 else 0.0,
+               'filesps': iFiles / fSeconds if fSeconds > 0 else 0.0,
+               'methods': oResult.getMethodCounts() if isinstance(oResult, CopyPlan) else {'copy2': iFiles}}
+    shutil.rmtree(sTargetDir)
+    return dResult
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runCopyBenchmark(sWorkDir, iWorkers, iRepeat, iFiles, iFileSize, iLarge, iLargeSize):
+
+    sSourceDir = os.path.join(sWorkDir, 'source')
+    sTargetDir = os.path.join(sWorkDir, 'target')
+
+    print("Generating source tree in " + sSourceDir + " ...")
+    iTotalFiles, iTotalBytes = generateTree(sSourceDir, iFiles, iFileSize, iLarge, iLargeSize)
+    print("  %d files, %.1f MB\n" % (iTotalFiles, iTotalBytes / 1e6))
+
+    lCandidates = [('shutil.copytree', lambda: shutil.copytree(sSourceDir, sTargetDir))]
+    for sBackend in lCOPY_BACKENDS:
+        oEngine = createCopyEngine(sBackend, iWorkers=iWorkers)
+        lCandidates.append((sBackend, lambda oEngine=oEngine: oEngine.syncTree(sSourceDir, sTargetDir)))
+
+    lResults = []
+    print("%-18s %10s %10s %10s   %s" % ('backend', 'seconds', 'MB/s', 'files/s', 'methods'))
+    for sName, fnCopy in lCandidates:
+        lSeconds = []
+        for _ in range(iRepeat):
+            dResult = timeCopy(sName, fnCopy, sTargetDir, iTotalFiles, iTotalBytes)
+            lSeconds.append(dResult['seconds'])
+            print("%-18s %10.3f %10.1f %10.0f   %s" % (sName, dResult['seconds'], dResult['MBps'],\
+                                                       dResult['filesps'], dResult['methods']))
+        lResults.append(makeResult('copy', sName, lSeconds, iTotalFiles, iTotalBytes, {'methods': dResult['methods']}))
+    print()
+    return lResults
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def prepareInstall(sMode, sSourceDir, sTargetDir, sBackend, iWorkers):
+    ''' Bring the target into the state the mode starts from (not timed) and
+        return the InstallJob to time.
+    '''
+    from ImageQuizzerInstallJob import InstallJob
+
+    if os.path.exists(sTargetDir):
+        shutil.rmtree(sTargetDir)
+    if sMode in ('staged', 'incremental', 'noop'):
+        oSetup = InstallJob(sSourceDir, sTargetDir)
+        oSetup.sCopyBackend = sBackend
+        oSetup.iCopyWorkers = iWorkers
+        oSetup.run()
+
+    oJob = InstallJob(sSourceDir, sTargetDir)
+    oJob.sCopyBackend = sBackend
+    oJob.iCopyWorkers = iWorkers
+    oJob.bStaged = sMode == 'staged'
+    oJob.bIncremental = sMode in ('incremental', 'noop')
+    oJob.bVerify = sMode == 'verify'
+    return oJob
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def readPhases(sPerfLogPath, sField='seconds'):
+    ''' Phase totals ('seconds', 'files' or 'bytes') of the last install in a
+        performance log (see ImageQuizzerPerfLog).
+    '''
+    dPhases = {}
+    try:
+        with open(sPerfLogPath, 'r', encoding='utf-8') as fIn:
+            for sLine in fIn:
+                if sLine.startswith('{"event": "summary"'):
+                    dPhases = json.loads(sLine).get('phases', {})
+    except (OSError, ValueError):
+        pass
+    return {sPhase: dPhase[sField] for sPhase, dPhase in dPhases.items()}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runInstallBenchmark(sWorkDir, dPreset, lScenarios, lBackends, lModes, iWorkers, iRepeat):
+    ''' Time InstallJob.run for every scenario, backend and mode.
+    '''
+    lResults = []
+    print("%-34s %10s %10s %10s   %s" % ('install', 'seconds', 'MB/s', 'files/s', 'phases'))
+    for sScenario in lScenarios:
+        sSourceDir = os.path.join(sWorkDir, sScenario, 'source')
+        sTargetDir = os.path.join(sWorkDir, sScenario, 'install')
+        iFiles, iBytes = generateScenario(sScenario, sSourceDir, dPreset[sScenario])
+
+        for sMode in lModes:
+            for sBackend in lBackends:
+                sCase = '%s/%s/%s' % (sScenario, sBackend, sMode)
+                lSeconds = []
+                for _ in range(iRepeat):
+                    oJob = prepareInstall(sMode, sSourceDir, sTargetDir, sBackend, iWorkers)
+                    iChanged = changeFiles(sSourceDir, fINCREMENTAL_CHANGED) if sMode == 'incremental' else 0
+                    fStart = time.perf_counter()
+                    oJob.run()
+                    lSeconds.append(time.perf_counter() - fStart)
+                    dPhases = readPhases(oJob.oPerfLog.sPath)
+                    iCopied = readPhases(oJob.oPerfLog.sPath, 'bytes').get('copy', 0)
+
+                # what the mode actually writes
+                iCaseFiles, iCaseBytes = iFiles, iCopied
+                if sMode == 'noop':
+                    iCaseFiles = 0
+                elif sMode == 'incremental':
+                    iCaseFiles = iChanged
+                dResult = makeResult('install', sCase, lSeconds, iCaseFiles, iCaseBytes, {'phases': dPhases})
+                lResults.append(dResult)
+                print("%-34s %10.3f %10s %10s   %s" % (sCase, dResult['median'], dResult.get('mb_per_s') or '-',\
+                                                      dResult.get('files_per_s') or '-',\
+                                                      ' '.join('%s=%.2f' % tupPhase for tupPhase in dPhases.items())))
+
+        shutil.rmtree(os.path.join(sWorkDir, sScenario), ignore_errors=True)
+    print()
+    return lResults
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runWriteBenchmark(sWorkDir, sTargetRoot, dPreset, lScenarios, lBackends, lPolicies, iWorkers, iRepeat):
+    ''' Time a full install into sTargetRoot for every write policy and backend,
+        including the sync that an eject would wait for ('default' is the
+        original behaviour to compare with).
+    '''
+    sTargetDir = os.path.join(sTargetRoot, 'iq-bench-write')
+    bSync = hasattr(os, 'sync')     # not on Windows - only the install is timed there
+    lResults = []
+    print("%-34s %10s %10s %10s %10s   %s" % ('write policy', 'seconds', 'install', 'eject', 'MB/s', 'phases'))
+    for sScenario in lScenarios:
+        sSourceDir = os.path.join(sWorkDir, sScenario, 'source')
+        iFiles, iBytes = generateScenario(sScenario, sSourceDir, dPreset[sScenario])
+
+        for sPolicy in lPolicies:
+            for sBackend in lBackends:
+                sCase = '%s/%s/%s' % (sScenario, sBackend, sPolicy)
+                lSeconds, lInstall, lEject = [], [], []
+                for _ in range(iRepeat):
+                    oJob = prepareInstall('full', sSourceDir, sTargetDir, sBackend, iWorkers)
+                    oJob.sWritePolicy = sPolicy
+                    if bSync:
+                        os.sync()       # the removed previous install is not part of the timing
+                    fStart = time.perf_counter()
+                    oJob.run()
+                    fInstalled = time.perf_counter()
+                    if bSync:
+                        os.sync()
+                    fEnd = time.perf_counter()
+                    lSeconds.append(fEnd - fStart)
+                    lInstall.append(fInstalled - fStart)
+                    lEject.append(fEnd - fInstalled)
+                    dPhases = readPhases(oJob.oPerfLog.sPath)
+
+                dResult = makeResult('write', sCase, lSeconds, iFiles, iBytes,\
+                                     {'install': round(statistics.median(lInstall), 6),\
+                                      'eject': round(statistics.median(lEject), 6) if bSync else None,\
+                                      'phases': dPhases})
+                lResults.append(dResult)
+                print("%-34s %10.3f %10.3f %10.3f %10s   %s" % (sCase, dResult['median'], dResult['install'],\
+                                                             dResult['eject'] or 0.0, dResult['mb_per_s'],\
+                                                             ' '.join('%s=%.2f' % tupPhase for tupPhase in dPhases.items())))
+
+        shutil.rmtree(os.path.join(sWorkDir, sScenario), ignore_errors=True)
+    shutil.rmtree(sTargetDir, ignore_errors=True)
+    for sName in os.listdir(sTargetRoot):
+        if sName.startswith('iq-bench-write.'):
+            os.remove(os.path.join(sTargetRoot, sName))     # performance log
+    print()
+    return lResults
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def generateSlicerInstall(sSlicerDir, iPaths):
+    ''' Fake Slicer install whose NA-MIC/Slicer-xxxx.ini lists iPaths other
+        extension folders in AdditionalPaths, within the usual ini sections.
+        Returns the ini path.
+    '''
+    oRandom = random.Random(iSEED + iPaths)
+    os.makedirs(os.path.join(sSlicerDir, 'bin'), exist_ok=True)
+    os.makedirs(os.path.join(sSlicerDir, 'NA-MIC'), exist_ok=True)
+    with open(os.path.join(sSlicerDir, 'Slicer'), 'w') as fOut:
+        fOut.write('')
+
+    lPaths = ['C:/Users/lab/AppData/Local/NA-MIC/Slicer 5.6.2/NA-MIC/Extensions-32448/Ext%04d/lib/Slicer-5.6/qt-scripted-modules'\
+              % iPath for iPath in range(iPaths)]
+    lLines = ['[General]', 'additionalLauncherSettingsFilePath=', 'disable-terminal-outputs=false', '']
+    lLines += ['[MainWindow]', 'geometry=@ByteArray(' + ''.join(oRandom.choice('0123456789abcdef') for _ in range(400)) + ')', '']
+    lLines += ['[Modules]', 'AdditionalPaths=' + ', '.join(lPaths), 'IgnoreModules=@Invalid()', '']
+    lLines += ['[Python]', 'DockableWindow=true', '']
+    sIniPath = os.path.join(sSlicerDir, 'NA-MIC', 'Slicer-32448.ini')
+    with open(sIniPath, 'w', newline='') as fOut:
+        fOut.write('\r\n'.join(lLines))
+    return sIniPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runConnectBenchmark(sWorkDir, lIniPaths, iRepeat):
+    ''' Time connecting an Image Quizzer install to Slicer ini files with many
+        AdditionalPaths entries: the first connect (ini rewritten), a reconnect
+        (nothing to change) and connectIni alone (no Slicer discovery).
+    '''
+    from ImageQuizzerSlicerSettings import connectIni, getCheckedCodePath
+    from ImageQuizzerSlicerDiscovery import SlicerIndex, connectAll
+
+    sModuleDir = os.path.join(sWorkDir, 'connect', 'BainesImageQuizzer')
+    os.makedirs(os.path.join(sModuleDir, 'ImageQuizzer', 'Code'), exist_ok=True)
+    sCodePath = getCheckedCodePath(sModuleDir)
+    # a private index - the user's Slicer index is not touched
+    sIndexPath = os.path.join(sWorkDir, 'connect', 'slicer-index.json')
+
+    lResults = []
+    print("%-34s %10s" % ('connect', 'ms'))
+    for iPaths in lIniPaths:
+        sSlicerDir = os.path.join(sWorkDir, 'connect', 'Slicer-%d' % iPaths)
+        sIniPath = generateSlicerInstall(sSlicerDir, iPaths)
+        with open(sIniPath, 'rb') as fIn:
+            bytesIni = fIn.read()
+
+        dCases = {'connect': [], 'reconnect': [], 'connectIni': []}
+        for _ in range(iRepeat):
+            with open(sIniPath, 'wb') as fOut:
+                fOut.write(bytesIni)
+            fStart = time.perf_counter()
+            connectAll(sModuleDir, [sSlicerDir], oIndex=SlicerIndex(sIndexPath))
+            dCases['connect'].append(time.perf_counter() - fStart)
+
+            fStart = time.perf_counter()
+            connectAll(sModuleDir, [sSlicerDir], oIndex=SlicerIndex(sIndexPath))
+            dCases['reconnect'].append(time.perf_counter() - fStart)
+
+            with open(sIniPath, 'wb') as fOut:
+                fOut.write(bytesIni)
+            fStart = time.perf_counter()
+            connectIni(sCodePath, sIniPath)
+            dCases['connectIni'].append(time.perf_counter() - fStart)
+
+        for sName, lSeconds in dCases.items():
+            sCase = 'ini-%d/%s' % (iPaths, sName)
+            dResult = makeResult('connect', sCase, lSeconds, dExtra={'ini_bytes': len(bytesIni)})
+            lResults.append(dResult)
+            print("%-34s %10.2f" % (sCase, dResult['median'] * 1000))
+    print()
+    return lResults
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def timeStartup(lCommand, iRepeat):
+    ''' Run lCommand iRepeat times in a new process and return the wall-clock seconds of each run.
+    '''
+    lSeconds = []
+    for _ in range(iRepeat):
+        fStart = time.perf_counter()
+        subprocess.run(lCommand, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        lSeconds.append(time.perf_counter() - fStart)
+    return lSeconds
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runStartupBenchmark(iRepeat):
+    ''' Compare the start-up of the headless command line with importing the GUI tools.
+    '''
+    sCodeDir = os.path.dirname(os.path.abspath(__file__))
+    sPython = sys.executable
+
+    lCandidates = [('python (empty)', [sPython, '-c', 'pass']),
+                   ('setup-cli --help', [sPython, os.path.join(sCodeDir, 'ImageQuizzerSetupCLI.py'), '--help']),
+                   ('connector CLI', [sPython, os.path.join(sCodeDir, 'ImageQuizzerModuleConnector.py'),\
+                                      sCodeDir, sCodeDir, '--json']),
+                   ('import InstallManager (Qt)', [sPython, '-c', 'import ImageQuizzerInstallManager']),
+                   ('import ModuleConnector (Qt)', [sPython, '-c', 'import ImageQuizzerModuleConnector'])]
+
+    # the command line must not pull in Qt through any of its imports
+    oCheck = subprocess.run([sPython, '-c', "import sys, ImageQuizzerSetupCLI; sys.exit('PyQt5' in sys.modules)"],\
+                            cwd=sCodeDir)
+    print("PyQt5 loaded by ImageQuizzerSetupCLI : " + ("yes" if oCheck.returncode else "no") + "\n")
+
+    lResults = []
+    print("%-30s %10s %10s" % ('command', 'median ms', 'min ms'))
+    for sName, lCommand in lCandidates:
+        lSeconds = timeStartup(lCommand, iRepeat)
+        dResult = makeResult('startup', sName, lSeconds)
+        lResults.append(dResult)
+        print("%-30s %10.1f %10.1f" % (sName, dResult['median'] * 1000, dResult['min'] * 1000))
+    print()
+    return lResults
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getCommit():
+    ''' git commit of the code being benchmarked, or None outside a checkout.
+    '''
+    try:
+        oResult = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,\
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return oResult.stdout.strip() or None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def buildReport(lResults, dParameters, sLabel):
+    return {'format': sRESULTS_FORMAT, 'version': iRESULTS_VERSION,\
+            'label': sLabel, 'commit': getCommit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),\
+            'host': {'platform': platform.platform(), 'python': platform.python_version(),\
+                     'machine': platform.machine(), 'cpus': os.cpu_count()},\
+            'parameters': dParameters, 'results': lResults}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def compareReports(dBase, dReport, fThreshold):
+    ''' Print the change of the median of every case found in both reports.
+        Returns the cases more than fThreshold percent slower.
+    '''
+    if dBase.get('format') != sRESULTS_FORMAT or dBase.get('version') != iRESULTS_VERSION:
+        print("Cannot compare - not a version %d benchmark result" % iRESULTS_VERSION)
+        return []
+    if dBase.get('parameters') != dReport['parameters']:
+        print("Note: the runs used different parameters - only cases of the same name are compared")
+    if dBase.get('host', {}).get('platform') != dReport['host']['platform']:
+        print("Note: the runs are from different machines")
+
+    dBaseCases = {(dResult['suite'], dResult['case']): dResult for dResult in dBase.get('results', [])}
+    lSlower = []
+    print("%-42s %10s %10s %8s   (against %s)" % ('case', 'base ms', 'now ms', 'change', dBase.get('label') or dBase.get('commit')))
+    for dResult in dReport['results']:
+        dBaseResult = dBaseCases.get((dResult['suite'], dResult['case']))
+        if dBaseResult is None or dBaseResult['median'] <= 0:
+            continue
+        fChange = (dResult['median'] / dBaseResult['median'] - 1) * 100
+        sFlag = ''
+        if fChange > fThreshold:
+            sFlag = '  SLOWER'
+            lSlower.append(dResult['suite'] + ' ' + dResult['case'])
+        print("%-42s %10.1f %10.1f %+7.1f%%%s" % (dResult['suite'] + ' ' + dResult['case'],\
+                                                dBaseResult['median'] * 1000, dResult['median'] * 1000, fChange, sFlag))
+    return lSlower
+
+
+##########################################################################
+##########################################################################
+##########################################################################
+#
+# RUN BENCHMARK
+#
+##########################################################################
+##########################################################################
+##########################################################################
+
+
+if __name__ == '__main__':
+
+    oParser = argparse.ArgumentParser(description="Benchmark the Image Quizzer install copy backends")
+    oParser.add_argument('--suite', choices=lSUITES + ['all'], default='copy', help="what to benchmark (default: copy)")
+    oParser.add_argument('--work-dir', help="folder for the generated source and target trees (default: temp folder)")
+    oParser.add_argument('--files', type=int, default=5000, help="number of small files")
+    oParser.add_argument('--file-size', type=int, default=128 * 1024, help="size of each small file in bytes")
+    oParser.add_argument('--large', type=int, default=2, help="number of large volumes")
+    oParser.add_argument('--large-size', type=int, default=256 * 1024 * 1024, help="size of each large volume in bytes")
+    oParser.add_argument('--preset', choices=sorted(dPRESETS), default='quick', help="sizes of the install and"\
+                         " connect scenarios")
+    oParser.add_argument('--scenario', action='append', choices=lSCENARIOS, help="install scenario (repeat; default: all)")
+    oParser.add_argument('--backend', action='append', choices=lCOPY_BACKENDS, help="install backend (repeat;"\
+                         " default: all)")
+    oParser.add_argument('--mode', action='append', choices=lINSTALL_MODES, help="install mode (repeat; default: all)")
+    oParser.add_argument('--policy', action='append', choices=lWRITE_POLICIES, help="write policy (repeat;"\
+                         " default: all)")
+    oParser.add_argument('--target-dir', help="folder on the media to write to for --suite write (default:"\
+                         " the work folder)")
+    oParser.add_argument('--workers', type=int, default=iDEFAULT_WORKERS, help="worker threads for the parallel backends")
+    oParser.add_argument('--repeat', type=int, default=1, help="runs per backend (or per command with --startup)")
+    oParser.add_argument('--startup', action='store_true', help="benchmark start-up of the CLI and GUI tools instead")
+    oParser.add_argument('--label', help="name of this run in the results, eg. the release")
+    oParser.add_argument('--json-out', help="write the results to this file")
+    oParser.add_argument('--compare', help="results of an earlier run to compare with")
+    oParser.add_argument('--threshold', type=float, default=10.0, help="percent slower that counts as a regression")
+    oArgs = oParser.parse_args()
+    if oArgs.work_dir:
+        try:
+            os.makedirs(oArgs.work_dir, exist_ok=True)
+        except OSError as oError:
+            oParser.error("--work-dir %s cannot be created: %s" % (oArgs.work_dir, oError.strerror or oError))
+    if oArgs.target_dir and not os.path.isdir(oArgs.target_dir):
+        oParser.error("--target-dir %s is not a folder (mount the media first)" % oArgs.target_dir)
+
+    if oArgs.startup:
+        oArgs.suite = 'startup'
+    lSuites = ['install', 'connect', 'startup'] if oArgs.suite == 'all' else [oArgs.suite]
+    dPreset = dPRESETS[oArgs.preset]
+
+    dParameters = {'suites': lSuites, 'workers': oArgs.workers, 'repeat': oArgs.repeat}
+    if 'copy' in lSuites:
+        dParameters['copy'] = {'files': oArgs.files, 'file_size': oArgs.file_size, 'large': oArgs.large,\
+                               'large_size': oArgs.large_size}
+    if 'install' in lSuites or 'connect' in lSuites or 'write' in lSuites:
+        dParameters['preset'] = oArgs.preset
+
+    lResults = []
+    if 'startup' in lSuites:
+        os.environ.setdefault('PYTHONPATH', os.path.dirname(os.path.abspath(__file__)))
+        lResults.extend(runStartupBenchmark(max(oArgs.repeat, 3)))
+
+    sWorkDir = tempfile.mkdtemp(prefix='iq-bench-', dir=oArgs.work_dir)
+    try:
+        if 'copy' in lSuites:
+            lResults.extend(runCopyBenchmark(sWorkDir, oArgs.workers, oArgs.repeat, oArgs.files, oArgs.file_size,\
+                                             oArgs.large, oArgs.large_size))
+        if 'install' in lSuites:
+            lResults.extend(runInstallBenchmark(sWorkDir, dPreset, oArgs.scenario or lSCENARIOS,\
+                                                oArgs.backend or lCOPY_BACKENDS, oArgs.mode or lINSTALL_MODES,\
+                                                oArgs.workers, oArgs.repeat))
+        if 'write' in lSuites:
+            lResults.extend(runWriteBenchmark(sWorkDir, oArgs.target_dir or sWorkDir, dPreset,\
+                                              oArgs.scenario or ['dicom', 'volumes'], oArgs.backend or lCOPY_BACKENDS,\
+                                              oArgs.policy or lWRITE_POLICIES, oArgs.workers, oArgs.repeat))
+        if 'connect' in lSuites:
+            lResults.extend(runConnectBenchmark(sWorkDir, dPreset['ini_paths'], max(oArgs.repeat, 5)))
+    finally:
+        shutil.rmtree(sWorkDir, ignore_errors=True)
+
+    dReport = buildReport(lResults, dParameters, oArgs.label)
+    if oArgs.json_out:
+        with open(oArgs.json_out, 'w', encoding='utf-8') as fOut:
+            json.dump(dReport, fOut, indent=1)
+        print("Results written to " + oArgs.json_out)
+
+    if oArgs.compare:
+        with open(oArgs.compare, 'r', encoding='utf-8') as fIn:
+            lSlower = compareReports(json.load(fIn), dReport, oArgs.threshold)
+        if lSlower:
+            print("\n%d case(s) more than %.0f%% slower" % (len(lSlower), oArgs.threshold))
+            sys.exit(1)
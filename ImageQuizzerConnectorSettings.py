@@ -0,0 +1,187 @@
+'''
+    Remembered connector settings for the Baines Image Quizzer module connector.
+
+    The connector exists because the USB drive letter changes between PCs. Once the
+    module has been connected, the layout of the stick is remembered in
+    <user config>/ImageQuizzer/connector-settings.json, keyed by the identity of
+    the volume the connector runs from (see ImageQuizzerSlicerDiscovery.getVolumeId)
+    and by the connector's folder on that volume:
+
+        { 'version': 1,
+          'volumes': { <volume id>: { <start folder relative to volume>:
+                                          { 'module': <relative to volume>,
+                                            'slicer': <relative to volume, or absolute if on another volume>,
+                                            'slicer_on_volume': true|false } } } }
+
+    On the next launch - on any PC, with any drive letter - the paths are rebuilt
+    from the current mount point and the module is connected straight away. Only
+    on a cache miss are the stick's folders searched (findModuleDir and the Slicer
+    discovery walk).
+
+    This module is used by ImageQuizzerModuleConnector.py and the 'connect'
+    command of ImageQuizzerSetupCLI.py and must not import PyQt5.
+'''
+
+import os
+import json
+import threading
+
+from ImageQuizzerSlicerDiscovery import getConfigDir, getVolume, getVolumeId, discoverSlicerInstalls, connectAll
+from ImageQuizzerSlicerSettings import findSlicerInis
+
+
+sSETTINGS_NAME = 'connector-settings.json'
+iSETTINGS_VERSION = 1
+
+sFROM_CACHE = 'cache'
+sFROM_DISCOVERY = 'discovery'
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isModuleDir(sDir):
+    return os.path.isdir(os.path.join(sDir, 'ImageQuizzer', 'Code'))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def findModuleDir(sStartDir):
+    ''' Image Quizzer install near the connector: the start folder itself, its
+        parent, or a folder next to it (eg. BainesImageQuizzer). Returns None if
+        there is none or more than one candidate.
+    '''
+    sStartDir = os.path.abspath(sStartDir)
+    sParentDir = os.path.dirname(sStartDir)
+    for sDir in (sStartDir, sParentDir):
+        if isModuleDir(sDir):
+            return sDir
+
+    lCandidates = []
+    try:
+        with os.scandir(sParentDir) as itEntries:
+            for oEntry in itEntries:
+                if oEntry.is_dir(follow_symlinks=False) and isModuleDir(oEntry.path):
+                    lCandidates.append(oEntry.path)
+    except OSError:
+        pass
+    return lCandidates[0] if len(lCandidates) == 1 else None
+
+
+##########################################################################
+#
+# ConnectorSettings
+#
+##########################################################################
+class ConnectorSettings():
+    ''' Module and Slicer paths last connected from each start folder of each volume.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sPath=None):
+        self.sPath = sPath or os.path.join(getConfigDir(), sSETTINGS_NAME)
+        self.dVolumes = {}
+        try:
+            with open(self.sPath, 'r', encoding='utf-8') as fIn:
+                dSettings = json.load(fIn)
+            if dSettings.get('version') == iSETTINGS_VERSION:
+                self.dVolumes = dSettings.get('volumes', {})
+        except (OSError, ValueError):
+            pass
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getKey(self, sStartDir):
+        sStartDir = os.path.abspath(sStartDir)
+        sVolume = getVolume(sStartDir)
+        return sVolume, getVolumeId(sVolume), os.path.relpath(sStartDir, sVolume)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def lookup(self, sStartDir):
+        ''' (module path, Slicer path) remembered for sStartDir, rebuilt on the
+            volume's current mount point - or None if unknown or no longer there.
+        '''
+        sVolume, sVolumeId, sRelStart = self._getKey(sStartDir)
+        dEntry = self.dVolumes.get(sVolumeId, {}).get(sRelStart)
+        if dEntry is None:
+            return None
+
+        sModulePath = os.path.join(sVolume, dEntry['module'])
+        if dEntry.get('slicer_on_volume', True):
+            sSlicerPath = os.path.join(sVolume, dEntry['slicer'])
+        else:
+            sSlicerPath = dEntry['slicer']
+        if not isModuleDir(sModulePath) or not os.path.isdir(sSlicerPath):
+            return None
+        return sModulePath, sSlicerPath
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def remember(self, sStartDir, sModulePath, sSlicerPath):
+        ''' Store the paths of a successful connect and write the settings file.
+            A read-only config folder only loses the cache.
+        '''
+        sVolume, sVolumeId, sRelStart = self._getKey(sStartDir)
+        sModulePath = os.path.abspath(sModulePath)
+        sSlicerPath = os.path.abspath(sSlicerPath)
+        if getVolume(sModulePath) != sVolume:
+            return
+
+        bSlicerOnVolume = getVolume(sSlicerPath) == sVolume
+        dEntry = {'module': os.path.relpath(sModulePath, sVolume),\
+                  'slicer': os.path.relpath(sSlicerPath, sVolume) if bSlicerOnVolume else sSlicerPath,\
+                  'slicer_on_volume': bSlicerOnVolume}
+        if self.dVolumes.get(sVolumeId, {}).get(sRelStart) == dEntry:
+            return
+        self.dVolumes.setdefault(sVolumeId, {})[sRelStart] = dEntry
+
+        try:
+            os.makedirs(os.path.dirname(self.sPath), exist_ok=True)
+            sTempPath = '%s.%d-%d.tmp' % (self.sPath, os.getpid(), threading.get_ident())
+            with open(sTempPath, 'w', encoding='utf-8') as fOut:
+                json.dump({'version': iSETTINGS_VERSION, 'volumes': self.dVolumes}, fOut, indent=1)
+            os.replace(sTempPath, self.sPath)
+        except OSError:
+            pass
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def resolvePaths(sStartDir, oSettings=None):
+    ''' Module and Slicer paths for the connector started in sStartDir:
+        from the remembered settings, else by searching the stick.
+
+        Returns (module path, Slicer path, sFROM_CACHE | sFROM_DISCOVERY),
+        or (None, None, None) if they cannot be found without asking the user.
+        With several Slicer installs on the stick, the Slicer path is the folder
+        holding them all (connectAll connects each one).
+    '''
+    if oSettings is None:
+        oSettings = ConnectorSettings()
+
+    tupPaths = oSettings.lookup(sStartDir)
+    if tupPaths is not None:
+        return tupPaths[0], tupPaths[1], sFROM_CACHE
+
+    sModulePath = findModuleDir(sStartDir)
+    if sModulePath is None:
+        return None, None, None
+
+    sStickDir = os.path.dirname(sModulePath)
+    lInstalls = [sInstall for sInstall in discoverSlicerInstalls([sStickDir]) if findSlicerInis(sInstall)]
+    if not lInstalls:
+        return sModulePath, None, None
+    if len(lInstalls) == 1:
+        return sModulePath, lInstalls[0], sFROM_DISCOVERY
+    return sModulePath, sStickDir, sFROM_DISCOVERY
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def autoConnect(sStartDir, oSettings=None):
+    ''' Resolve the paths for sStartDir and connect without asking anything.
+        Returns (module path, Slicer path, source, connectAll results); the results
+        are None if the paths could not be resolved. Connect errors are raised
+        (SlicerConnectError); a fully successful connect is remembered.
+    '''
+    if oSettings is None:
+        oSettings = ConnectorSettings()
+
+    sModulePath, sSlicerPath, sSource = resolvePaths(sStartDir, oSettings)
+    if sSource is None:
+        return sModulePath, sSlicerPath, None, None
+
+    lResults = connectAll(sModulePath, [sSlicerPath])
+    if not any(dIni['error'] for dIni in lResults):
+        oSettings.remember(sStartDir, sModulePath, sSlicerPath)
+    return sModulePath, sSlicerPath, sSource, lResults
@@ -0,0 +1,1353 @@
+'''
+    Copy engine for the Baines Image Quizzer install manager.
+
+    Qt-free helpers used by InstallerLogic to copy the Image Quizzer project folder
+    into the install directory.
+
+    In incremental mode the source and destination trees are compared by size and
+    modification time (and optionally by a content hash) so that only new or changed
+    files are copied. Files and folders in the destination that no longer exist in
+    the source are removed. A code-only update of an install with gigabytes of
+    DICOM in the Inputs folder only has to copy the few files that changed.
+
+    Copy backends:
+        'copytree'  - one file at a time. InstallJob copies a new in-place install
+                      with shutil.copytree (original behaviour); staged, incremental,
+                      resumed, snapshot and dedup installs - and
+                      createCopyEngine('copytree') - use this engine with one worker.
+        'parallel'  - folders are created first, then files are copied concurrently
+                      by a bounded pool of worker threads. This keeps the target busy
+                      when copying thousands of small DICOM slices.
+        'zerocopy'  - as 'parallel', but each file is copied by the kernel where possible:
+                      reflink (FICLONE), then os.copy_file_range, then os.sendfile,
+                      falling back to buffered reads. Same-filesystem copies on Linux
+                      never move the data through user space. The method used for
+                      every file is recorded in CopyPlan.dCopyMethods.
+
+    With a link folder (sLinkDir, eg. the previous .BAK snapshot) files that are identical
+    in the source and the link folder are hard-linked instead of copied, in the style
+    of 'rsync --link-dest'. Filesystems without hard links (FAT/exFAT) fall back
+    to copying.
+
+    With dedup on, files of the source with identical contents (eg. reference images,
+    masks and templates shipped in several session folders) are written once: the
+    duplicates are hard-linked to the copy in the target, cloned (reflink) where the
+    target has no hard links, and copied only where it has neither (user data that is
+    edited in place is only cloned - see CopyEngine.lCloneOnlyDirs). Files are grouped
+    by size first, so only files sharing a size are hashed - with the hashes of the
+    cached source manifest where it is up to date (see findDuplicates).
+
+    With journalling on, every completed file is appended to a small journal in the
+    target folder (relative path, size, modification time and, when hashing is on,
+    the content hash). If a copy is interrupted (USB stick unplugged, laptop asleep)
+    the next run finds the journal, keeps the files it lists and copies only what is
+    missing or partially written. The journal is deleted when the copy completes.
+
+    How copied files reach the target device is set by a WritePolicy. Cheap FAT/exFAT
+    USB sticks are slow with small writes, and the operating system's write-back cache
+    hides that until the stick is ejected, which then stalls for minutes:
+        'default'   - shutil.copy2 / the zero-copy methods, written back by the OS
+                      (original behaviour)
+        'buffered'  - file data is copied through one large page-aligned buffer per
+                      thread, so the device gets a few large writes per file (the
+                      zero-copy backend uses it only where the kernel cannot copy)
+        'batched'   - as 'buffered', and the written files are fsynced every
+                      iSYNC_BATCH_FILES files or iSYNC_BATCH_BYTES bytes, so the
+                      amount of unwritten data stays small while copying
+        'flush'     - default copy, then every written file is fsynced at the end of
+                      the copy, shown as a 'Flushing to disk' progress phase
+        'removable' - large buffers, batched fsyncs and the final flush; when the
+                      install finishes the stick can be ejected straight away
+
+    Progress (files, bytes, throughput and ETA) is reported through a CopyProgress
+    object and a copy can be stopped between files (and between chunks for the
+    zero-copy backend) by setting the engine's cancel event.
+
+    This module is imported by ImageQuizzerInstallManager.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import sys, os
+import shutil
+import stat
+import hashlib
+import mmap
+import errno
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # Windows
+
+from ImageQuizzerPerfLog import PerfLog
+from ImageQuizzerSetupOptions import sBACKEND_COPYTREE, sBACKEND_PARALLEL, sBACKEND_ZEROCOPY, lCOPY_BACKENDS, \
+                                     iDEFAULT_WORKERS, sPOLICY_DEFAULT, sPOLICY_BUFFERED, sPOLICY_BATCHED, \
+                                     sPOLICY_FLUSH, sPOLICY_REMOVABLE, lWRITE_POLICIES
+
+
+# FAT/exFAT USB sticks store modification times with a 2 second resolution
+iMTIME_TOLERANCE_NS = 2 * 1000 * 1000 * 1000
+
+iHASH_BUFFER_SIZE = 1024 * 1024
+iHASH_MMAP_MIN_SIZE = 8 * 1024 * 1024     # larger files are hashed through mmap
+
+# per file copy methods, in the order they are tried by the zero-copy backend
+sMETHOD_COPY2 = 'copy2'
+sMETHOD_REFLINK = 'reflink'
+sMETHOD_COPY_FILE_RANGE = 'copy_file_range'
+sMETHOD_SENDFILE = 'sendfile'
+sMETHOD_BUFFERED = 'buffered'
+
+sMETHOD_ALIGNED = 'aligned'
+sMETHOD_HARDLINK = 'hardlink'       # duplicates linked to an identical file of the install
+
+iFICLONE = 0x40049409           # linux/fs.h _IOW(0x94, 9, int)
+iZEROCOPY_CHUNK_SIZE = 64 * 1024 * 1024
+iBUFFERED_COPY_SIZE = 1024 * 1024
+
+# errors meaning 'this method is not supported here' rather than a real I/O failure
+setUNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,\
+                         errno.ENOTTY, errno.EBADF, errno.EPERM}
+if hasattr(errno, 'ENOTSUP'):
+    setUNSUPPORTED_ERRNOS.add(errno.ENOTSUP)
+
+sJOURNAL_NAME = '.iq-copy-journal'
+sMANIFEST_NAME = '.iq-manifest'
+sRULES_NAME = '.iq-install-rules'
+iJOURNAL_SYNC_FILES = 256       # fsync the journal after this many entries ...
+fJOURNAL_SYNC_SECONDS = 2.0     # ... or this many seconds
+
+# engine files in the root of a target folder that are never copied or removed
+setINTERNAL_FILES = {sJOURNAL_NAME, sMANIFEST_NAME, sRULES_NAME}
+
+iALIGNED_BUFFER_SIZE = 8 * 1024 * 1024     # erase blocks of USB sticks are 1 - 8 MB
+iSYNC_BATCH_FILES = 128
+iSYNC_BATCH_BYTES = 64 * 1024 * 1024
+
+# policy -> (buffer size or 0 for the backend's own copy, fsync every N files,
+#            fsync every N bytes, fsync everything at the end)
+dWRITE_POLICIES = {
+    sPOLICY_DEFAULT:   (0, 0, 0, False),
+    sPOLICY_BUFFERED:  (iALIGNED_BUFFER_SIZE, 0, 0, False),
+    sPOLICY_BATCHED:   (iALIGNED_BUFFER_SIZE, iSYNC_BATCH_FILES, iSYNC_BATCH_BYTES, False),
+    sPOLICY_FLUSH:     (0, 0, 0, True),
+    sPOLICY_REMOVABLE: (iALIGNED_BUFFER_SIZE, iSYNC_BATCH_FILES, iSYNC_BATCH_BYTES, True),
+    }
+
+sFLUSH_LABEL = "Flushing to disk"
+sDEDUP_LABEL = "Linking identical files"
+
+# smaller files are always copied - a link or clone saves less than an allocation block
+iDEDUP_MIN_SIZE = 4096
+
+
+##########################################################################
+#
+# CopyCancelled
+#
+##########################################################################
+class CopyCancelled(Exception):
+    ''' Raised by the copy engine when the copy is stopped through the cancel event.
+    '''
+    pass
+
+
+##########################################################################
+#
+# CopyProgress
+#
+##########################################################################
+class CopyProgress():
+    ''' Thread-safe counters of files and bytes copied.
+
+        fnCallback (if set) is called with this object after every file. It is called
+        from the copy threads, so it must not touch the GUI directly.
+    '''
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, fnCallback=None):
+        self.fnCallback = fnCallback
+        self.oLock = threading.Lock()
+        self.start(0, 0)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def start(self, iFilesTotal, iBytesTotal, sLabel=None):
+        ''' Reset the counters for a new phase; sLabel (eg. sFLUSH_LABEL) is shown
+            in front of the status of phases other than the copy.
+        '''
+        with self.oLock:
+            self.sLabel = sLabel
+            self.iFilesTotal = iFilesTotal
+            self.iBytesTotal = iBytesTotal
+            self.iFilesDone = 0
+            self.iBytesDone = 0
+            self.fStartTime = time.monotonic()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def addFile(self, iBytes):
+        with self.oLock:
+            self.iFilesDone += 1
+            self.iBytesDone += iBytes
+        if self.fnCallback is not None:
+            self.fnCallback(self)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getElapsedSeconds(self):
+        return time.monotonic() - self.fStartTime
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getBytesPerSecond(self):
+        fElapsed = self.getElapsedSeconds()
+        if fElapsed <= 0:
+            return 0.0
+        return self.iBytesDone / fElapsed
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getFraction(self):
+        ''' Fraction complete (0 - 1) by bytes, or by files for a tree of empty files.
+        '''
+        if self.iBytesTotal > 0:
+            return min(1.0, self.iBytesDone / self.iBytesTotal)
+        if self.iFilesTotal > 0:
+            return min(1.0, self.iFilesDone / self.iFilesTotal)
+        return 1.0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getEtaSeconds(self):
+        ''' Estimated seconds remaining, None until there is a throughput to go by.
+        '''
+        fFraction = self.getFraction()
+        if fFraction <= 0:
+            return None
+        return self.getElapsedSeconds() * (1.0 - fFraction) / fFraction
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def formatStatus(self):
+        ''' eg. "120/4000 files   35.0/810.2 MB   22.4 MB/s   ETA 0:35"
+        '''
+        fEta = self.getEtaSeconds()
+        if fEta is None:
+            sEta = '--:--'
+        else:
+            iEta = int(fEta + 0.5)
+            sEta = '%d:%02d' % (iEta // 60, iEta % 60)
+
+        sStatus = "%d/%d files   %.1f/%.1f MB   %.1f MB/s   ETA %s" \
+                    % (self.iFilesDone, self.iFilesTotal, self.iBytesDone / 1e6, self.iBytesTotal / 1e6,\
+                       self.getBytesPerSecond() / 1e6, sEta)
+        if self.sLabel:
+            sStatus = self.sLabel + "   " + sStatus
+        return sStatus
+
+
+##########################################################################
+#
+# CopyJournal
+#
+##########################################################################
+class CopyJournal():
+    ''' Append-only record of the files completed in a target folder.
+
+        One line per file:  size <tab> mtime_ns <tab> hash or '-' <tab> relative path
+        Lines are written after the file has been copied and its metadata set, and
+        the journal is fsynced in batches, so a listed file is complete.
+    '''
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sTargetDir):
+        self.sTargetDir = sTargetDir
+        self.sPath = os.path.join(sTargetDir, sJOURNAL_NAME)
+        self.fJournal = None
+        self.oLock = threading.Lock()
+        self.iUnsynced = 0
+        self.fLastSync = 0.0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def exists(self):
+        return os.path.isfile(self.sPath)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def load(self):
+        ''' Return relative path -> (size, mtime_ns, hash or None) of a previous run.
+            A truncated last line (interrupted write) is ignored.
+        '''
+        dEntries = {}
+        if not self.exists():
+            return dEntries
+
+        with open(self.sPath, 'r', encoding='utf-8', errors='replace') as fIn:
+            for sLine in fIn:
+                if not sLine.endswith('\n'):
+                    break
+                lFields = sLine.rstrip('\n').split('\t', 3)
+                if len(lFields) != 4:
+                    continue
+                try:
+                    dEntries[lFields[3]] = (int(lFields[0]), int(lFields[1]), None if lFields[2] == '-' else lFields[2])
+                except ValueError:
+                    continue
+        return dEntries
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def open(self):
+        os.makedirs(os.path.dirname(self.sPath), exist_ok=True)
+        self.fJournal = open(self.sPath, 'a', encoding='utf-8')
+        self.fLastSync = time.monotonic()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def record(self, sRelPath, iSize, iMtime, sHash=None):
+        ''' Add a completed file. May be called from several copy threads.
+        '''
+        sLine = "%d\t%d\t%s\t%s\n" % (iSize, iMtime, sHash if sHash else '-', sRelPath)
+        with self.oLock:
+            self.fJournal.write(sLine)
+            self.iUnsynced += 1
+            if self.iUnsynced >= iJOURNAL_SYNC_FILES or time.monotonic() - self.fLastSync >= fJOURNAL_SYNC_SECONDS:
+                self._sync()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _sync(self):
+        self.fJournal.flush()
+        os.fsync(self.fJournal.fileno())
+        self.iUnsynced = 0
+        self.fLastSync = time.monotonic()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        with self.oLock:
+            if self.fJournal is not None:
+                self._sync()
+                self.fJournal.close()
+                self.fJournal = None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def remove(self):
+        self.close()
+        if self.exists():
+            os.remove(self.sPath)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def hasJournal(sTargetDir):
+    ''' True if sTargetDir holds the journal of an interrupted copy.
+    '''
+    return os.path.isfile(os.path.join(sTargetDir, sJOURNAL_NAME))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def createCopyEngine(sBackend, bCompareHash=False, iWorkers=iDEFAULT_WORKERS):
+    ''' Return the CopyEngine for the named backend.
+        The 'copytree' backend is this engine with a single worker, not
+        shutil.copytree (which InstallJob only uses for a new in-place install).
+    '''
+    if sBackend not in lCOPY_BACKENDS:
+        raise ValueError("Unknown copy backend : " + str(sBackend))
+
+    if sBackend == sBACKEND_PARALLEL:
+        return CopyEngine(bCompareHash, iWorkers)
+    if sBackend == sBACKEND_ZEROCOPY:
+        return CopyEngine(bCompareHash, iWorkers, bZeroCopy=True)
+    return CopyEngine(bCompareHash, 1)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def hashFile(sPath):
+    ''' Return the BLAKE2b hex digest of the file contents.
+        Large files are mapped into memory and hashed without copying them into
+        Python buffers; hashlib releases the GIL so several files can be hashed
+        in parallel by worker threads.
+    '''
+    oHash = hashlib.blake2b()
+    with open(sPath, 'rb') as fIn:
+        if os.fstat(fIn.fileno()).st_size >= iHASH_MMAP_MIN_SIZE:
+            try:
+                with mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ) as oMap:
+                    oHash.update(oMap)
+                return oHash.hexdigest()
+            except (OSError, ValueError):
+                pass    # eg. file system without mmap support - read it instead
+        while True:
+            bytesChunk = fIn.read(iHASH_BUFFER_SIZE)
+            if not bytesChunk:
+                break
+            oHash.update(bytesChunk)
+    return oHash.hexdigest()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def findDuplicates(sRootDir, dFiles, setToWrite, dManifest=None, iWorkers=iDEFAULT_WORKERS):
+    ''' Files of setToWrite with the same contents as another file of dFiles
+        (relpath -> (size, mtime_ns), eg. from scanTree of sRootDir).
+
+        Files are indexed by size first: only files of at least iDEDUP_MIN_SIZE bytes
+        that share their size with a file to be written are hashed, by iWorkers
+        threads. The hash of dManifest (relpath -> (size, mtime_ns, hash), see
+        ImageQuizzerManifest) is used while the size and modification time match.
+
+        Returns relpath -> relpath of the original it duplicates. The original is a
+        file that is not written (already in place) where the group has one,
+        otherwise the first file of the group.
+    '''
+    if dManifest is None:
+        dManifest = {}
+
+    dBySize = {}
+    for sRelPath, (iSize, _) in dFiles.items():
+        if iSize >= iDEDUP_MIN_SIZE:
+            dBySize.setdefault(iSize, []).append(sRelPath)
+    lCandidates = [sRelPath for lPaths in dBySize.values()\
+                   if len(lPaths) > 1 and any(sPath in setToWrite for sPath in lPaths) for sRelPath in lPaths]
+
+    dHashes = {}
+    lToHash = []
+    for sRelPath in lCandidates:
+        tupEntry = dManifest.get(sRelPath)
+        if tupEntry is not None and tupEntry[0] == dFiles[sRelPath][0] and tupEntry[1] == dFiles[sRelPath][1]:
+            dHashes[sRelPath] = tupEntry[2]
+        else:
+            lToHash.append(sRelPath)
+    if lToHash:
+        with ThreadPoolExecutor(max_workers=max(1, iWorkers)) as oExecutor:
+            for sRelPath, sHash in zip(lToHash, oExecutor.map(hashFile, [os.path.join(sRootDir, sRelPath)\
+                                                                         for sRelPath in lToHash])):
+                dHashes[sRelPath] = sHash
+
+    dByHash = {}
+    for sRelPath in sorted(lCandidates):
+        dByHash.setdefault((dFiles[sRelPath][0], dHashes[sRelPath]), []).append(sRelPath)
+
+    dOriginals = {}
+    for lPaths in dByHash.values():
+        if len(lPaths) < 2:
+            continue
+        lInPlace = [sRelPath for sRelPath in lPaths if sRelPath not in setToWrite]
+        sOriginal = lInPlace[0] if lInPlace else lPaths[0]
+        for sRelPath in lPaths:
+            if sRelPath != sOriginal and sRelPath in setToWrite:
+                dOriginals[sRelPath] = sOriginal
+    return dOriginals
+
+
+##########################################################################
+#
+# Zero-copy file transfer
+#
+##########################################################################
+
+# (source device, target device) -> methods found to be unsupported
+dUnsupportedMethods = {}
+oUnsupportedLock = threading.Lock()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def copyFileZeroCopy(sSourcePath, sTargetPath, oCancelEvent=None, iBufferSize=0):
+    ''' Copy file contents and metadata using the cheapest method available.
+
+        Methods are tried in order: reflink (FICLONE), os.copy_file_range,
+        os.sendfile and buffered reads (through an aligned buffer of iBufferSize,
+        if given). A method that reports it is not supported between two devices
+        is not tried again for that pair of devices.
+
+        If oCancelEvent is set during the copy, the partial target file is removed
+        and CopyCancelled is raised.
+
+        Returns the name of the method that copied the data.
+    '''
+    try:
+        sMethod = _copyFileData(sSourcePath, sTargetPath, oCancelEvent, iBufferSize)
+    except CopyCancelled:
+        os.remove(sTargetPath)
+        raise
+
+    shutil.copystat(sSourcePath, sTargetPath)
+    return sMethod
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def cloneFile(sOriginalPath, sTargetPath, sMetadataPath=None):
+    ''' Reflink sTargetPath to the data of sOriginalPath (FICLONE - Linux filesystems
+        with shared extents such as Btrfs and XFS) and copy the metadata of sMetadataPath.
+        Raises OSError (errno in setUNSUPPORTED_ERRNOS if cloning is not supported);
+        no partial target is left.
+    '''
+    try:
+        with open(sOriginalPath, 'rb') as fIn, open(sTargetPath, 'wb') as fOut:
+            _copyReflink(fIn.fileno(), fOut.fileno(), 0, None)
+        shutil.copystat(sMetadataPath or sOriginalPath, sTargetPath)
+    except OSError:
+        if os.path.exists(sTargetPath):
+            os.remove(sTargetPath)
+        raise
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _copyFileData(sSourcePath, sTargetPath, oCancelEvent, iBufferSize=0):
+
+    with open(sSourcePath, 'rb') as fIn:
+        oSourceStat = os.fstat(fIn.fileno())
+        with open(sTargetPath, 'wb') as fOut:
+            tupDevices = (oSourceStat.st_dev, os.fstat(fOut.fileno()).st_dev)
+            with oUnsupportedLock:
+                setSkip = set(dUnsupportedMethods.get(tupDevices, ()))
+
+            sMethod = None
+            for sCandidate, fnCopy in ((sMETHOD_REFLINK, _copyReflink),\
+                                       (sMETHOD_COPY_FILE_RANGE, _copyFileRange),\
+                                       (sMETHOD_SENDFILE, _copySendfile)):
+                if sCandidate in setSkip:
+                    continue
+                try:
+                    if fnCopy(fIn.fileno(), fOut.fileno(), oSourceStat.st_size, oCancelEvent):
+                        sMethod = sCandidate
+                        break
+                except OSError as oError:
+                    if oError.errno not in setUNSUPPORTED_ERRNOS:
+                        raise
+                # restart the next method from the beginning of the file
+                fOut.seek(0)
+                fOut.truncate()
+                with oUnsupportedLock:
+                    dUnsupportedMethods.setdefault(tupDevices, set()).add(sCandidate)
+
+            if sMethod is None and iBufferSize > 0:
+                fIn.seek(0)
+                _copyAligned(fIn, fOut, _getAlignedBuffer(iBufferSize), oCancelEvent)
+                sMethod = sMETHOD_ALIGNED
+            elif sMethod is None:
+                fIn.seek(0)
+                while True:
+                    _checkCancel(oCancelEvent)
+                    bytesChunk = fIn.read(iBUFFERED_COPY_SIZE)
+                    if not bytesChunk:
+                        break
+                    fOut.write(bytesChunk)
+                sMethod = sMETHOD_BUFFERED
+
+    return sMethod
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _checkCancel(oCancelEvent):
+    if oCancelEvent is not None and oCancelEvent.is_set():
+        raise CopyCancelled()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _copyReflink(iFdIn, iFdOut, iSize, oCancelEvent):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, "reflink not available")
+    fcntl.ioctl(iFdOut, iFICLONE, iFdIn)
+    return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _copyFileRange(iFdIn, iFdOut, iSize, oCancelEvent):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range not available")
+    iOffset = 0
+    while iOffset < iSize:
+        _checkCancel(oCancelEvent)
+        iCopied = os.copy_file_range(iFdIn, iFdOut, min(iZEROCOPY_CHUNK_SIZE, iSize - iOffset), iOffset, iOffset)
+        if iCopied == 0:
+            # some filesystems return 0 instead of an error when they cannot do it
+            if iOffset == 0:
+                raise OSError(errno.EOPNOTSUPP, "copy_file_range copied no data")
+            break
+        iOffset += iCopied
+    return iOffset >= iSize
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _copySendfile(iFdIn, iFdOut, iSize, oCancelEvent):
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, "sendfile not available")
+    iOffset = 0
+    while iOffset < iSize:
+        _checkCancel(oCancelEvent)
+        iSent = os.sendfile(iFdOut, iFdIn, iOffset, min(iZEROCOPY_CHUNK_SIZE, iSize - iOffset))
+        if iSent == 0:
+            if iOffset == 0:
+                raise OSError(errno.EOPNOTSUPP, "sendfile copied no data")
+            break
+        iOffset += iSent
+    return iOffset >= iSize
+
+
+##########################################################################
+#
+# Write policy
+#
+##########################################################################
+
+oAlignedBuffers = threading.local()     # one buffer per copy thread
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getAlignedBuffer(iBufferSize):
+    ''' Page-aligned buffer of iBufferSize bytes (an anonymous mapping) for the
+        calling thread, kept for the next file.
+    '''
+    oView = getattr(oAlignedBuffers, 'oView', None)
+    if oView is None or len(oView) != iBufferSize:
+        oAlignedBuffers.oMap = mmap.mmap(-1, iBufferSize)
+        oView = oAlignedBuffers.oView = memoryview(oAlignedBuffers.oMap)
+    return oView
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _copyAligned(fIn, fOut, oView, oCancelEvent):
+    while True:
+        _checkCancel(oCancelEvent)
+        iRead = fIn.readinto(oView)
+        if not iRead:
+            break
+        oChunk = oView[:iRead]
+        while len(oChunk):
+            oChunk = oChunk[fOut.write(oChunk):]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def copyFileAligned(sSourcePath, sTargetPath, iBufferSize, oCancelEvent=None):
+    ''' Copy file contents through the thread's aligned buffer with unbuffered
+        reads and writes of iBufferSize bytes, then the metadata.
+        Returns the copy method.
+    '''
+    try:
+        with open(sSourcePath, 'rb', buffering=0) as fIn, open(sTargetPath, 'wb', buffering=0) as fOut:
+            _copyAligned(fIn, fOut, _getAlignedBuffer(iBufferSize), oCancelEvent)
+    except CopyCancelled:
+        os.remove(sTargetPath)
+        raise
+
+    shutil.copystat(sSourcePath, sTargetPath)
+    return sMETHOD_ALIGNED
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def syncFile(sPath, bFull=False):
+    ''' fsync a written file. With bFull on macOS the drive is also asked to
+        write its own cache (F_FULLFSYNC), as an eject would.
+    '''
+    # Windows only flushes handles opened for writing
+    iFd = os.open(sPath, (os.O_RDWR | os.O_BINARY) if os.name == 'nt' else os.O_RDONLY)
+    try:
+        if bFull and fcntl is not None and hasattr(fcntl, 'F_FULLFSYNC'):
+            fcntl.fcntl(iFd, fcntl.F_FULLFSYNC)
+        else:
+            os.fsync(iFd)
+    finally:
+        os.close(iFd)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _syncDir(sDir):
+    ''' fsync a folder so new entries are on the device (not possible on Windows,
+        where the file syncs include their folder entries).
+    '''
+    if os.name == 'nt':
+        return
+    try:
+        iFd = os.open(sDir, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(iFd)
+    except OSError:
+        pass    # eg. EINVAL - the filesystem does not sync folders
+    finally:
+        os.close(iFd)
+
+
+##########################################################################
+#
+# WritePolicy
+#
+##########################################################################
+class WritePolicy():
+    ''' How copied files are written to the target device (see dWRITE_POLICIES).
+
+        The copy code calls copyFile for the data (if usesOwnCopy), fileWritten for
+        every completed file and flush at the end of the copy. fileWritten may be
+        called from several copy threads; the thread that completes a batch syncs
+        it while the others keep copying, one batch at a time.
+
+        Batch syncs are timed as the 'sync' phase and the final flush as the 'flush'
+        phase of oPerfLog.
+    '''
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sName=sPOLICY_DEFAULT):
+        if sName not in dWRITE_POLICIES:
+            raise ValueError("Unknown write policy : " + str(sName))
+        self.sName = sName
+        self.iBufferSize, self.iSyncFiles, self.iSyncBytes, self.bFinalFlush = dWRITE_POLICIES[sName]
+        self.oPerfLog = PerfLog()
+
+        self.oLock = threading.Lock()
+        self.oSyncLock = threading.Lock()
+        self.lPending = []          # (path, size) written since the last sync
+        self.iPendingBytes = 0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def usesOwnCopy(self):
+        return self.iBufferSize > 0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def copyFile(self, sSourcePath, sTargetPath, oCancelEvent=None):
+        return copyFileAligned(sSourcePath, sTargetPath, self.iBufferSize, oCancelEvent)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def fileWritten(self, sTargetPath, iSize):
+        ''' A file has been written completely; sync the batch once it is full.
+        '''
+        if not self.iSyncFiles and not self.iSyncBytes and not self.bFinalFlush:
+            return
+        with self.oLock:
+            self.lPending.append((sTargetPath, iSize))
+            self.iPendingBytes += iSize
+            if (not self.iSyncFiles or len(self.lPending) < self.iSyncFiles) and \
+                    (not self.iSyncBytes or self.iPendingBytes < self.iSyncBytes):
+                return
+            lBatch = self._takePending()
+
+        with self.oPerfLog.phase('sync', files=len(lBatch), bytes=sum(iSize for _, iSize in lBatch)):
+            with self.oSyncLock:
+                for sPath, _ in lBatch:
+                    syncFile(sPath)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _takePending(self):
+        ''' Files not synced yet; the pending list is emptied (lock held).
+        '''
+        lBatch = self.lPending
+        self.lPending = []
+        self.iPendingBytes = 0
+        return lBatch
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def flush(self, oProgress=None):
+        ''' Sync every file written since the last batch and the folders holding
+            them (final flush policies only). Progress is reported to oProgress
+            as a sFLUSH_LABEL phase. A flush is not cancelled - the copy is complete.
+        '''
+        if not self.bFinalFlush:
+            return
+        with self.oLock:
+            lBatch = self._takePending()
+        iBytes = sum(iSize for _, iSize in lBatch)
+
+        if oProgress is not None:
+            oProgress.start(len(lBatch), iBytes, sFLUSH_LABEL)
+        with self.oPerfLog.phase('flush', files=len(lBatch), bytes=iBytes):
+            with self.oSyncLock:
+                for sPath, iSize in lBatch:
+                    syncFile(sPath, bFull=True)
+                    if oProgress is not None:
+                        oProgress.addFile(iSize)
+                for sDir in sorted({os.path.dirname(sPath) for sPath, _ in lBatch}, reverse=True):
+                    _syncDir(sDir)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def scanTree(sRootDir, oRules=None, setExcludedParents=None):
+    ''' Walk the tree under sRootDir using os.scandir.
+
+        Returns a tuple (dFiles, lDirs) where
+            dFiles : relative path -> (size, mtime in ns)
+            lDirs  : relative paths of all sub folders, parents listed before children
+
+        Entries excluded by oRules (see ImageQuizzerInstallRules) are skipped; an
+        excluded folder is not walked at all. The folders holding an excluded entry,
+        and their parents, are added to setExcludedParents (if given) - such a folder
+        cannot be removed as a whole.
+        A missing root returns empty results.
+    '''
+    if oRules is not None and oRules.isEmpty():
+        oRules = None
+
+    dFiles = {}
+    lDirs = []
+
+    if not os.path.isdir(sRootDir):
+        return dFiles, lDirs
+
+    lStack = ['']
+    while lStack:
+        sRelDir = lStack.pop()
+        with os.scandir(os.path.join(sRootDir, sRelDir)) as itEntries:
+            for oEntry in itEntries:
+                sRelPath = os.path.join(sRelDir, oEntry.name)
+                bIsDir = oEntry.is_dir()
+                if oRules is not None and oRules.isExcluded(sRelPath, bIsDir):
+                    if setExcludedParents is not None:
+                        sParent = sRelDir
+                        while sParent != '' and sParent not in setExcludedParents:
+                            setExcludedParents.add(sParent)
+                            sParent = os.path.dirname(sParent)
+                    continue
+                if bIsDir:
+                    lDirs.append(sRelPath)
+                    lStack.append(sRelPath)
+                else:
+                    oStat = oEntry.stat()
+                    dFiles[sRelPath] = (oStat.st_size, oStat.st_mtime_ns)
+
+    lDirs.sort()
+    return dFiles, lDirs
+
+
+##########################################################################
+#
+# CopyPlan
+#
+##########################################################################
+class CopyPlan():
+    ''' List of operations required to make the destination tree match the source.
+    '''
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sSourceDir, sTargetDir, sLinkDir=None):
+
+        self.sSourceDir = sSourceDir
+        self.sTargetDir = sTargetDir
+        self.sLinkDir = sLinkDir
+
+        self.lDirsToCreate = []
+        self.lFilesToCopy = []      # (relative path, size)
+        self.lFilesToLink = []      # (relative path, size) - hard-linked from sLinkDir
+        self.lFilesToReplace = []   # existing target files to be unlinked before copying
+        self.lFilesToRemove = []
+        self.lDirsToRemove = []
+        self.iDirFilesRemoved = 0   # files removed with lDirsToRemove
+        self.lConflicts = []        # preserved target files that differ from the source
+
+        self.iFilesUnchanged = 0
+        self.iBytesUnchanged = 0
+        self.iFilesLinked = 0
+        self.iBytesLinked = 0
+        self.iFilesResumed = 0      # files trusted from the journal of an interrupted copy
+
+        self.lFilesToDedup = []     # (relative path, size, relative path of the identical original)
+        self.iFilesDeduped = 0
+        self.iBytesDeduped = 0      # not written - linked or cloned from the original
+
+        self.dCopyMethods = {}      # relative path -> copy method used
+        self.dDedupMethods = {}     # relative path -> sMETHOD_HARDLINK or sMETHOD_REFLINK
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getBytesToCopy(self):
+        return sum(iSize for _, iSize in self.lFilesToCopy)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getMethodCounts(self):
+        ''' Number of files copied by each copy method.
+        '''
+        dCounts = {}
+        for sMethod in self.dCopyMethods.values():
+            dCounts[sMethod] = dCounts.get(sMethod, 0) + 1
+        return dCounts
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        ''' Short text description of the plan for the status bar.
+        '''
+        sSummary = "%d files copied, %d files removed, %d files unchanged" \
+                    % (len(self.lFilesToCopy), len(self.lFilesToRemove) + self.iDirFilesRemoved, self.iFilesUnchanged)
+        if self.iFilesLinked > 0:
+            sSummary = sSummary + ", %d files (%.1f MB) hard-linked" % (self.iFilesLinked, self.iBytesLinked / 1e6)
+        if self.iFilesDeduped > 0:
+            sSummary = sSummary + ", %d identical files linked or cloned (%.1f MB saved)" \
+                                    % (self.iFilesDeduped, self.iBytesDeduped / 1e6)
+        if self.iFilesResumed > 0:
+            sSummary = sSummary + " (resumed - %d files already copied)" % self.iFilesResumed
+        return sSummary
+
+
+##########################################################################
+#
+# CopyEngine
+#
+##########################################################################
+class CopyEngine():
+    ''' Incremental tree copy.
+
+        Files are considered unchanged when the size matches and the modification time
+        matches (within the FAT timestamp resolution). When bCompareHash is set,
+        files of equal size are compared by content hash instead of modification time.
+
+        With iWorkers > 1 the files are copied by a pool of iWorkers threads.
+        With bZeroCopy set, file data is copied by copyFileZeroCopy instead of shutil.copy2.
+
+        Hard links are never made for files below the folders in lNoLinkDirs
+        (relative to the root). Files below the folders in lPreserveDirs are never
+        removed or overwritten; differing files there are listed as conflicts.
+        Existing target files are unlinked before they are replaced, so a
+        hard-linked snapshot is never modified through the install.
+
+        With bJournal set, completed files are recorded in a CopyJournal in the
+        target so that an interrupted copy can be resumed.
+
+        With oRules (InstallRules) set, excluded paths are pruned from the walk of
+        both trees: they are not copied, and not removed from the target either.
+
+        With bDedup set, files to be copied that are identical to another source file
+        are linked or cloned from that file in the target (see _dedupFiles).
+        dDedupManifest (relpath -> (size, mtime_ns, hash), eg. the cached manifest of
+        the source) saves hashing them. Files below lNoLinkDirs are not deduplicated;
+        files below lCloneOnlyDirs (user data edited in place) are only cloned, never
+        hard-linked. A linked duplicate counts as unchanged while it is still linked
+        to its unchanged original (see _isLinkedDuplicate).
+
+        Copied files are written as set by oWritePolicy (WritePolicy); its final
+        flush is part of executePlan.
+
+        Phase and per-file timings are recorded in oPerfLog (see ImageQuizzerPerfLog).
+
+        Progress is reported to oProgress; setting oCancelEvent stops the copy with
+        CopyCancelled. Files are never left half-written by a cancel.
+    '''
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, bCompareHash=False, iWorkers=1, bZeroCopy=False):
+        self.bCompareHash = bCompareHash
+        self.iWorkers = max(1, int(iWorkers))
+        self.bZeroCopy = bZeroCopy
+        self.lNoLinkDirs = []
+        self.lPreserveDirs = []
+        self.bJournal = False
+        self.oJournal = None
+        self.oRules = None
+        self.bDedup = False
+        self.dDedupManifest = None
+        self.lCloneOnlyDirs = []
+        self.oWritePolicy = WritePolicy()
+        self.oPerfLog = PerfLog()
+
+        self.oProgress = CopyProgress()
+        self.sProgressLabel = None
+        self.oCancelEvent = threading.Event()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isUnchanged(self, sSourcePath, tupSourceStat, sTargetPath, tupTargetStat):
+
+        iSourceSize, iSourceMtime = tupSourceStat
+        iTargetSize, iTargetMtime = tupTargetStat
+
+        if iSourceSize != iTargetSize:
+            return False
+
+        if self.bCompareHash:
+            return hashFile(sSourcePath) == hashFile(sTargetPath)
+
+        return abs(iSourceMtime - iTargetMtime) <= iMTIME_TOLERANCE_NS
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def buildPlan(self, sSourceDir, sTargetDir, sLinkDir=None, dJournal=None):
+        ''' Compare source and destination trees and return a CopyPlan.
+            Files to be copied that are unchanged in sLinkDir are hard-linked instead.
+            Target files listed in dJournal (see CopyJournal.load) with the source's
+            size and modification time are kept without further checks.
+        '''
+        oPlan = CopyPlan(sSourceDir, sTargetDir, sLinkDir)
+        if dJournal is None:
+            dJournal = {}
+
+        dSourceFiles, lSourceDirs = scanTree(sSourceDir, self.oRules)
+        setExcludedParents = set()
+        dTargetFiles, lTargetDirs = scanTree(sTargetDir, self.oRules, setExcludedParents)
+        for sName in setINTERNAL_FILES:
+            dSourceFiles.pop(sName, None)
+            dTargetFiles.pop(sName, None)
+        dLinkFiles = {}
+        if sLinkDir is not None:
+            dLinkFiles, _ = scanTree(sLinkDir, self.oRules)
+        dTargetInodes = {}
+        setNoLinkDirs = set(self.lNoLinkDirs)
+        setPreserveDirs = set(self.lPreserveDirs)
+        setSourceDirs = set(lSourceDirs)
+        setTargetDirs = set(lTargetDirs)
+
+        # stale folders (including folders replaced by a file of the same name)
+        # anything below them is removed with the folder - except in a folder holding
+        # excluded entries, which are left alone while the rest is removed piece by piece
+        setKeptDirs = set()
+        for sRelDir in lTargetDirs:
+            if sRelDir not in setSourceDirs:
+                sParent = os.path.dirname(sRelDir)
+                if sParent == '' or sParent in setSourceDirs or sParent in setKeptDirs:
+                    if self._isBelow(sRelDir, setPreserveDirs):
+                        continue
+                    if sRelDir in setExcludedParents:
+                        setKeptDirs.add(sRelDir)
+                    else:
+                        oPlan.lDirsToRemove.append(sRelDir)
+        setRemovedDirs = set(oPlan.lDirsToRemove)
+
+        for sRelPath in dTargetFiles:
+            if sRelPath not in dSourceFiles or sRelPath in setSourceDirs:
+                if self._isBelow(sRelPath, setRemovedDirs):
+                    oPlan.iDirFilesRemoved += 1
+                elif not self._isBelow(sRelPath, setPreserveDirs):
+                    oPlan.lFilesToRemove.append(sRelPath)
+
+        for sRelDir in lSourceDirs:
+            if sRelDir not in setTargetDirs:
+                oPlan.lDirsToCreate.append(sRelDir)
+
+        for sRelPath, tupSourceStat in dSourceFiles.items():
+            tupTargetStat = dTargetFiles.get(sRelPath)
+            if tupTargetStat is not None and sRelPath not in setTargetDirs:
+                if self._isJournalled(dJournal.get(sRelPath), tupSourceStat, tupTargetStat,\
+                                      os.path.join(sTargetDir, sRelPath)):
+                    oPlan.iFilesUnchanged += 1
+                    oPlan.iBytesUnchanged += tupSourceStat[0]
+                    oPlan.iFilesResumed += 1
+                    continue
+                if self.isUnchanged(os.path.join(sSourceDir, sRelPath), tupSourceStat,\
+                                    os.path.join(sTargetDir, sRelPath), tupTargetStat):
+                    oPlan.iFilesUnchanged += 1
+                    oPlan.iBytesUnchanged += tupSourceStat[0]
+                    continue
+                if self.bDedup and self._isLinkedDuplicate(oPlan, sRelPath, dSourceFiles, dTargetFiles, dTargetInodes):
+                    oPlan.iFilesUnchanged += 1
+                    oPlan.iBytesUnchanged += tupSourceStat[0]
+                    continue
+                if self._isBelow(sRelPath, setPreserveDirs):
+                    oPlan.lConflicts.append(sRelPath)
+                    continue
+                oPlan.lFilesToReplace.append(sRelPath)
+
+            tupLinkStat = dLinkFiles.get(sRelPath)
+            if tupLinkStat is not None and not self._isBelow(sRelPath, setNoLinkDirs):
+                if self.isUnchanged(os.path.join(sSourceDir, sRelPath), tupSourceStat,\
+                                    os.path.join(sLinkDir, sRelPath), tupLinkStat):
+                    oPlan.lFilesToLink.append((sRelPath, tupSourceStat[0]))
+                    continue
+
+            oPlan.lFilesToCopy.append((sRelPath, tupSourceStat[0]))
+
+        if self.bDedup:
+            self._planDedup(oPlan, dSourceFiles, setNoLinkDirs)
+
+        oPlan.lFilesToRemove.sort()
+        oPlan.lFilesToCopy.sort()
+        oPlan.lFilesToLink.sort()
+        oPlan.lConflicts.sort()
+        return oPlan
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _planDedup(self, oPlan, dSourceFiles, setNoLinkDirs):
+        ''' Move the files to be copied that are identical to another source file
+            from lFilesToCopy to lFilesToDedup. Conflicts (the target keeps a different
+            file) are never used as the original.
+        '''
+        setConflicts = set(oPlan.lConflicts)
+        dFiles = {sRelPath: tupStat for sRelPath, tupStat in dSourceFiles.items()\
+                  if sRelPath not in setConflicts and not self._isBelow(sRelPath, setNoLinkDirs)}
+        setToCopy = {sRelPath for sRelPath, _ in oPlan.lFilesToCopy if sRelPath in dFiles}
+        dOriginals = findDuplicates(oPlan.sSourceDir, dFiles, setToCopy, self.dDedupManifest)
+        if not dOriginals:
+            return
+        oPlan.lFilesToCopy = [tupFile for tupFile in oPlan.lFilesToCopy if tupFile[0] not in dOriginals]
+        oPlan.lFilesToDedup = sorted((sRelPath, dSourceFiles[sRelPath][0], sOriginal)\
+                                     for sRelPath, sOriginal in dOriginals.items())
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _isLinkedDuplicate(self, oPlan, sRelPath, dSourceFiles, dTargetFiles, dTargetInodes):
+        ''' True if the target file is a duplicate hard-linked by _dedupFiles to the
+            target file of another source file with the same contents, and that file
+            is unchanged. A linked duplicate has the modification time of its original,
+            so the usual comparison always finds it changed.
+
+            dTargetInodes (size -> (device, inode) -> target relpaths) is filled as the
+            sizes are looked up.
+        '''
+        sTargetPath = os.path.join(oPlan.sTargetDir, sRelPath)
+        try:
+            oStat = os.stat(sTargetPath)
+        except OSError:
+            return False
+        if oStat.st_nlink < 2:
+            return False
+
+        iSize = dSourceFiles[sRelPath][0]
+        if iSize not in dTargetInodes:
+            dInodes = dTargetInodes[iSize] = {}
+            for sPath, tupStat in dTargetFiles.items():
+                if tupStat[0] == iSize:
+                    try:
+                        oPathStat = os.stat(os.path.join(oPlan.sTargetDir, sPath))
+                    except OSError:
+                        continue
+                    dInodes.setdefault((oPathStat.st_dev, oPathStat.st_ino), []).append(sPath)
+
+        for sOriginal in dTargetInodes[iSize].get((oStat.st_dev, oStat.st_ino), []):
+            tupOriginalStat = dSourceFiles.get(sOriginal)
+            if sOriginal == sRelPath or tupOriginalStat is None:
+                continue
+            if tupOriginalStat[0] != iSize or\
+                    abs(tupOriginalStat[1] - dTargetFiles[sOriginal][1]) > iMTIME_TOLERANCE_NS:
+                continue
+            if self._getSourceHash(oPlan, sRelPath, dSourceFiles) == self._getSourceHash(oPlan, sOriginal, dSourceFiles):
+                return True
+        return False
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getSourceHash(self, oPlan, sRelPath, dSourceFiles):
+        ''' Content hash of a source file, from dDedupManifest while it is up to date.
+        '''
+        tupEntry = (self.dDedupManifest or {}).get(sRelPath)
+        if tupEntry is not None and tuple(tupEntry[:2]) == tuple(dSourceFiles[sRelPath]):
+            return tupEntry[2]
+        return hashFile(os.path.join(oPlan.sSourceDir, sRelPath))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _isJournalled(self, tupEntry, tupSourceStat, tupTargetStat, sTargetPath):
+        ''' True if the journal shows the target file was completely copied from the
+            current version of the source file. With hashing on, the target's
+            content is also checked against the recorded hash.
+        '''
+        if tupEntry is None:
+            return False
+
+        iSize, iMtime, sHash = tupEntry
+        if iSize != tupSourceStat[0] or iSize != tupTargetStat[0]:
+            return False
+        if abs(iMtime - tupSourceStat[1]) > iMTIME_TOLERANCE_NS:
+            return False
+        if self.bCompareHash and sHash is not None:
+            return hashFile(sTargetPath) == sHash
+        return True
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _isBelow(self, sRelPath, setDirs):
+        ''' True if sRelPath is one of setDirs or inside one of them.
+        '''
+        sParent = sRelPath
+        while sParent != '':
+            if sParent in setDirs:
+                return True
+            sParent = os.path.dirname(sParent)
+        return False
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def executePlan(self, oPlan, oJournal=None):
+        ''' Apply the plan: remove stale entries, create folders then copy files.
+            File metadata is copied with the data so that the modification time is
+            preserved for the next comparison.
+
+            Completed files are recorded in oJournal (if given).
+        '''
+        sTargetDir = oPlan.sTargetDir
+
+        with self.oPerfLog.phase('delete', files=len(oPlan.lFilesToRemove) + oPlan.iDirFilesRemoved\
+                                 + len(oPlan.lFilesToReplace), dirs=len(oPlan.lDirsToRemove)):
+            for sRelPath in oPlan.lFilesToRemove:
+                self._removeFile(os.path.join(sTargetDir, sRelPath))
+
+            for sRelDir in sorted(oPlan.lDirsToRemove, reverse=True):
+                shutil.rmtree(os.path.join(sTargetDir, sRelDir), onerror=self._onRemoveError)
+
+            for sRelPath in oPlan.lFilesToReplace:
+                self._removeFile(os.path.join(sTargetDir, sRelPath))
+
+        os.makedirs(sTargetDir, exist_ok=True)
+        for sRelDir in oPlan.lDirsToCreate:
+            os.makedirs(os.path.join(sTargetDir, sRelDir), exist_ok=True)
+
+        self.oJournal = oJournal
+        if oJournal is not None:
+            oJournal.open()
+        try:
+            with self.oPerfLog.phase('link') as dPhase:
+                self._linkFiles(oPlan)
+                dPhase['files'] = oPlan.iFilesLinked
+                dPhase['bytes'] = oPlan.iBytesLinked
+
+            self.oProgress.start(len(oPlan.lFilesToCopy), oPlan.getBytesToCopy(), self.sProgressLabel)
+            with self.oPerfLog.phase('copy', files=len(oPlan.lFilesToCopy), bytes=oPlan.getBytesToCopy(),\
+                                     workers=self.iWorkers):
+                if self.iWorkers == 1:
+                    for sRelPath, iSize in oPlan.lFilesToCopy:
+                        self.copyFile(oPlan, sRelPath, iSize)
+                else:
+                    self._copyFilesParallel(oPlan)
+
+            if oPlan.lFilesToDedup:
+                # after the copy - the originals must be in place
+                self.oProgress.start(len(oPlan.lFilesToDedup), sum(iSize for _, iSize, _ in oPlan.lFilesToDedup),\
+                                     sDEDUP_LABEL)
+                with self.oPerfLog.phase('dedup') as dPhase:
+                    self._dedupFiles(oPlan)
+                    dPhase['files'] = oPlan.iFilesDeduped
+                    dPhase['bytes'] = oPlan.iBytesDeduped
+                    dPhase['methods'] = sorted(set(oPlan.dDedupMethods.values()))
+            self.oWritePolicy.flush(self.oProgress)
+        finally:
+            if oJournal is not None:
+                oJournal.close()
+            self.oJournal = None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _linkFiles(self, oPlan):
+        ''' Hard-link the plan's link files from the link folder.
+
+            If the first link fails (filesystem without hard links) all link files
+            are moved to the copy list. Later failures (eg. link count limit)
+            copy just that file.
+        '''
+        bLinksSupported = True
+        for sRelPath, iSize in oPlan.lFilesToLink:
+            _checkCancel(self.oCancelEvent)
+            if bLinksSupported:
+                try:
+                    os.link(os.path.join(oPlan.sLinkDir, sRelPath), os.path.join(oPlan.sTargetDir, sRelPath))
+                    oPlan.iFilesLinked += 1
+                    oPlan.iBytesLinked += iSize
+                    self._recordCompleted(oPlan, sRelPath)
+                    continue
+                except OSError:
+                    if oPlan.iFilesLinked == 0:
+                        bLinksSupported = False
+            oPlan.lFilesToCopy.append((sRelPath, iSize))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _dedupFiles(self, oPlan):
+        ''' Hard-link each duplicate to its original in the target; where the target
+            has no hard links, clone it (reflink) instead, and where it has neither,
+            copy it from the source. As for _linkFiles, a method that fails the first
+            time it is tried is not tried again; later failures (eg. link count limit)
+            copy just that file.
+
+            A linked duplicate has the modification time of its original; buildPlan
+            recognizes it by its inode (see _isLinkedDuplicate). Duplicates below
+            lCloneOnlyDirs, or of an original there, are never hard-linked - editing
+            one would change the other.
+        '''
+        setCloneOnlyDirs = set(self.lCloneOnlyDirs)
+        bLinksSupported = True
+        bClonesSupported = fcntl is not None and sys.platform.startswith('linux')
+        iLinked = iCloned = 0
+        for sRelPath, iSize, sOriginal in oPlan.lFilesToDedup:
+            _checkCancel(self.oCancelEvent)
+            sOriginalPath = os.path.join(oPlan.sTargetDir, sOriginal)
+            sTargetPath = os.path.join(oPlan.sTargetDir, sRelPath)
+
+            sMethod = None
+            if bLinksSupported and not self._isBelow(sRelPath, setCloneOnlyDirs) and\
+                    not self._isBelow(sOriginal, setCloneOnlyDirs):
+                try:
+                    os.link(sOriginalPath, sTargetPath)
+                    sMethod = sMETHOD_HARDLINK
+                    iLinked += 1
+                except OSError:
+                    bLinksSupported = iLinked > 0
+            if sMethod is None and bClonesSupported:
+                try:
+                    cloneFile(sOriginalPath, sTargetPath, os.path.join(oPlan.sSourceDir, sRelPath))
+                    sMethod = sMETHOD_REFLINK
+                    iCloned += 1
+                except OSError as oError:
+                    if oError.errno not in setUNSUPPORTED_ERRNOS:
+                        raise
+                    bClonesSupported = iCloned > 0
+
+            if sMethod is None:
+                oPlan.lFilesToCopy.append((sRelPath, iSize))
+                self.copyFile(oPlan, sRelPath, iSize)
+                continue
+            oPlan.iFilesDeduped += 1
+            oPlan.iBytesDeduped += iSize
+            oPlan.dDedupMethods[sRelPath] = sMethod
+            self._recordCompleted(oPlan, sRelPath)
+            self.oProgress.addFile(iSize)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancel(self):
+        self.oCancelEvent.set()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def copyFile(self, oPlan, sRelPath, iSize):
+        _checkCancel(self.oCancelEvent)
+
+        sSourcePath = os.path.join(oPlan.sSourceDir, sRelPath)
+        sTargetPath = os.path.join(oPlan.sTargetDir, sRelPath)
+
+        fStart = time.perf_counter()
+        if self.bZeroCopy:
+            sMethod = copyFileZeroCopy(sSourcePath, sTargetPath, self.oCancelEvent, self.oWritePolicy.iBufferSize)
+        elif self.oWritePolicy.usesOwnCopy():
+            sMethod = self.oWritePolicy.copyFile(sSourcePath, sTargetPath, self.oCancelEvent)
+        else:
+            shutil.copy2(sSourcePath, sTargetPath)
+            sMethod = sMETHOD_COPY2
+        self.oPerfLog.addFile('copy', sRelPath, iSize, time.perf_counter() - fStart, sMethod)
+        self.oWritePolicy.fileWritten(sTargetPath, iSize)
+
+        oPlan.dCopyMethods[sRelPath] = sMethod
+        self._recordCompleted(oPlan, sRelPath)
+        self.oProgress.addFile(iSize)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _recordCompleted(self, oPlan, sRelPath):
+        ''' Add a completed target file to the journal.
+        '''
+        if self.oJournal is None:
+            return
+        sTargetPath = os.path.join(oPlan.sTargetDir, sRelPath)
+        oStat = os.stat(sTargetPath)
+        sHash = None
+        if self.bCompareHash:
+            sHash = hashFile(sTargetPath)
+        self.oJournal.record(sRelPath, oStat.st_size, oStat.st_mtime_ns, sHash)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _copyFilesParallel(self, oPlan):
+        ''' Copy the plan's files with a bounded pool of worker threads.
+
+            Largest files are started first so that a few big volumes do not
+            end up as the tail of the copy. At most 4 jobs per worker are queued
+            at a time; the first error stops further submissions and is re-raised.
+        '''
+        lJobs = sorted(oPlan.lFilesToCopy, key=lambda tupJob: tupJob[1], reverse=True)
+        iMaxPending = self.iWorkers * 4
+
+        with ThreadPoolExecutor(max_workers=self.iWorkers) as oExecutor:
+            setPending = set()
+            itJobs = iter(lJobs)
+            bSubmitting = True
+            while bSubmitting or setPending:
+                while bSubmitting and len(setPending) < iMaxPending:
+                    tupJob = next(itJobs, None)
+                    if tupJob is None:
+                        bSubmitting = False
+                    else:
+                        setPending.add(oExecutor.submit(self.copyFile, oPlan, tupJob[0], tupJob[1]))
+
+                if setPending:
+                    setDone, setPending = wait(setPending, return_when=FIRST_COMPLETED)
+                    for oFuture in setDone:
+                        if oFuture.exception() is not None:
+                            for oPendingFuture in setPending:
+                                oPendingFuture.cancel()
+                            raise oFuture.exception()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def syncTree(self, sSourceDir, sTargetDir, sLinkDir=None):
+        ''' Make sTargetDir an exact copy of sSourceDir, copying only what changed.
+            Returns the executed CopyPlan.
+        '''
+        oJournal = CopyJournal(sTargetDir) if self.bJournal else None
+        dJournal = oJournal.load() if oJournal is not None else None
+        with self.oPerfLog.phase('walk') as dPhase:
+            oPlan = self.buildPlan(sSourceDir, sTargetDir, sLinkDir, dJournal)
+            dPhase['files'] = oPlan.iFilesUnchanged + len(oPlan.lFilesToCopy) + len(oPlan.lFilesToLink) +\
+                              len(oPlan.lFilesToDedup)
+
+        self.executePlan(oPlan, oJournal)
+        if oJournal is not None:
+            oJournal.remove()
+        return oPlan
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _removeFile(self, sPath):
+        try:
+            os.remove(sPath)
+        except PermissionError:
+            # read-only files (eg. copied from a git checkout) on Windows
+            os.chmod(sPath, stat.S_IWRITE)
+            os.remove(sPath)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _onRemoveError(self, fnFunc, sPath, tupExcInfo):
+        os.chmod(sPath, stat.S_IWRITE)
+        fnFunc(sPath)
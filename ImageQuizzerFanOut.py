@@ -0,0 +1,380 @@
+'''
+    Fan-out provisioning for the Baines Image Quizzer install manager.
+
+    Installs the project folder onto many USB sticks at once (eg. 30-50 reader
+    sticks for a study) while reading every source file only once.
+
+    One reader thread reads each source file in chunks and hands the same chunk
+    to every target. Each target has its own writer thread and a small bounded
+    queue, so the sticks are written concurrently and memory use stays at a few
+    chunks no matter how many targets there are (the chunk objects are shared
+    between the queues).
+
+    Failure isolation:
+        - a target whose writer fails (stick pulled, disk full) is marked failed
+          and dropped; the other targets carry on.
+        - a target that cannot keep up (its queue stays full for fDETACH_SECONDS)
+          is detached: the reader stops waiting for it and the target's writer
+          copies the remaining files from the source on its own, so one slow stick
+          does not hold back the others.
+        - a source file that cannot be read fails the targets waiting for it,
+          with the read error; their writers are stopped, not left waiting.
+
+    Each target is written into '<install>.staging' and renamed into place when
+    complete (the existing install is kept as a .BAK backup), then optionally
+    connected to the Slicer install on the same stick.
+
+    This module is used by the 'fanout' command of ImageQuizzerSetupCLI.py and is
+    bundled into the setup executables by pyinstaller.
+'''
+
+import os
+import queue
+import shutil
+import stat
+import threading
+import time
+
+from ImageQuizzerCopyEngine import CopyProgress, CopyCancelled, scanTree, setINTERNAL_FILES
+from ImageQuizzerInstallJob import getStagingPath
+from ImageQuizzerBackup import getBackupPath
+from ImageQuizzerSlicerSettings import connectModule
+
+
+iFANOUT_CHUNK_SIZE = 256 * 1024
+iFANOUT_QUEUE_CHUNKS = 16           # per target - bounds how far a writer may lag
+fDETACH_SECONDS = 5.0               # queue full this long -> the target reads the source itself
+
+sSTATUS_PENDING = 'pending'
+sSTATUS_COPYING = 'copying'
+sSTATUS_DONE = 'done'
+sSTATUS_FAILED = 'failed'
+sSTATUS_NOT_CONNECTED = 'not connected'     # installed, but connecting to Slicer failed
+sSTATUS_CANCELLED = 'cancelled'
+
+# queue messages
+sMSG_FILE = 'file'
+sMSG_DATA = 'data'
+sMSG_END = 'end'
+sMSG_DONE = 'done'
+
+
+##########################################################################
+#
+# FanOutTarget
+#
+##########################################################################
+class FanOutTarget():
+    ''' One destination of a fan-out install.
+
+        sInstallDir - install folder on the stick
+        sSlicerDir  - Slicer install to connect the module to (None = do not connect)
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sInstallDir, sSlicerDir=None):
+
+        self.sInstallDir = os.path.abspath(sInstallDir)
+        self.sSlicerDir = sSlicerDir
+        self.sStagingDir = getStagingPath(self.sInstallDir)
+
+        self.sStatus = sSTATUS_PENDING
+        self.sError = None
+        self.sBackupDir = None
+        self.sSlicerIni = None
+        self.bDetached = False
+        self.fStartTime = 0.0
+        self.fSeconds = 0.0
+
+        self.oProgress = CopyProgress()
+        self.oQueue = queue.Queue(maxsize=iFANOUT_QUEUE_CHUNKS)
+        self.oThread = None
+        self.iLastComplete = -1     # index of the last file written completely
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isActive(self):
+        return self.sStatus == sSTATUS_COPYING and not self.bDetached
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getResult(self):
+        return {'target': self.sInstallDir, 'status': self.sStatus, 'error': self.sError,\
+                'backup': self.sBackupDir, 'slicer_ini': self.sSlicerIni, 'detached': self.bDetached,\
+                'files': self.oProgress.iFilesDone, 'bytes': self.oProgress.iBytesDone,\
+                'seconds': round(self.fSeconds, 3)}
+
+
+##########################################################################
+#
+# FanOut
+#
+##########################################################################
+class FanOut():
+    ''' Copy sSourceDir to every FanOutTarget, reading the source once.
+
+        bBackup   - rename an existing install to <install>.BAK-<date> (otherwise delete it)
+        oRules    - InstallRules selecting the files to install (None = everything)
+        fnProgress(oFanOut) is called from the reader thread after every source file.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sSourceDir, lTargets, fnProgress=None):
+
+        self.sSourceDir = sSourceDir
+        self.lTargets = lTargets
+        self.fnProgress = fnProgress
+        self.bBackup = True
+        self.oRules = None
+        self.oCancelEvent = threading.Event()
+
+        self.lFiles = []        # [(relpath, size)]
+        self.lDirs = []
+        self.iBytesTotal = 0
+        self.iFilesRead = 0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancel(self):
+        self.oCancelEvent.set()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        ''' Install to all targets. Returns the list of FanOutTarget.getResult() dictionaries.
+            A failing target does not raise; check each result's status.
+        '''
+        dFiles, self.lDirs = scanTree(self.sSourceDir, self.oRules)
+        for sName in setINTERNAL_FILES:
+            dFiles.pop(sName, None)
+        self.lFiles = sorted((sRelPath, tupStat[0]) for sRelPath, tupStat in dFiles.items())
+        self.iBytesTotal = sum(iSize for _, iSize in self.lFiles)
+
+        for oTarget in self.lTargets:
+            self._startTarget(oTarget)
+
+        try:
+            self._readSource()
+        finally:
+            for oTarget in self.lTargets:
+                if oTarget.oThread is not None:
+                    oTarget.oThread.join()
+
+        for oTarget in self.lTargets:
+            if oTarget.sStatus == sSTATUS_COPYING:
+                self._finishTarget(oTarget)
+        return [oTarget.getResult() for oTarget in self.lTargets]
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        dCounts = {}
+        for oTarget in self.lTargets:
+            dCounts[oTarget.sStatus] = dCounts.get(oTarget.sStatus, 0) + 1
+        return ", ".join("%d %s" % (iCount, sStatus) for sStatus, iCount in sorted(dCounts.items()))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _startTarget(self, oTarget):
+        ''' Prepare the staging folder and start the target's writer thread.
+        '''
+        try:
+            if os.path.exists(oTarget.sStagingDir):
+                shutil.rmtree(oTarget.sStagingDir, onerror=_onRemoveError)
+            for sRelDir in [''] + self.lDirs:
+                os.makedirs(os.path.join(oTarget.sStagingDir, sRelDir), exist_ok=True)
+        except OSError as oError:
+            self._fail(oTarget, oError)
+            return
+
+        oTarget.sStatus = sSTATUS_COPYING
+        oTarget.oProgress.start(len(self.lFiles), self.iBytesTotal)
+        oTarget.fStartTime = time.monotonic()
+        oTarget.oThread = threading.Thread(target=self._writeTarget, args=(oTarget,),\
+                                           name='iq-fanout-' + os.path.basename(oTarget.sInstallDir))
+        oTarget.oThread.start()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _readSource(self):
+        ''' Read every source file once and pass its chunks to the active targets.
+            A file that cannot be read fails every target still waiting for it
+            (detached targets read the source themselves).
+        '''
+        try:
+            for iIndex, (sRelPath, iSize) in enumerate(self.lFiles):
+                if self.oCancelEvent.is_set():
+                    break
+                if not any(oTarget.isActive() for oTarget in self.lTargets):
+                    break
+
+                self._broadcast((sMSG_FILE, iIndex))
+                try:
+                    with open(os.path.join(self.sSourceDir, sRelPath), 'rb') as fIn:
+                        while True:
+                            bytesChunk = fIn.read(iFANOUT_CHUNK_SIZE)
+                            if not bytesChunk:
+                                break
+                            self._broadcast((sMSG_DATA, bytesChunk))
+                except OSError as oError:
+                    for oTarget in self.lTargets:
+                        if oTarget.isActive():
+                            self._fail(oTarget, "Cannot read the source file " + sRelPath + " : "\
+                                       + (oError.strerror or str(oError)))
+                    break
+                self._broadcast((sMSG_END, iIndex))
+                self.iFilesRead = iIndex + 1
+
+                if self.fnProgress is not None:
+                    self.fnProgress(self)
+
+        finally:
+            # also after an error - the writers wait for this (failed ones stop on their own)
+            self._broadcast((sMSG_DONE, None))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _broadcast(self, tupMsg):
+        ''' Put the message on every active target's queue. A target whose queue
+            stays full for fDETACH_SECONDS is detached and catches up on its own.
+        '''
+        for oTarget in self.lTargets:
+            if not oTarget.isActive():
+                continue
+            try:
+                oTarget.oQueue.put(tupMsg, timeout=fDETACH_SECONDS)
+            except queue.Full:
+                oTarget.bDetached = True
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _writeTarget(self, oTarget):
+        ''' Writer thread of one target: write the chunks from its queue and, once
+            detached, copy the remaining files from the source directly.
+        '''
+        fOut = None
+        sTargetPath = None
+        try:
+            while True:
+                if self.oCancelEvent.is_set():
+                    raise CopyCancelled()
+                try:
+                    sMsg, oValue = oTarget.oQueue.get(timeout=0.2)
+                except queue.Empty:
+                    if oTarget.bDetached or oTarget.sStatus != sSTATUS_COPYING:
+                        break
+                    continue
+
+                if sMsg == sMSG_FILE:
+                    sRelPath, iSize = self.lFiles[oValue]
+                    sTargetPath = os.path.join(oTarget.sStagingDir, sRelPath)
+                    fOut = open(sTargetPath, 'wb')
+                elif sMsg == sMSG_DATA:
+                    fOut.write(oValue)
+                elif sMsg == sMSG_END:
+                    fOut.close()
+                    fOut = None
+                    self._completeFile(oTarget, oValue)
+                else:   # sMSG_DONE
+                    break
+
+            if fOut is not None:
+                fOut.close()
+                fOut = None
+
+            if oTarget.bDetached:
+                # the rest of the files (including any partly written one) from the source
+                for iIndex in range(oTarget.iLastComplete + 1, len(self.lFiles)):
+                    if self.oCancelEvent.is_set():
+                        raise CopyCancelled()
+                    sRelPath, _ = self.lFiles[iIndex]
+                    shutil.copyfile(os.path.join(self.sSourceDir, sRelPath), os.path.join(oTarget.sStagingDir, sRelPath))
+                    self._completeFile(oTarget, iIndex)
+
+            if self.oCancelEvent.is_set():
+                raise CopyCancelled()
+
+        except CopyCancelled:
+            oTarget.sStatus = sSTATUS_CANCELLED
+        except Exception as oError:
+            self._fail(oTarget, oError)
+        finally:
+            if fOut is not None:
+                fOut.close()
+            oTarget.fSeconds = time.monotonic() - oTarget.fStartTime
+            if oTarget.sStatus != sSTATUS_COPYING:
+                # drain so the reader is never blocked by a stopped writer
+                while True:
+                    try:
+                        oTarget.oQueue.get_nowait()
+                    except queue.Empty:
+                        break
+                shutil.rmtree(oTarget.sStagingDir, onerror=_onRemoveError)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _completeFile(self, oTarget, iIndex):
+        sRelPath, iSize = self.lFiles[iIndex]
+        shutil.copystat(os.path.join(self.sSourceDir, sRelPath), os.path.join(oTarget.sStagingDir, sRelPath))
+        oTarget.iLastComplete = iIndex
+        oTarget.oProgress.addFile(iSize)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _finishTarget(self, oTarget):
+        ''' Check the staged copy, swap it into place and connect it to Slicer.
+        '''
+        try:
+            dStaged, _ = scanTree(oTarget.sStagingDir)
+            for sRelPath, iSize in self.lFiles:
+                if sRelPath not in dStaged or dStaged[sRelPath][0] != iSize:
+                    raise OSError("Copy incomplete : " + sRelPath)
+
+            if os.path.exists(oTarget.sInstallDir):
+                if self.bBackup:
+                    oTarget.sBackupDir = getBackupPath(oTarget.sInstallDir)
+                    os.rename(oTarget.sInstallDir, oTarget.sBackupDir)
+                else:
+                    shutil.rmtree(oTarget.sInstallDir, onerror=_onRemoveError)
+            os.rename(oTarget.sStagingDir, oTarget.sInstallDir)
+
+        except Exception as oError:
+            self._fail(oTarget, oError)
+            return
+
+        try:
+            if oTarget.sSlicerDir is not None:
+                oTarget.sSlicerIni, _ = connectModule(oTarget.sInstallDir, oTarget.sSlicerDir)
+            oTarget.sStatus = sSTATUS_DONE
+        except Exception as oError:
+            oTarget.sStatus = sSTATUS_NOT_CONNECTED
+            oTarget.sError = str(oError)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _fail(self, oTarget, oError):
+        oTarget.sStatus = sSTATUS_FAILED
+        oTarget.sError = str(oError)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def readTargetsFile(sPath, sSlicerDir=None):
+    ''' Read a list of targets, one per line: <install folder>[<tab><Slicer folder>].
+        Empty lines and lines starting with '#' are ignored. Targets without their
+        own Slicer folder use sSlicerDir (see getSlicerDir).
+    '''
+    lTargets = []
+    with open(sPath, 'r', encoding='utf-8') as fIn:
+        for sLine in fIn:
+            sLine = sLine.strip()
+            if sLine == '' or sLine.startswith('#'):
+                continue
+            lFields = sLine.split('\t')
+            sInstallDir = lFields[0].strip()
+            if len(lFields) > 1 and lFields[1].strip():
+                lTargets.append(FanOutTarget(sInstallDir, lFields[1].strip()))
+            else:
+                lTargets.append(FanOutTarget(sInstallDir, getSlicerDir(sInstallDir, sSlicerDir)))
+    return lTargets
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getSlicerDir(sInstallDir, sSlicerDir):
+    ''' A relative Slicer folder is taken relative to the folder holding the
+        install, ie. a Slicer install next to Image Quizzer on the same stick.
+    '''
+    if sSlicerDir is None or os.path.isabs(sSlicerDir):
+        return sSlicerDir
+    return os.path.join(os.path.dirname(os.path.abspath(sInstallDir)), sSlicerDir)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _onRemoveError(fnFunc, sPath, tupExcInfo):
+    if not os.path.lexists(sPath):
+        return
+    os.chmod(sPath, stat.S_IWRITE)
+    fnFunc(sPath)
@@ -0,0 +1,626 @@
+'''
+    Install job for the Baines Image Quizzer install manager.
+
+    Qt-free description of one install: source, destination and copy options.
+    InstallerLogic collects the user's answers (backup, confirmation) in the GUI
+    thread and then runs the InstallJob on a worker thread, so the window stays
+    responsive and the copy can be cancelled.
+
+    A staged install copies into a sibling '<install>.staging' folder, verifies it
+    and then swaps it into place with renames, so Slicer never sees a half-written
+    module and a failed or cancelled copy leaves the existing install untouched.
+
+    Every copy keeps a journal of completed files in its target folder. If an install
+    is interrupted (stick unplugged, laptop asleep, error), running it again resumes
+    from the journal instead of starting over.
+
+    With verification on, the install is checked against a content manifest of the
+    source (see ImageQuizzerManifest.py) by parallel hashing, and the manifest is
+    written into the install so it can be verified again later with --verify.
+
+    The source may also be a release archive (.zip, .tar.gz); its members are
+    streamed straight into the target folder (see ImageQuizzerReleaseArchive.py).
+
+    What is installed is selected by an install profile and optional rules file
+    (see ImageQuizzerInstallRules.py); excluded folders are pruned from every walk.
+
+    Instead of a .BAK folder, the Inputs and Outputs of the previous install may be
+    kept in a compressed, deduplicated archive (see ImageQuizzerArchiveStore.py),
+    built on a background thread after the new install is in place.
+
+    Each phase of the install (walk, delete, copy with per-file timings, verify,
+    swap ...) is timed in '<install>.iq-perf.jsonl' (see ImageQuizzerPerfLog.py).
+
+    This module is imported by ImageQuizzerInstallManager.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import os
+import shutil
+import stat
+import threading
+import time
+
+from ImageQuizzerCopyEngine import createCopyEngine, scanTree, CopyProgress, CopyCancelled, CopyJournal, \
+                                  WritePolicy, hasJournal, setINTERNAL_FILES, sBACKEND_COPYTREE, iDEFAULT_WORKERS, \
+                                  sPOLICY_DEFAULT, sMETHOD_COPY2
+from ImageQuizzerManifest import getSourceManifest, verifyManifest, saveManifest, getManifestPath, loadManifest
+from ImageQuizzerReleaseArchive import ReleaseArchive, isReleaseArchive
+from ImageQuizzerInstallRules import loadRules, sDEFAULT_PROFILE
+from ImageQuizzerBackup import getLatestBackup, pruneBackups, getPreservePath, moveUserData, linkUserData, \
+                               moveToBackup, BackupMoveError, lUSER_DATA_DIRS
+from ImageQuizzerArchiveStore import ArchiveStore, ArchiveTask, getStorePath
+from ImageQuizzerPerfLog import PerfLog, getPerfLogPath, isProfileRequested
+
+
+sSTAGING_SUFFIX = '.staging'
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getStagingPath(sInstallDir):
+    ''' Sibling folder the new install is copied into before it is swapped into place.
+    '''
+    return os.path.abspath(str(sInstallDir)) + sSTAGING_SUFFIX
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def hasInterruptedInstall(sInstallDir, bStaged):
+    ''' True if a previous install into sInstallDir stopped part way and will be resumed.
+    '''
+    if bStaged:
+        return hasJournal(getStagingPath(sInstallDir))
+    return hasJournal(sInstallDir)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isPartialInstall(sInstallDir):
+    ''' True if sInstallDir holds an interrupted in-place copy rather than a complete
+        install, so there is nothing in it to back up. (A staged install resumes in
+        '<install>.staging' - the install folder still holds the previous install.)
+    '''
+    return hasJournal(sInstallDir)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _onRemoveError(fnFunc, sPath, tupExcInfo):
+    os.chmod(sPath, stat.S_IWRITE)
+    fnFunc(sPath)
+
+
+##########################################################################
+#
+# InstallVerifyError
+#
+##########################################################################
+class InstallVerifyError(Exception):
+    ''' Raised when the copied tree does not match the source.
+    '''
+    pass
+
+
+##########################################################################
+#
+# InstallJob
+#
+##########################################################################
+class InstallJob():
+    ''' Copy the project folder (or release archive) sSourceDir into sInstallDir.
+
+        Options (set as attributes before calling run):
+            bIncremental  - copy only new or changed files, remove stale files
+            bCompareHash  - (incremental and resumed copies) compare files by content hash
+                            instead of size and modification time
+            sCopyBackend  - 'copytree', 'parallel' or 'zerocopy' ('copytree' runs
+                            shutil.copytree only for a new in-place install,
+                            else the copy engine with one worker)
+            iCopyWorkers  - threads used by the parallel backends
+            sWritePolicy  - how files are written to the target: 'default', 'buffered',
+                            'batched', 'flush' or 'removable' (see ImageQuizzerCopyEngine)
+            bSnapshot     - hard-link files that are unchanged in the newest .BAK snapshot
+                            instead of copying them
+            bDedup        - (project folders) write files with identical contents once and
+                            hard-link or clone the duplicates (see ImageQuizzerCopyEngine);
+                            duplicates in Inputs and Outputs are only cloned
+            iKeepBackups  - delete all but the newest iKeepBackups .BAK folders after
+                            a successful install (None or 0 keeps all)
+            bPreserveUserData - carry the Inputs and Outputs folders of the existing
+                            install (or of sBackupDir) into the new install by renaming
+            sBackupDir    - folder the caller renamed the existing install to, if any
+            bMoveToBackup - sBackupDir does not exist yet: run() moves the existing install
+                            there (a rename, or a checked copy if sBackupDir is on another
+                            drive - see ImageQuizzerBackup.moveToBackup); first, or for a
+                            staged install at the swap
+            sBackupRoot   - folder holding the .BAK folders and the archive store (default:
+                            next to the install)
+            bArchiveBackup - (without sBackupDir) add the Inputs and Outputs of the existing
+                            install to the archive store instead; the old install is kept
+                            until oArchiveTask has archived them after run() - see below
+            bStaged       - (full installs) copy into <install>.staging, verify, then swap
+                            it into place; on failure the existing install is kept
+            bVerify       - hash the copied files against the source manifest (otherwise
+                            staged installs only check file sizes)
+            sProfile      - install profile: 'code', 'code+samples' (default) or 'full'
+            sRulesFile    - rules file with extra patterns (default: .iq-install-rules
+                            in the source folder, if any)
+
+        After run(), lConflicts lists user files that differ from the files of the
+        same name in the release. The user's version is kept.
+
+        With bArchiveBackup, run() starts oArchiveTask on a background thread just
+        before it returns. Callers wait for the task before exiting; it prunes the
+        store to iKeepBackups snapshots. An incremental install changes the existing
+        install, so its user data is first hard-linked into a sibling folder that is
+        archived; where hard links fail it is archived on the job's thread before the
+        copy, and a failed archive raises BackupMoveError with the install unchanged.
+
+        oPerfLog times the install; callers add their own phases (pre-flight,
+        backup rename) before run(), which writes the summary. Set
+        oPerfLog.bProfile to also run the install under cProfile.
+
+        Files below lNO_LINK_DIRS are always copied: Image Quizzer writes results
+        there and a hard link would let those writes change the snapshot.
+    '''
+
+    lNO_LINK_DIRS = ['Outputs']
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sSourceDir, sInstallDir, fnProgress=None):
+
+        self.sSourceDir = sSourceDir
+        self.sInstallDir = sInstallDir
+
+        self.bIncremental = False
+        self.bCompareHash = False
+        self.sCopyBackend = sBACKEND_COPYTREE
+        self.iCopyWorkers = iDEFAULT_WORKERS
+        self.sWritePolicy = sPOLICY_DEFAULT
+        self.bSnapshot = False
+        self.bDedup = False
+        self.iKeepBackups = None
+        self.bPreserveUserData = False
+        self.sBackupDir = None
+        self.bMoveToBackup = False
+        self.sBackupRoot = None
+        self.bArchiveBackup = False
+        self.bStaged = False
+        self.bVerify = False
+        self.sProfile = sDEFAULT_PROFILE
+        self.sRulesFile = None
+
+        self.oRules = None
+        self.oWritePolicy = None
+        self.lConflicts = []
+        self.oVerifyReport = None
+        self.oBackupMove = None
+        self.oArchiveTask = None
+
+        self.oPerfLog = PerfLog(getPerfLogPath(sInstallDir), isProfileRequested())
+        self.oProgress = CopyProgress(fnProgress)
+        self.oEngine = None
+        self.oCopytreeJournal = None
+        self.bCancelRequested = False
+        self.oCancelEvent = threading.Event()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancel(self):
+        ''' Request the copy to stop after the files currently being copied.
+            May be called from any thread.
+        '''
+        self.bCancelRequested = True
+        self.oCancelEvent.set()
+        if self.oEngine is not None:
+            self.oEngine.cancel()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        ''' Perform the copy. Returns a short summary for the status bar.
+            Raises CopyCancelled if cancel() was called before the copy finished.
+        '''
+        self.oPerfLog.startProfiler()
+        self.oPerfLog.record('job', source=str(self.sSourceDir), incremental=self.bIncremental,\
+                             compare_hash=self.bCompareHash,\
+                             backend=self.sCopyBackend, workers=self.iCopyWorkers, write_policy=self.sWritePolicy,\
+                             snapshot=self.bSnapshot, dedup=self.bDedup,\
+                             staged=self.bStaged, verify=self.bVerify, profile=self.sProfile,\
+                             preserve_user_data=self.bPreserveUserData, archive_backup=self.bArchiveBackup)
+        sStatus = 'error'
+        try:
+            sMsg = self._run()
+            sStatus = 'ok'
+            return sMsg
+        except CopyCancelled:
+            sStatus = 'cancelled'
+            raise
+        finally:
+            self.oPerfLog.close(sStatus)
+            # the previous install is only removed by the task, so it runs whatever the outcome
+            if self.oArchiveTask is not None and not self.oArchiveTask.isDone():
+                self.oArchiveTask.start()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _run(self):
+        self.getRules()     # an unknown profile or write policy fails before anything is touched
+        self.oWritePolicy = WritePolicy(self.sWritePolicy)
+        self.oWritePolicy.oPerfLog = self.oPerfLog
+        if self.bMoveToBackup and self.sBackupDir is not None and not self._isStagedFull():
+            self._moveToBackup()
+        if self.bIncremental:
+            if self._isArchiving() and os.path.isdir(self.sInstallDir):
+                self._archiveBeforeCopy()
+            sMsg = self._copy(self.sInstallDir, self._getSnapshotLinkDir())
+        elif not self.bStaged and hasJournal(self.sInstallDir):
+            sMsg = self._copy(self.sInstallDir, self._getSnapshotLinkDir(), bResume=True)
+        elif self.bStaged:
+            sMsg = self._runStaged()
+        else:
+            sMsg = self._runInPlace()
+
+        if self.bVerify and (self.bIncremental or not self.bStaged):
+            self.verifyTree(self.sInstallDir)
+        if self.oVerifyReport is not None:
+            sMsg = sMsg + " - " + self.oVerifyReport.getSummary()
+        elif os.path.exists(getManifestPath(self.sInstallDir)):
+            # left by an earlier verified install - no longer describes the files
+            os.remove(getManifestPath(self.sInstallDir))
+
+        if self.lConflicts:
+            sMsg = sMsg + " - %d user file(s) differ from the release" % len(self.lConflicts)
+        if self.oBackupMove is not None and self.oBackupMove.bCrossDevice:
+            sMsg = sMsg + " - " + self.oBackupMove.getSummary()
+        if self.oArchiveTask is not None and self.oArchiveTask.isDone():
+            sMsg = sMsg + " - " + self.oArchiveTask.getSummary()
+
+        with self.oPerfLog.phase('prune') as dPhase:
+            lPruned = pruneBackups(self.sInstallDir, self.iKeepBackups, self.sBackupRoot)
+            dPhase['backups'] = len(lPruned)
+        if lPruned:
+            sMsg = sMsg + " - %d old backup(s) removed" % len(lPruned)
+        return sMsg
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getRules(self):
+        ''' InstallRules of the job's profile and rules file (loaded once).
+        '''
+        if self.oRules is None:
+            self.oRules = loadRules(self.sSourceDir, self.sProfile, self.sRulesFile)
+        return self.oRules
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _isStagedFull(self):
+        return self.bStaged and not self.bIncremental
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _moveToBackup(self):
+        self.oBackupMove = moveToBackup(self.sInstallDir, self.sBackupDir, self.iCopyWorkers, self.oProgress,\
+                                        self.oCancelEvent, self.oPerfLog)
+        # with a '-N' suffix if another install took the name since
+        self.sBackupDir = self.oBackupMove.sBackupDir
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _isArchiving(self):
+        return self.bArchiveBackup and self.sBackupDir is None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _setArchive(self, sSourceDir, sRemoveDir=None):
+        ''' Archive the user data of sSourceDir (then delete sRemoveDir) - see oArchiveTask.
+        '''
+        oStore = ArchiveStore(getStorePath(self.sInstallDir, self.sBackupRoot), self.iCopyWorkers)
+        self.oArchiveTask = ArchiveTask(oStore, sSourceDir, sRemoveDir, self.iKeepBackups, self.oPerfLog)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _archiveBeforeCopy(self):
+        ''' Keep the user data of an install that is about to be changed in place for
+            oArchiveTask: hard-linked into a sibling folder (the copy replaces files by
+            unlinking them), archived and removed after run(). Where hard links fail,
+            archive it now; if that fails the install is not touched.
+        '''
+        sArchiveDir = getPreservePath(self.sInstallDir)
+        try:
+            with self.oPerfLog.phase('link') as dPhase:
+                dPhase['files'] = linkUserData(self.sInstallDir, sArchiveDir, self.lNO_LINK_DIRS)
+            self._setArchive(sArchiveDir, sArchiveDir)
+            return
+        except OSError:
+            if os.path.exists(sArchiveDir):
+                shutil.rmtree(sArchiveDir, onerror=_onRemoveError)
+
+        self._setArchive(self.sInstallDir)
+        self.oArchiveTask.run()
+        if self.oArchiveTask.sStatus == 'cancelled':
+            raise CopyCancelled()
+        if self.oArchiveTask.sStatus != 'ok':
+            raise BackupMoveError("The Inputs and Outputs could not be archived (the install was left as it was): "\
+                                  + str(self.oArchiveTask.oError))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getSnapshotLinkDir(self):
+        if self.bSnapshot:
+            return getLatestBackup(self.sInstallDir, self.sBackupRoot)
+        return None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _runInPlace(self):
+        ''' Delete the existing install and copy the new one into its place.
+            (An install folder holding the journal of an interrupted copy is resumed
+            by run() instead.)
+        '''
+        sLinkDir = self._getSnapshotLinkDir()
+
+        # user data of a previous install to carry into the new one
+        sPreserveDir = None
+        if self.bPreserveUserData:
+            if self.sBackupDir is not None:
+                sPreserveDir = self.sBackupDir
+            elif os.path.exists(self.sInstallDir):
+                sPreserveDir = getPreservePath(self.sInstallDir)
+                os.rename(self.sInstallDir, sPreserveDir)
+            if sPreserveDir is not None and self._isArchiving():
+                # the user data is carried into the new install - archived from there
+                self._setArchive(self.sInstallDir)
+        elif self._isArchiving() and os.path.exists(self.sInstallDir):
+            sArchiveDir = getPreservePath(self.sInstallDir)
+            os.rename(self.sInstallDir, sArchiveDir)
+            self._setArchive(sArchiveDir, sArchiveDir)
+
+        if os.path.exists(self.sInstallDir):
+            with self.oPerfLog.phase('delete', dirs=1):
+                shutil.rmtree(self.sInstallDir)
+
+        try:
+            sMsg = self._copy(self.sInstallDir, sLinkDir)
+
+        finally:
+            # also after a cancel or error - the user data must not be left behind
+            # in a temporary folder
+            if sPreserveDir is not None and os.path.isdir(self.sInstallDir):
+                with self.oPerfLog.phase('preserve'):
+                    self.lConflicts.extend(moveUserData(sPreserveDir, self.sInstallDir))
+                    if sPreserveDir != self.sBackupDir:
+                        shutil.rmtree(sPreserveDir)
+
+        return sMsg
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _runStaged(self):
+        ''' Copy into a sibling staging folder, verify it, then swap it into place
+            with two renames. The existing install is not touched until the new one
+            is complete, and it is restored if the swap fails.
+
+            Unchanged files are hard-linked from the existing install (or from the
+            newest snapshot in snapshot mode) where the filesystem allows it.
+
+            With bMoveToBackup the existing install is only moved to sBackupDir once
+            the new install is complete and verified; until then it stays in place
+            (and is the newest snapshot to link from).
+        '''
+        sStagingDir = getStagingPath(self.sInstallDir)
+        if os.path.exists(sStagingDir) and not hasJournal(sStagingDir):
+            # left behind without a journal - cannot tell what is complete
+            shutil.rmtree(sStagingDir, onerror=_onRemoveError)
+
+        bMoveToBackup = self.bMoveToBackup and self.sBackupDir is not None and os.path.isdir(self.sInstallDir)
+        sLinkDir = self._getSnapshotLinkDir()
+        if os.path.isdir(self.sInstallDir) and (sLinkDir is None or bMoveToBackup):
+            sLinkDir = self.sInstallDir
+
+        try:
+            sMsg = self._copy(sStagingDir, sLinkDir, bResume=True)
+            self.verifyTree(sStagingDir)
+        except (CopyCancelled, InstallVerifyError):
+            shutil.rmtree(sStagingDir, onerror=_onRemoveError)
+            raise
+        # any other error keeps the staging folder and its journal so that
+        # the next run can resume
+
+        # a backup on another drive is copied before the install is removed - if that
+        # fails or is cancelled, the install is left as it was
+        sRestoreDir = None
+        if bMoveToBackup:
+            try:
+                self._moveToBackup()
+            except (CopyCancelled, BackupMoveError):
+                shutil.rmtree(sStagingDir, onerror=_onRemoveError)
+                raise
+            if not self.oBackupMove.bCrossDevice:
+                sRestoreDir = self.sBackupDir
+
+        # swap - the window without a complete install is two renames
+        sOldDir = None
+        with self.oPerfLog.phase('swap'):
+            if os.path.exists(self.sInstallDir):
+                sOldDir = getPreservePath(self.sInstallDir)
+                os.rename(self.sInstallDir, sOldDir)
+                sRestoreDir = sOldDir
+            try:
+                os.rename(sStagingDir, self.sInstallDir)
+            except:
+                if sRestoreDir is not None:
+                    os.rename(sRestoreDir, self.sInstallDir)
+                shutil.rmtree(sStagingDir, onerror=_onRemoveError)
+                raise
+
+        if self.bPreserveUserData:
+            sPreserveDir = self.sBackupDir if self.sBackupDir is not None else sOldDir
+            if sPreserveDir is not None:
+                with self.oPerfLog.phase('preserve'):
+                    self.lConflicts.extend(moveUserData(sPreserveDir, self.sInstallDir))
+
+        if sOldDir is not None and self._isArchiving():
+            if self.bPreserveUserData:
+                self._setArchive(self.sInstallDir)
+            else:
+                # kept until its user data is archived
+                self._setArchive(sOldDir, sOldDir)
+                sOldDir = None
+
+        if sOldDir is not None:
+            with self.oPerfLog.phase('delete', dirs=1):
+                shutil.rmtree(sOldDir, onerror=_onRemoveError)
+
+        return sMsg
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def verifyTree(self, sTargetDir):
+        ''' Check that every source file is in sTargetDir with the same size
+            (and with bVerify, the same content hash).
+            Raises InstallVerifyError listing the first differences.
+        '''
+        with self.oPerfLog.phase('verify', hashed=self.bVerify) as dPhase:
+            if self.bVerify:
+                try:
+                    self._verifyManifest(sTargetDir)
+                finally:
+                    if self.oVerifyReport is not None:
+                        dPhase['files'] = self.oVerifyReport.iFilesChecked
+                        dPhase['bytes'] = self.oVerifyReport.iBytesChecked
+                return
+
+            dSourceFiles = self._scanSource()
+            dTargetFiles, _ = scanTree(sTargetDir, self.getRules())
+            dPhase['files'] = len(dSourceFiles)
+
+            lProblems = []
+            for sRelPath, tupSourceStat in dSourceFiles.items():
+                tupTargetStat = dTargetFiles.get(sRelPath)
+                if tupTargetStat is None:
+                    lProblems.append("missing : " + sRelPath)
+                elif tupTargetStat[0] != tupSourceStat[0]:
+                    lProblems.append("size differs : " + sRelPath)
+
+            if lProblems:
+                raise InstallVerifyError("Install verification failed for " + sTargetDir + "\n" + "\n".join(lProblems[:20]))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _verifyManifest(self, sTargetDir):
+        ''' Hash sTargetDir against the (cached) source manifest and write the
+            manifest into sTargetDir. User data folders are skipped when preserved.
+        '''
+        if isReleaseArchive(self.sSourceDir):
+            with ReleaseArchive(self.sSourceDir) as oArchive:
+                dManifest = oArchive.getManifest()
+        else:
+            dManifest = getSourceManifest(self.sSourceDir, self.iCopyWorkers)
+        dManifest = self.getRules().filterFiles(dManifest)
+        lSkipDirs = lUSER_DATA_DIRS if self.bPreserveUserData else self.lNO_LINK_DIRS
+        self.oVerifyReport = verifyManifest(sTargetDir, dManifest, self.iCopyWorkers, lSkipDirs,\
+                                            self.oProgress, self.oCancelEvent)
+        if not self.oVerifyReport.isOk():
+            raise InstallVerifyError("Install verification failed for " + sTargetDir + "\n" +\
+                                     "\n".join(self.oVerifyReport.getProblems()[:20]))
+        saveManifest(dManifest, getManifestPath(sTargetDir))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _scanSource(self):
+        ''' relpath -> (size, mtime_ns) of the source folder or archive.
+        '''
+        if isReleaseArchive(self.sSourceDir):
+            with ReleaseArchive(self.sSourceDir) as oArchive:
+                return self.getRules().filterFiles(oArchive.getFiles())
+        dSourceFiles, _ = scanTree(self.sSourceDir, self.getRules())
+        for sName in setINTERNAL_FILES:
+            dSourceFiles.pop(sName, None)
+        return dSourceFiles
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _copy(self, sTargetDir, sLinkDir, bResume=False):
+        ''' Copy the source into sTargetDir with the selected backend.
+            With bResume, files already in sTargetDir are kept if they are complete.
+        '''
+        if isReleaseArchive(self.sSourceDir):
+            return self._extract(sTargetDir, sLinkDir)
+
+        if self.bIncremental or bResume or self.sCopyBackend != sBACKEND_COPYTREE or sLinkDir is not None or self.bDedup:
+            self.oEngine = createCopyEngine(self.sCopyBackend, bCompareHash=self.bCompareHash,\
+                                            iWorkers=self.iCopyWorkers)
+            self.oEngine.bJournal = True
+            self.oEngine.oProgress = self.oProgress
+            self.oEngine.lNoLinkDirs = self.lNO_LINK_DIRS
+            self.oEngine.oRules = self.getRules()
+            self.oEngine.oPerfLog = self.oPerfLog
+            self.oEngine.oWritePolicy = self.oWritePolicy
+            if self.bPreserveUserData:
+                self.oEngine.lPreserveDirs = lUSER_DATA_DIRS
+            if self.bDedup:
+                self.oEngine.bDedup = True
+                self.oEngine.dDedupManifest = loadManifest(getManifestPath(self.sSourceDir))
+                self.oEngine.lCloneOnlyDirs = lUSER_DATA_DIRS
+            if self.bCancelRequested:
+                self.oEngine.cancel()
+
+            oPlan = self.oEngine.syncTree(self.sSourceDir, sTargetDir, sLinkDir)
+            self.lConflicts.extend(oPlan.lConflicts)
+            return "Image Quizzer copy complete - " + oPlan.getSummary()
+
+        with self.oPerfLog.phase('walk') as dPhase:
+            dFiles, _ = scanTree(self.sSourceDir, self.getRules())
+            dPhase['files'] = len(dFiles)
+        iBytes = sum(iSize for iSize, _ in dFiles.values())
+        self.oProgress.start(len(dFiles), iBytes)
+
+        self.oCopytreeJournal = CopyJournal(sTargetDir)
+        self.oCopytreeJournal.open()
+        try:
+            with self.oPerfLog.phase('copy', files=len(dFiles), bytes=iBytes, workers=1):
+                shutil.copytree(self.sSourceDir, sTargetDir, copy_function=self._copy2WithProgress,\
+                                dirs_exist_ok=True, ignore=self._ignoreExcluded)
+            self.oWritePolicy.flush(self.oProgress)
+        finally:
+            self.oCopytreeJournal.close()
+        self.oCopytreeJournal.remove()
+        return "Image Quizzer copy complete"
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _extract(self, sTargetDir, sLinkDir):
+        ''' Stream the release archive into sTargetDir. Files already there with
+            the member's size and modification time are kept, so an incremental or
+            interrupted install only writes what changed.
+        '''
+        oJournal = CopyJournal(sTargetDir)
+        with ReleaseArchive(self.sSourceDir) as oArchive:
+            oArchive.oPerfLog = self.oPerfLog
+            oArchive.oWritePolicy = self.oWritePolicy
+            oPlan = oArchive.extractTo(sTargetDir, sLinkDir, self.lNO_LINK_DIRS,\
+                                       lUSER_DATA_DIRS if self.bPreserveUserData else None,\
+                                       self.oProgress, self.oCancelEvent, oJournal, self.getRules())
+        oJournal.remove()
+        self.lConflicts.extend(oPlan.lConflicts)
+        return "Image Quizzer copy complete - " + oPlan.getSummary()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _ignoreExcluded(self, sDir, lNames):
+        ''' ignore function for shutil.copytree - the cached manifest of the source
+            is not part of the release, nor is anything excluded by the install rules.
+            An ignored folder is not walked.
+        '''
+        sRelDir = os.path.relpath(sDir, self.sSourceDir)
+        if sRelDir == os.curdir:
+            sRelDir = ''
+        oRules = self.getRules()
+
+        lIgnored = []
+        for sName in lNames:
+            if sRelDir == '' and sName in setINTERNAL_FILES:
+                lIgnored.append(sName)
+            elif oRules.isExcluded(os.path.join(sRelDir, sName), os.path.isdir(os.path.join(sDir, sName))):
+                lIgnored.append(sName)
+        return lIgnored
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _copy2WithProgress(self, sSourcePath, sTargetPath):
+        ''' copy_function for shutil.copytree that reports progress, records the
+            file in the journal and honours cancel.
+        '''
+        if self.bCancelRequested:
+            raise CopyCancelled()
+        fStart = time.perf_counter()
+        if self.oWritePolicy.usesOwnCopy():
+            sMethod = self.oWritePolicy.copyFile(sSourcePath, sTargetPath, self.oCancelEvent)
+        else:
+            shutil.copy2(sSourcePath, sTargetPath)
+            sMethod = sMETHOD_COPY2
+        fSeconds = time.perf_counter() - fStart
+
+        oStat = os.stat(sTargetPath)
+        sRelPath = os.path.relpath(sTargetPath, self.oCopytreeJournal.sTargetDir)
+        self.oPerfLog.addFile('copy', sRelPath, oStat.st_size, fSeconds, sMethod)
+        self.oWritePolicy.fileWritten(sTargetPath, oStat.st_size)
+        self.oCopytreeJournal.record(sRelPath, oStat.st_size, oStat.st_mtime_ns)
+        self.oProgress.addFile(oStat.st_size)
+        return sTargetPath
@@ -21,10 +21,31 @@
     Usage:      >> cd to download of BainesImageQuizzer project
                 >> setup-installManager
 
+                Install from a downloaded release archive instead of the project folder:
+                >> setup-installManager <release .zip or .tar.gz>
+
+                Without the GUI (options as for 'setup-cli install', see ImageQuizzerSetupCLI.py):
+                >> setup-installManager --source <project folder or archive> --target <install folder> --yes
+
+                Check an existing install against its manifest (or the project folder) without copying:
+                >> setup-installManager --verify <install folder> [--source <project folder>]
+                The exit code is 0 if the install matches, 1 if files differ.
+
+                Phase timings of every install are appended to <install folder>.iq-perf.jsonl
+                (see ImageQuizzerPerfLog.py); with IQ_CPROFILE=1 set, the install also runs under cProfile.
+
     Documentation: https://baines-imaging-research-laboratory.github.io/ImageQuizzerDocumentation
 '''
 
+import sys
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1].startswith('-'):
+    # headless command line - hand over before Qt is loaded
+    from ImageQuizzerSetupCLI import runInstallerCLI
+    sys.exit(runInstallerCLI(sys.argv[1:]))
+
 from PyQt5 import QtWidgets
+from PyQt5 import QtCore
 
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtWidgets import QMainWindow
@@ -37,9 +58,20 @@ from pathlib import Path
 from datetime import datetime
 import shutil
 import traceback
+import asyncio
 import re
 import fileinput
 
+from ImageQuizzerCopyEngine import sBACKEND_COPYTREE, sBACKEND_PARALLEL, sBACKEND_ZEROCOPY, \
+                                  sPOLICY_DEFAULT, sPOLICY_REMOVABLE
+from ImageQuizzerInstallJob import InstallJob, hasInterruptedInstall, isPartialInstall
+from ImageQuizzerPreflight import runPreflight
+from ImageQuizzerBackup import getBackupPath
+from ImageQuizzerArchiveStore import getStorePath
+from ImageQuizzerAPI import jobEvents, sEVENT_PROGRESS
+from ImageQuizzerReleaseArchive import isReleaseArchive
+from ImageQuizzerInstallRules import sPROFILE_CODE, sPROFILE_CODE_SAMPLES, sPROFILE_FULL, sDEFAULT_PROFILE
+
 
 ##########################################################################
 #
@@ -64,6 +96,14 @@ class ImageQuizzerInstallerWindow(QMainWindow):
         self.oFormWidget = FormWidget(self)
         self.setCentralWidget(self.oFormWidget)
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def closeEvent(self, qEvent):
+        ''' Closing the window during an install cancels the copy cleanly
+            instead of killing it part way through a file.
+        '''
+        self.oFormWidget.cancelInstall(bWait=True)
+        qEvent.accept()
+
 
 ##########################################################################
 #
@@ -81,9 +121,14 @@ class FormWidget(QWidget):
         self.statusBar = self.parent().statusBar
         self.sInstallDir = None
         self.sSlicerDir  = None
+        self.oInstallLogic = None
 
 
         self.sCurrentDirectory = os.getcwd()
+        self.sSourcePath = self.sCurrentDirectory
+        for sArg in sys.argv[1:]:
+            if isReleaseArchive(sArg):
+                self.sSourcePath = os.path.abspath(sArg)
         self.sDefaultInstallDirectory = os.path.join(os.path.dirname(self.sCurrentDirectory),'BainesImageQuizzer')
 
         self.qMainLayout = QtWidgets.QGridLayout()
@@ -96,6 +141,14 @@ class FormWidget(QWidget):
  
 
 
+        qLblSource = QtWidgets.QLabel("Install from (project folder or release archive) :")
+
+        self.qLineSource = QtWidgets.QLineEdit()
+        self.qLineSource.setText(self.sSourcePath)
+
+        qBtnArchive = QtWidgets.QPushButton("Archive")
+        qBtnArchive.clicked.connect(self.getReleaseArchive)
+
         qLblInstallPath = QtWidgets.QLabel("Install location :")
 
         self.qLineInstallPath = QtWidgets.QLineEdit()
@@ -104,16 +157,104 @@ class FormWidget(QWidget):
         qBtnChangePath = QtWidgets.QPushButton("Change")
         qBtnChangePath.clicked.connect(self.getNewInstallPath)
 
-        qBtnInstall = QtWidgets.QPushButton("Install")
-        qBtnInstall.clicked.connect(self.setupInstall)
+        self.qChkIncremental = QtWidgets.QCheckBox("Update changed files only")
+        self.qChkIncremental.setToolTip("Copy only new or changed files and remove files no longer in the project." +\
+                                        "\nUnchanged files (eg. image data in the Inputs folder) are not copied again.")
+        self.qChkCompareHash = QtWidgets.QCheckBox("Compare file contents")
+        self.qChkCompareHash.setToolTip("When updating changed files only, compare files by content hash instead of" +\
+                                        "\nsize and modification time - slower, but finds every changed file.")
+        qIncrementalLayout = QtWidgets.QHBoxLayout()
+        qIncrementalLayout.addWidget(self.qChkIncremental)
+        qIncrementalLayout.addWidget(self.qChkCompareHash)
+        qIncrementalLayout.addStretch()
+
+        self.qChkStaged = QtWidgets.QCheckBox("Safe install (copy to a staging folder, then swap)")
+        self.qChkStaged.setChecked(True)
+        self.qChkStaged.setToolTip("The new install is copied and checked next to the existing one and then renamed" +\
+                                   "\ninto place. If the copy fails or is cancelled the existing install is not changed.")
+
+        self.qChkVerify = QtWidgets.QCheckBox("Verify install (compare file contents)")
+        self.qChkVerify.setChecked(True)
+        self.qChkVerify.setToolTip("After copying, every file is hashed and compared with the project folder." +\
+                                   "\nA manifest is written into the install so it can be checked again later.")
+
+        self.qChkPreserve = QtWidgets.QCheckBox("Keep existing Inputs and Outputs")
+        self.qChkPreserve.setToolTip("Move the Inputs and Outputs folders of the existing install into the new install" +\
+                                     "\ninstead of leaving them in the backup. Your files are kept where the release" +\
+                                     "\nhas a different file of the same name.")
+
+        self.qChkSnapshot = QtWidgets.QCheckBox("Snapshot backups")
+        self.qChkSnapshot.setToolTip("Files unchanged since the last backup are hard-linked instead of copied," +\
+                                     "\nso backups share identical code and image data (not supported on FAT sticks).")
+        self.qChkDedup = QtWidgets.QCheckBox("Store identical files once")
+        self.qChkDedup.setToolTip("Files with the same contents in several folders (eg. reference images shared by" +\
+                                  "\nsessions) are written once and hard-linked, so large studies fit on smaller sticks.")
+        qLblKeepBackups = QtWidgets.QLabel("Backups to keep (0 = all) :")
+        self.qSpinKeepBackups = QtWidgets.QSpinBox()
+        self.qSpinKeepBackups.setRange(0, 99)
+        self.qSpinKeepBackups.setValue(0)
+        qSnapshotLayout = QtWidgets.QHBoxLayout()
+        qSnapshotLayout.addWidget(self.qChkSnapshot)
+        qSnapshotLayout.addWidget(self.qChkDedup)
+        qSnapshotLayout.addStretch()
+        qSnapshotLayout.addWidget(qLblKeepBackups)
+        qSnapshotLayout.addWidget(self.qSpinKeepBackups)
+
+        self.qChkRemovable = QtWidgets.QCheckBox("Installing to a USB stick (write in large blocks, flush when done)")
+        self.qChkRemovable.setToolTip("Files are written in large blocks and flushed to the stick in batches while" +\
+                                      "\ncopying, then all remaining data is flushed before the install ends," +\
+                                      "\nso the stick can be ejected straight away.")
+
+        self.qComboBackend = QtWidgets.QComboBox()
+        self.qComboBackend.addItem("Standard copy", sBACKEND_COPYTREE)
+        self.qComboBackend.addItem("Parallel copy", sBACKEND_PARALLEL)
+        self.qComboBackend.addItem("Parallel zero-copy", sBACKEND_ZEROCOPY)
+        self.qComboBackend.setToolTip("Parallel copy uses several threads - faster for folders with many small image files." +\
+                                      "\nZero-copy lets the operating system copy file data directly where supported.")
+
+        self.qComboProfile = QtWidgets.QComboBox()
+        self.qComboProfile.addItem("Install code and sample inputs", sPROFILE_CODE_SAMPLES)
+        self.qComboProfile.addItem("Install code only", sPROFILE_CODE)
+        self.qComboProfile.addItem("Install everything in the folder", sPROFILE_FULL)
+        self.qComboProfile.setCurrentIndex(self.qComboProfile.findData(sDEFAULT_PROFILE))
+        self.qComboProfile.setToolTip("Build output, .git, the installer itself and old Outputs are left out" +\
+                                      "\nexcept with 'everything'. Extra patterns can be listed in .iq-install-rules.")
+
+        self.qBtnInstall = QtWidgets.QPushButton("Install")
+        self.qBtnInstall.clicked.connect(self.setupInstall)
+
+        self.qProgressBar = QtWidgets.QProgressBar()
+        self.qProgressBar.setRange(0, 1000)
+        self.qProgressBar.setTextVisible(False)
+        self.qProgressBar.setVisible(False)
+
+        self.qLblProgress = QtWidgets.QLabel()
+
+        self.qBtnCancel = QtWidgets.QPushButton("Cancel")
+        self.qBtnCancel.setEnabled(False)
+        self.qBtnCancel.clicked.connect(self.cancelInstall)
 
          
         # add widgets to layout
         self.qMainLayout.addWidget(qLblInfo,0,0)
-        self.qMainLayout.addWidget(qLblInstallPath,1,0)
-        self.qMainLayout.addWidget(self.qLineInstallPath,2,0)
-        self.qMainLayout.addWidget(qBtnChangePath,2,1)
-        self.qMainLayout.addWidget(qBtnInstall,3,1)
+        self.qMainLayout.addWidget(qLblSource,1,0)
+        self.qMainLayout.addWidget(self.qLineSource,2,0)
+        self.qMainLayout.addWidget(qBtnArchive,2,1)
+        self.qMainLayout.addWidget(qLblInstallPath,3,0)
+        self.qMainLayout.addWidget(self.qLineInstallPath,4,0)
+        self.qMainLayout.addWidget(qBtnChangePath,4,1)
+        self.qMainLayout.addLayout(qIncrementalLayout,5,0)
+        self.qMainLayout.addWidget(self.qChkStaged,6,0)
+        self.qMainLayout.addWidget(self.qChkVerify,7,0)
+        self.qMainLayout.addWidget(self.qChkPreserve,8,0)
+        self.qMainLayout.addLayout(qSnapshotLayout,9,0)
+        self.qMainLayout.addWidget(self.qChkRemovable,10,0)
+        self.qMainLayout.addWidget(self.qComboProfile,11,0)
+        self.qMainLayout.addWidget(self.qComboBackend,12,0)
+        self.qMainLayout.addWidget(self.qBtnInstall,12,1)
+        self.qMainLayout.addWidget(self.qProgressBar,13,0)
+        self.qMainLayout.addWidget(self.qBtnCancel,13,1)
+        self.qMainLayout.addWidget(self.qLblProgress,14,0)
 
  
         self.setLayout(self.qMainLayout)
@@ -138,13 +279,106 @@ class FormWidget(QWidget):
         else:
             self.qLineInstallPath.setText(self.sInstallDir)
             
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getReleaseArchive(self):
+        ''' Select a downloaded release archive to install from.
+        '''
+        self.statusBar.showMessage("")
+        qDialog = QtWidgets.QFileDialog()
+        sPath, _ = qDialog.getOpenFileName(self,\
+                                           "Select release archive",\
+                                           os.path.dirname(self.sCurrentDirectory),\
+                                           "Release archives (*.zip *.tar.gz *.tgz *.tar)")
+        if sPath != '':     # not cancelled
+            self.sSourcePath = sPath
+            self.qLineSource.setText(sPath)
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def setupInstall(self):
 
         self.statusBar.showMessage("")
+        self.qLblProgress.setText("")
+
+        self.oInstallLogic = InstallerLogic(self.statusBar, self.qProgressBar, self.qLblProgress)
+        self.oInstallLogic.bIncremental = self.qChkIncremental.isChecked()
+        self.oInstallLogic.bCompareHash = self.qChkCompareHash.isChecked()
+        self.oInstallLogic.sCopyBackend = self.qComboBackend.currentData()
+        self.oInstallLogic.sWritePolicy = sPOLICY_REMOVABLE if self.qChkRemovable.isChecked() else sPOLICY_DEFAULT
+        self.oInstallLogic.bSnapshot = self.qChkSnapshot.isChecked()
+        self.oInstallLogic.bDedup = self.qChkDedup.isChecked()
+        self.oInstallLogic.bPreserveUserData = self.qChkPreserve.isChecked()
+        self.oInstallLogic.bStaged = self.qChkStaged.isChecked()
+        self.oInstallLogic.bVerify = self.qChkVerify.isChecked()
+        self.oInstallLogic.sProfile = self.qComboProfile.currentData()
+        self.oInstallLogic.iKeepBackups = self.qSpinKeepBackups.value()
+        bStarted = self.oInstallLogic.installSoftware(self.qLineSource.text(), self.qLineInstallPath.text(),\
+                                                      self.onInstallFinished)
+        if bStarted:
+            self.qBtnInstall.setEnabled(False)
+            self.qBtnCancel.setEnabled(True)
 
-        oInstallLogic = InstallerLogic(self.statusBar)
-        oInstallLogic.installSoftware(self.sCurrentDirectory, self.qLineInstallPath.text())
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancelInstall(self, bWait=False):
+
+        if self.oInstallLogic is not None:
+            self.qBtnCancel.setEnabled(False)
+            self.oInstallLogic.cancelInstall(bWait)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def onInstallFinished(self):
+
+        self.qBtnInstall.setEnabled(True)
+        self.qBtnCancel.setEnabled(False)
+
+
+##########################################################################
+#
+# InstallWorker
+#
+##########################################################################
+class InstallWorker(QtCore.QObject):
+    ''' Runs an InstallJob on a QThread and reports progress through signals.
+    '''
+
+    # (fraction complete x 1000, progress text)
+    progress = QtCore.pyqtSignal(int, str)
+    # ('complete' | 'cancelled' | 'backup_failed' | 'archive_failed' | 'error', message)
+    done = QtCore.pyqtSignal(str, str)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, oJob):
+        super(InstallWorker, self).__init__()
+        self.oJob = oJob
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        try:
+            oResult = asyncio.run(self._runJob())
+            if oResult.sStatus == 'ok':
+                self.done.emit('complete', oResult.sMessage)
+            elif oResult.sStatus == 'cancelled':
+                self.done.emit('cancelled', oResult.sMessage + ".")
+            elif oResult.oError is None and self.oJob.oArchiveTask is not None:
+                # the new install is in place - only the archive of the user data failed
+                self.done.emit('archive_failed', str(self.oJob.oArchiveTask.oError))
+            else:
+                self.done.emit('backup_failed', str(oResult.oError))
+        except:
+            self.done.emit('error', traceback.format_exc())
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    async def _runJob(self):
+        ''' Run the job through the library API (see ImageQuizzerAPI.py). The progress
+            events are already throttled so that thousands of small files do not
+            flood the GUI event loop. InstallerLogic does the pre-flight check and
+            waits for an archive backup itself.
+        '''
+        oResult = None
+        async for oEvent in jobEvents(self.oJob, bPreflight=False, bWaitForArchive=False):
+            if oEvent.sKind == sEVENT_PROGRESS:
+                self.progress.emit(int(oEvent.fFraction * 1000), oEvent.sText)
+            oResult = oEvent.oResult
+        return oResult
 
 
 ##########################################################################
@@ -154,17 +388,85 @@ class FormWidget(QWidget):
 ##########################################################################
 class InstallerLogic():
 
-    def __init__(self,qStBar):
+    def __init__(self, qStBar, qProgressBar=None, qLblProgress=None):
         self.statusBar = qStBar
+        self.qProgressBar = qProgressBar
+        self.qLblProgress = qLblProgress
+        self.bIncremental = False
+        self.bCompareHash = False
+        self.sCopyBackend = sBACKEND_COPYTREE
+        self.iCopyWorkers = None
+        self.sWritePolicy = sPOLICY_DEFAULT
+        self.bSnapshot = False
+        self.bDedup = False
+        self.iKeepBackups = None
+        self.sBackupRoot = None
+        self.bPreserveUserData = False
+        self.bStaged = False
+        self.bVerify = False
+        self.sProfile = sDEFAULT_PROFILE
+
+        self.oJob = None
+        self.oWorker = None
+        self.qThread = None
+        self.fnOnFinished = None
+        self.bClosing = False
+        self.qArchiveTimer = None
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def installSoftware(self, sSourceDir, sInstallDir):
+    def installSoftware(self, sSourceDir, sInstallDir, fnOnFinished=None):
         ''' Backup previous install if folder exists and it is not empty.
             Backup by renaming existing folder with .BAK-Date-Time suffix.
             
             Copy all files and folders into selected install dir.
+            sSourceDir may be the project folder or a release archive (.zip, .tar.gz)
+            whose members are streamed into the install dir without unpacking it first.
+            The copy runs on a worker thread; this function returns True once it has
+            started and fnOnFinished is called (in the GUI thread) when it ends.
+            In incremental mode, only new or changed files are copied and files
+            no longer in the source are removed from the install dir (with
+            bCompareHash, files are compared by content hash). The install is updated
+            in place, so the backup prompt only offers an archive of the Inputs and
+            Outputs - a renamed backup would leave every file to be copied again.
+
+            The copy backend (sCopyBackend) selects between one file at a time
+            (shutil.copytree for a new in-place install, else the copy engine with
+            a single worker) and the parallel / zero-copy copy engine. The write
+            policy (sWritePolicy) sets how files are written to the target, eg.
+            flushed for a USB stick.
+
+            In snapshot mode, files unchanged since the newest backup are hard-linked
+            from it. Only the newest iKeepBackups backups are kept.
+
+            With bDedup, files with identical contents are written once and the
+            copies in other folders hard-linked (or cloned) within the install.
+
+            The backup may be put in another folder (sBackupRoot, or chosen in the
+            backup prompt). On another drive the install is copied there, checked
+            and removed by the job (see ImageQuizzerBackup.moveToBackup), on the
+            worker thread with progress.
+
+            Instead of a backup folder, the user may choose to archive only the Inputs
+            and Outputs (see ImageQuizzerArchiveStore.py). The archive is built in the
+            background once the new install is in place; the Install button is enabled
+            again when it is done.
+
+            With bPreserveUserData, the Inputs and Outputs folders of the existing
+            install are moved into the new install; conflicts are reported when done.
+
+            A staged install (bStaged) copies into a staging folder and swaps it into
+            place, leaving the existing install untouched if the copy fails.
+
+            An install that was interrupted is resumed from its copy journal; the
+            backup prompt is skipped since the folder holds the unfinished copy.
+
+            A pre-flight check (see ImageQuizzerPreflight.py) runs before the backup
+            prompt: an install that does not fit on the target is stopped before
+            anything is renamed or removed, otherwise the estimated install time is
+            shown with the confirmation.
         '''
 
+        bStarted = False
         try:
 
             self.sSourceDir = sSourceDir
@@ -172,67 +474,321 @@ class InstallerLogic():
             qMsgBox = QtWidgets.QMessageBox()
 
             sPathInstall = Path(self.sInstallDir)
-            bBackupComplete = False
-
-            if sPathInstall.is_dir():
+            bBackupChosen = False
+            sPathBackupFolder = None
+            bResume = hasInterruptedInstall(str(sPathInstall), self.bStaged) and not self.bIncremental
+            # an interrupted in-place copy is resumed - nothing to back up
+            bPartial = isPartialInstall(str(sPathInstall)) and not self.bIncremental
+
+            self.oJob = InstallJob(sSourceDir, str(sPathInstall))
+            self.oJob.bIncremental = self.bIncremental
+            self.oJob.bCompareHash = self.bCompareHash
+            self.oJob.sCopyBackend = self.sCopyBackend
+            if self.iCopyWorkers is not None:
+                self.oJob.iCopyWorkers = self.iCopyWorkers
+            self.oJob.sWritePolicy = self.sWritePolicy
+            self.oJob.bSnapshot = self.bSnapshot
+            self.oJob.bDedup = self.bDedup
+            self.oJob.iKeepBackups = self.iKeepBackups
+            self.oJob.sBackupRoot = self.sBackupRoot
+            self.oJob.bPreserveUserData = self.bPreserveUserData
+            self.oJob.bStaged = self.bStaged
+            self.oJob.bVerify = self.bVerify
+            self.oJob.sProfile = self.sProfile
+
+            oPreflight = self.runPreflight(False)
+            if oPreflight is None:
+                return bStarted
+
+            if sPathInstall.is_dir() and not bPartial:
                 # folder exists
                 if len(os.listdir(sPathInstall)) > 0:
                     # folder not empty
                     qMsgBox.setIcon(QtWidgets.QMessageBox.Question)
                     qMsgBox.setWindowTitle("Backup")
-                    qMsgBox.setText("Selected install folder exists.\n\nA backup will capture existing settings and results in the Inputs and Outputs folders.")
-                    qMsgBox.setInformativeText( "Do you want to backup existing module?")
+                    if self.bIncremental:
+                        qMsgBox.setText("Selected install folder exists and will be updated in place.\n\nAn archive will capture existing settings and results in the Inputs and Outputs folders.")
+                        qMsgBox.setInformativeText( "Do you want to archive Inputs and Outputs first?")
+                    else:
+                        qMsgBox.setText("Selected install folder exists.\n\nA backup will capture existing settings and results in the Inputs and Outputs folders.")
+                        qMsgBox.setInformativeText( "Do you want to backup existing module?")
                     qMsgBox.setStandardButtons(QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
                     qMsgBox.setDefaultButton(QtWidgets.QMessageBox.Yes)
                     qAns = qMsgBox.exec()
 
-                    if qAns == QtWidgets.QMessageBox.Yes:
+                    if qAns == QtWidgets.QMessageBox.Yes and self.bIncremental:
+                        # a renamed backup would leave every file to be copied again
+                        self.oJob.bArchiveBackup = True
+                        sPathBackupFolder = getStorePath(sPathInstall, self.oJob.sBackupRoot)
+                        bBackupChosen = True
+
+                    elif qAns == QtWidgets.QMessageBox.Yes:
                         
-                        sCurrent_datetime = datetime.today().strftime('%Y%m%d-%H%M%S')
-                        sPathBackupFolder = os.path.join (os.path.dirname(sPathInstall),\
-                                                        os.path.basename(sPathInstall) + ".BAK-" + sCurrent_datetime)
-                        qMsgBox.setIcon(QtWidgets.QMessageBox.Question)
-                        qMsgBox.setWindowTitle("Backup")
-                        qMsgBox.setText("Creating backup folder : ")
-                        qMsgBox.setInformativeText( sPathBackupFolder )
-                        qMsgBox.setStandardButtons(QtWidgets.QMessageBox.Ok | QtWidgets.QMessageBox.Cancel)
-                        qAns = qMsgBox.exec()
-
-                        if qAns == QtWidgets.QMessageBox.Ok:
-                            os.rename(sPathInstall, sPathBackupFolder)
-                            bBackupComplete = True
+                        sPathBackupFolder = self.chooseBackupFolder(sPathInstall)
+                        if sPathBackupFolder is not None:
+                            # the old install stays on the target (or is moved off it) - check again
+                            oPreflight = self.runPreflight(not self.oJob.bArchiveBackup, oPreflight.oProbe)
+                            if oPreflight is None:
+                                return bStarted
+                            bBackupChosen = True
                             
                         
             # copy folders and subfolders to install dir
             qMsgBox.setIcon(QtWidgets.QMessageBox.Question)
             qMsgBox.setWindowTitle("Image Quizzer Install")
-            if bBackupComplete:
-                sMsg = "Backup complete - installing code ..."
+            if bBackupChosen and self.oJob.bArchiveBackup and self.bIncremental:
+                sMsg = "Inputs and Outputs of the existing install will be archived first - installing code ..."
+            elif bBackupChosen and self.oJob.bArchiveBackup:
+                sMsg = "Inputs and Outputs of the existing install will be archived once the new install is in place - installing code ..."
+            elif bBackupChosen:
+                sMsg = "The existing install will be moved to the backup folder - installing code ..."
+            elif bResume:
+                sMsg = "Resuming interrupted install ..."
             else:
                 sMsg = "Installing code ..."
+            if self.bIncremental:
+                sMsg = sMsg + "\n(only new or changed files are copied)"
             qMsgBox.setText(sMsg)
             sMsg = "Copying from : " + sSourceDir + " \nTo : " + str(sPathInstall)
+            sMsg = sMsg + "\n\n" + oPreflight.getSummary()
             qMsgBox.setInformativeText( sMsg )
             qMsgBox.setStandardButtons(QtWidgets.QMessageBox.Ok | QtWidgets.QMessageBox.Cancel)
             qAns = qMsgBox.exec()
 
             if qAns == QtWidgets.QMessageBox.Ok:
                 self.statusBar.showMessage("Copying .....")
-                if os.path.exists(sPathInstall):
-                    shutil.rmtree(sPathInstall)
-                shutil.copytree(sSourceDir, sPathInstall)
 
-                self.statusBar.showMessage("Image Quizzer copy complete")
+                if bBackupChosen and not self.oJob.bArchiveBackup:
+                    # moved by the job on the worker thread - a copy to another drive takes a while
+                    self.oJob.sBackupDir = sPathBackupFolder
+                    self.oJob.bMoveToBackup = True
+
+                self.startWorker(fnOnFinished)
+                bStarted = True
 
         except:
             tb = traceback.format_exc()
-            self.statusBar.showMessage("!!! ERROR !!! ")
+            self.showError(tb)
+
+        return bStarted
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def chooseBackupFolder(self, sPathInstall):
+        ''' Confirm the backup folder, which the user may move to another folder
+            (eg. on the local disk), or choose an archive of the Inputs and Outputs
+            (sets oJob.bArchiveBackup). Returns the backup or archive path, or None if cancelled.
+        '''
+        while True:
+            sPathBackupFolder = getBackupPath(sPathInstall, sBackupRoot=self.oJob.sBackupRoot)
+            qMsgBox = QtWidgets.QMessageBox()
+            qMsgBox.setIcon(QtWidgets.QMessageBox.Question)
+            qMsgBox.setWindowTitle("Backup")
+            qMsgBox.setText("Creating backup folder : ")
+            qMsgBox.setInformativeText( sPathBackupFolder )
+            qMsgBox.setStandardButtons(QtWidgets.QMessageBox.Ok | QtWidgets.QMessageBox.Cancel)
+            qBtnOther = qMsgBox.addButton("Choose another folder ...", QtWidgets.QMessageBox.ActionRole)
+            qBtnArchive = qMsgBox.addButton("Archive Inputs/Outputs only", QtWidgets.QMessageBox.ActionRole)
+            qAns = qMsgBox.exec()
+
+            if qMsgBox.clickedButton() == qBtnArchive:
+                self.oJob.bArchiveBackup = True
+                return getStorePath(sPathInstall, self.oJob.sBackupRoot)
+
+            if qMsgBox.clickedButton() == qBtnOther:
+                sBackupRoot = QtWidgets.QFileDialog.getExistingDirectory(None, "Folder for the backup",\
+                                                                         os.path.dirname(sPathBackupFolder))
+                if sBackupRoot:
+                    self.oJob.sBackupRoot = sBackupRoot
+                continue
+            if qAns == QtWidgets.QMessageBox.Ok:
+                return sPathBackupFolder
+            return None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def runPreflight(self, bBackup, oProbe=None):
+        ''' Pre-flight check of self.oJob. Returns the PreflightReport, or None
+            (after telling the user why) if the install should not go ahead.
+        '''
+        self.statusBar.showMessage("Checking free space and write speed .....")
+        QtWidgets.QApplication.processEvents()
+        oPreflight = runPreflight(self.oJob, bBackup, oProbe)
+        if oPreflight.isGo():
+            self.statusBar.showMessage("Pre-flight : " + oPreflight.getSummary())
+            return oPreflight
+
+        self.statusBar.showMessage("Pre-flight check failed")
+        qMsgBox = QtWidgets.QMessageBox()
+        qMsgBox.setIcon(QtWidgets.QMessageBox.Critical)
+        qMsgBox.setWindowTitle("Image Quizzer Install")
+        qMsgBox.setText("The install cannot go ahead - nothing has been changed.")
+        qMsgBox.setInformativeText("\n".join(oPreflight.lProblems) + "\n\n" + oPreflight.getSummary())
+        qMsgBox.exec()
+        return None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def startWorker(self, fnOnFinished):
+        ''' Run the install job on a QThread.
+        '''
+        self.fnOnFinished = fnOnFinished
+
+        if self.qProgressBar is not None:
+            self.qProgressBar.setValue(0)
+            self.qProgressBar.setVisible(True)
+
+        self.qThread = QtCore.QThread()
+        self.oWorker = InstallWorker(self.oJob)
+        self.oWorker.moveToThread(self.qThread)
+
+        self.qThread.started.connect(self.oWorker.run)
+        self.oWorker.progress.connect(self.onProgress)
+        self.oWorker.done.connect(self.onDone)
+        self.oWorker.done.connect(self.qThread.quit)
+
+        self.qThread.start()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancelInstall(self, bWait=False):
+        ''' Ask the running install to stop. The copy stops between files so no
+            partially written file is left behind.
+        '''
+        if self.oJob is not None and self.qThread is not None and self.qThread.isRunning():
+            self.statusBar.showMessage("Cancelling .....")
+            self.oJob.cancel()
+            if bWait:
+                # window is closing - no message box for the cancelled install
+                self.bClosing = True
+                self.qThread.wait()
+
+        if bWait and self.oJob is not None and self.oJob.oArchiveTask is not None and self.oJob.oArchiveTask.isRunning():
+            # the previous install is only removed once its user data is archived - let it finish
+            self.bClosing = True
+            self.statusBar.showMessage("Finishing the backup archive .....")
+            QtWidgets.QApplication.processEvents()
+            self.oJob.oArchiveTask.wait()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def onProgress(self, iPermille, sText):
+
+        if self.qProgressBar is not None:
+            self.qProgressBar.setValue(iPermille)
+        if self.qLblProgress is not None:
+            self.qLblProgress.setText(sText)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def onDone(self, sResult, sMsg):
+
+        if self.qProgressBar is not None:
+            self.qProgressBar.setVisible(False)
+        if self.qLblProgress is not None:
+            self.qLblProgress.setText(self.oJob.oProgress.formatStatus())
+
+        if sResult == 'complete':
+            self.statusBar.showMessage(sMsg)
+            if self.oJob.lConflicts:
+                self.showConflicts(self.oJob.lConflicts)
+            if self.oJob.oArchiveTask is not None and self.oJob.oArchiveTask.isRunning():
+                self.waitForArchive(sMsg)
+                return
+
+        elif sResult == 'cancelled':
+            self.statusBar.showMessage("Install cancelled")
+            if self.bClosing:
+                return
+            qMsgBox = QtWidgets.QMessageBox()
+            qMsgBox.setIcon(QtWidgets.QMessageBox.Warning)
+            qMsgBox.setWindowTitle("Install cancelled")
+            qMsgBox.setText(sMsg)
+            if self.oJob.bStaged and not self.oJob.bIncremental:
+                qMsgBox.setInformativeText("The staging folder was removed and the existing install was not changed.")
+            else:
+                qMsgBox.setInformativeText("The install folder is incomplete. Run the install again" +\
+                                           " to resume copying where it stopped.")
+            qMsgBox.exec()
+
+        elif sResult == 'backup_failed':
+            self.statusBar.showMessage("Backup failed - nothing was installed")
+            if self.bClosing:
+                return
             qMsgBox = QtWidgets.QMessageBox()
-            qMsgBox.setWindowTitle("ERROR!!!")
-            qMsgBox.setText("Error installing Image Quizzer software to target directory")
-            qMsgBox.setInformativeText(tb)
+            qMsgBox.setIcon(QtWidgets.QMessageBox.Warning)
+            qMsgBox.setWindowTitle("Backup failed")
+            qMsgBox.setText("The existing install could not be backed up, so it was not changed.")
+            qMsgBox.setInformativeText(sMsg)
             qMsgBox.exec()
 
+        elif sResult == 'archive_failed':
+            self.statusBar.showMessage("Image Quizzer installed - the Inputs and Outputs archive failed")
+            if self.oJob.lConflicts:
+                self.showConflicts(self.oJob.lConflicts)
+            if not self.bClosing:
+                self.showArchiveFailed(sMsg)
+
+        else:
+            self.showError(sMsg)
+
+        if self.fnOnFinished is not None:
+            self.fnOnFinished()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def waitForArchive(self, sMsg):
+        ''' The new install is in place; poll the background archive of the previous
+            install's Inputs and Outputs and finish when it is done.
+        '''
+        oTask = self.oJob.oArchiveTask
+        self.statusBar.showMessage(sMsg + " - archiving Inputs and Outputs of the previous install .....")
+
+        def _poll():
+            if oTask.isRunning():
+                return
+            self.qArchiveTimer.stop()
+            self.statusBar.showMessage(sMsg + " - " + oTask.getSummary())
+            if oTask.sStatus == 'error' and not self.bClosing:
+                self.showArchiveFailed(oTask.getSummary())
+            if self.fnOnFinished is not None:
+                self.fnOnFinished()
+
+        self.qArchiveTimer = QtCore.QTimer()
+        self.qArchiveTimer.timeout.connect(_poll)
+        self.qArchiveTimer.start(250)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def showArchiveFailed(self, sDetail):
+
+        qMsgBox = QtWidgets.QMessageBox()
+        qMsgBox.setIcon(QtWidgets.QMessageBox.Warning)
+        qMsgBox.setWindowTitle("Backup archive failed")
+        qMsgBox.setText("The new install is in place, but the Inputs and Outputs of the previous install"\
+                        " could not be archived.")
+        qMsgBox.setInformativeText(sDetail)
+        qMsgBox.exec()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def showConflicts(self, lConflicts):
+        ''' Warn about user files that differ from the release files of the same name.
+        '''
+        iMaxListed = 20
+        sList = '\n'.join(lConflicts[:iMaxListed])
+        if len(lConflicts) > iMaxListed:
+            sList = sList + "\n... and %d more" % (len(lConflicts) - iMaxListed)
+
+        qMsgBox = QtWidgets.QMessageBox()
+        qMsgBox.setIcon(QtWidgets.QMessageBox.Warning)
+        qMsgBox.setWindowTitle("Inputs / Outputs conflicts")
+        qMsgBox.setText("These existing files differ from the files of the same name in the new release." +\
+                        "\nYour existing files were kept.")
+        qMsgBox.setInformativeText(sList)
+        qMsgBox.exec()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def showError(self, sTraceback):
+
+        self.statusBar.showMessage("!!! ERROR !!! ")
+        qMsgBox = QtWidgets.QMessageBox()
+        qMsgBox.setWindowTitle("ERROR!!!")
+        qMsgBox.setText("Error installing Image Quizzer software to target directory")
+        qMsgBox.setInformativeText(sTraceback)
+        qMsgBox.exec()
+
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -0,0 +1,204 @@
+'''
+    Install rules for the Baines Image Quizzer install manager.
+
+    The install manager copies the download folder it is run from. That folder
+    also holds the installer executables, .git, __pycache__, pyinstaller build
+    output and possibly Outputs from trying the quiz out, none of which belong in
+    an install. Install rules select what is copied:
+
+        - a named profile:
+            'code'          - the Image Quizzer code only (no sample Inputs)
+            'code+samples'  - code and sample Inputs (default)
+            'full'          - everything, as before install rules existed
+        - optionally, gitignore-style patterns in '.iq-install-rules' in the root
+          of the project folder (or a rules file given with --rules):
+
+            # comment
+            *.log               excluded anywhere
+            /docs/              the docs folder in the root (trailing / - folders only)
+            !Inputs/Demo/       re-include (the last matching pattern wins)
+            [code]              patterns below apply to the 'code' profile only
+            /Inputs/Tutorial/
+            [demo]              a new profile - starts from the 'code+samples' excludes
+
+    Patterns are applied by the copy engine while it walks the tree (see
+    ImageQuizzerCopyEngine.scanTree): an excluded folder is pruned and never
+    listed, and as in git, files below an excluded folder cannot be re-included.
+    Excluded paths in an existing install are left alone - neither copied nor removed.
+
+    This module is imported by ImageQuizzerInstallJob.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import os
+import re
+
+from ImageQuizzerCopyEngine import sRULES_NAME
+from ImageQuizzerSetupOptions import sPROFILE_CODE, sPROFILE_CODE_SAMPLES, sPROFILE_FULL, lPROFILES, sDEFAULT_PROFILE
+
+
+# never part of an install: version control, Python caches, pyinstaller output,
+# the install manager itself (the module connector is kept - it is run from the stick)
+# and results left in the download folder
+lBUILD_EXCLUDES = ['.git/', '__pycache__/', '*.pyc', '/build/', '/dist/', '/*.spec',\
+                   '/setup-installManager*', '/Outputs/*']
+
+dPROFILE_PATTERNS = {
+    sPROFILE_CODE: lBUILD_EXCLUDES + ['/Inputs/*'],
+    sPROFILE_CODE_SAMPLES: lBUILD_EXCLUDES,
+    sPROFILE_FULL: [],
+    }
+
+
+##########################################################################
+#
+# InstallRules
+#
+##########################################################################
+class InstallRules():
+    ''' Ordered gitignore-style patterns; the last pattern matching a path decides.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, lPatterns=None, sProfile=None):
+        self.sProfile = sProfile
+        self.lPatterns = []         # (source text, compiled regex, negated, folders only)
+        for sPattern in lPatterns or []:
+            self.addPattern(sPattern)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def addPattern(self, sPattern):
+        sPattern = sPattern.rstrip()
+        if sPattern == '' or sPattern.startswith('#'):
+            return
+        bNegated = sPattern.startswith('!')
+        if bNegated:
+            sPattern = sPattern[1:]
+        bDirOnly = sPattern.endswith('/')
+        sPattern = sPattern.rstrip('/')
+        if sPattern == '':
+            return
+        self.lPatterns.append((sPattern, _compilePattern(sPattern), bNegated, bDirOnly))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isEmpty(self):
+        return not self.lPatterns
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isExcluded(self, sRelPath, bIsDir=False):
+        ''' True if the entry sRelPath (relative to the root) is excluded. The
+            folders above it are assumed to be included - see isPathExcluded.
+        '''
+        sRelPath = sRelPath.replace(os.sep, '/')
+        bExcluded = False
+        for _, oRegex, bNegated, bDirOnly in self.lPatterns:
+            if bDirOnly and not bIsDir:
+                continue
+            if bExcluded == bNegated and oRegex.match(sRelPath):
+                bExcluded = not bNegated
+        return bExcluded
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isPathExcluded(self, sRelPath, bIsDir=False):
+        ''' True if sRelPath or any folder above it is excluded (for flat file
+            lists such as archive members and manifests, which are not walked).
+        '''
+        lParts = sRelPath.replace(os.sep, '/').split('/')
+        for iDepth in range(1, len(lParts)):
+            if self.isExcluded('/'.join(lParts[:iDepth]), True):
+                return True
+        return self.isExcluded('/'.join(lParts), bIsDir)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def filterFiles(self, dFiles):
+        ''' Copy of a relpath-keyed dict (scanTree files, manifest) without excluded paths.
+        '''
+        if self.isEmpty():
+            return dFiles
+        return {sRelPath: tupValue for sRelPath, tupValue in dFiles.items() if not self.isPathExcluded(sRelPath)}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _compilePattern(sPattern):
+    ''' gitignore glob -> regex matched against the whole '/' separated relative path.
+        A pattern with a '/' (other than a trailing one) is anchored to the root;
+        otherwise it matches the name at any depth.
+    '''
+    bAnchored = '/' in sPattern
+    sPattern = sPattern.lstrip('/')
+
+    lRegex = []
+    i = 0
+    while i < len(sPattern):
+        sChar = sPattern[i]
+        if sPattern.startswith('**/', i):
+            lRegex.append('(?:.*/)?')
+            i += 3
+            continue
+        if sPattern.startswith('**', i):
+            lRegex.append('.*')
+            i += 2
+            continue
+        if sChar == '*':
+            lRegex.append('[^/]*')
+        elif sChar == '?':
+            lRegex.append('[^/]')
+        elif sChar == '[':
+            iEnd = sPattern.find(']', i + 2)
+            if iEnd < 0:
+                lRegex.append(re.escape(sChar))
+            else:
+                sClass = sPattern[i + 1:iEnd]
+                if sClass.startswith('!'):
+                    sClass = '^' + sClass[1:]
+                lRegex.append('[' + sClass.replace('\\', '\\\\') + ']')
+                i = iEnd
+        elif sChar == '\\' and i + 1 < len(sPattern):
+            i += 1
+            lRegex.append(re.escape(sPattern[i]))
+        else:
+            lRegex.append(re.escape(sChar))
+        i += 1
+
+    sRegex = ''.join(lRegex)
+    if not bAnchored:
+        sRegex = '(?:.*/)?' + sRegex
+    return re.compile(sRegex + r'\Z', re.IGNORECASE if os.name == 'nt' else 0)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def readRulesFile(sPath):
+    ''' Patterns of a rules file: (patterns for all profiles, profile name -> patterns).
+    '''
+    lCommon = []
+    dSections = {}
+    lCurrent = lCommon
+    with open(sPath, 'r', encoding='utf-8') as fIn:
+        for sLine in fIn:
+            sStripped = sLine.strip()
+            if sStripped.startswith('[') and sStripped.endswith(']') and len(sStripped) > 2:
+                lCurrent = dSections.setdefault(sStripped[1:-1].strip(), [])
+            else:
+                lCurrent.append(sLine.rstrip('\r\n'))
+    return lCommon, dSections
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def loadRules(sSourceDir, sProfile=sDEFAULT_PROFILE, sRulesFile=None):
+    ''' InstallRules for the profile, followed by the patterns of the rules file
+        (sRulesFile, or '.iq-install-rules' in a source folder if there is one).
+        Raises ValueError for a profile that is neither built in nor in the rules file.
+    '''
+    if sRulesFile is None and sSourceDir is not None and os.path.isdir(sSourceDir):
+        sDefaultFile = os.path.join(sSourceDir, sRULES_NAME)
+        if os.path.isfile(sDefaultFile):
+            sRulesFile = sDefaultFile
+
+    lCommon, dSections = [], {}
+    if sRulesFile is not None:
+        lCommon, dSections = readRulesFile(sRulesFile)
+
+    if sProfile not in dPROFILE_PATTERNS and sProfile not in dSections:
+        raise ValueError("Unknown install profile '%s' - use one of: %s" %\
+                         (sProfile, ", ".join(lPROFILES + sorted(set(dSections) - set(lPROFILES)))))
+
+    # a profile defined only in the rules file starts from the build excludes
+    lPatterns = dPROFILE_PATTERNS.get(sProfile, lBUILD_EXCLUDES)
+    return InstallRules(lPatterns + lCommon + dSections.get(sProfile, []), sProfile)
@@ -0,0 +1,302 @@
+'''
+    Content manifest for the Baines Image Quizzer install manager.
+
+    A manifest lists every file of a project tree with its size, modification time
+    and BLAKE2b content hash. It is written to '.iq-manifest' in the root of the
+    tree:
+
+        # iq-manifest 1
+        <hash>\t<size>\t<mtime ns>\t<relative path, '/' separated>
+
+    The manifest of the source (release) folder is cached there, so repeated
+    installs from the same release only hash files whose size or modification time
+    changed. After an install the manifest is also written into the install folder,
+    so an existing install can be verified later without the source.
+
+    Verification hashes the files of the destination in parallel with a pool of
+    worker threads (hashlib releases the GIL, large files are read through mmap).
+    Note that a verify straight after a copy may read the destination from the
+    page cache rather than from the device.
+
+    Usage:      >> python ImageQuizzerManifest.py <folder>                   (write manifest)
+                >> python ImageQuizzerManifest.py --verify <install folder> [--source <folder or archive>]
+
+    This module is imported by ImageQuizzerInstallJob.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import sys, os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageQuizzerCopyEngine import scanTree, hashFile, sMANIFEST_NAME, setINTERNAL_FILES, \
+                                  iDEFAULT_WORKERS, CopyCancelled
+
+
+sMANIFEST_HEADER = '# iq-manifest 1'
+
+# Image Quizzer writes results here, so an installed copy is expected to differ
+lVERIFY_SKIP_DIRS = ['Outputs']
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getManifestPath(sRootDir):
+    return os.path.join(sRootDir, sMANIFEST_NAME)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def loadManifest(sPath):
+    ''' Read a manifest file. Returns relpath -> (size, mtime_ns, hash)
+        or None if the file is missing or not a manifest.
+    '''
+    try:
+        with open(sPath, 'r', encoding='utf-8') as fIn:
+            if fIn.readline().rstrip('\n') != sMANIFEST_HEADER:
+                return None
+            dManifest = {}
+            for sLine in fIn:
+                lFields = sLine.rstrip('\n').split('\t', 3)
+                if len(lFields) != 4:
+                    continue
+                sHash, sSize, sMtime, sRelPath = lFields
+                dManifest[sRelPath.replace('/', os.sep)] = (int(sSize), int(sMtime), sHash)
+            return dManifest
+    except (OSError, ValueError, UnicodeDecodeError):
+        return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def saveManifest(dManifest, sPath):
+    ''' Write the manifest through a temporary file so that a reader never sees
+        a half-written manifest.
+    '''
+    # unique per writer - parallel installs from one source (see ImageQuizzerAPI.py) all save its manifest
+    sTempPath = '%s.%d-%d.tmp' % (sPath, os.getpid(), threading.get_ident())
+    with open(sTempPath, 'w', encoding='utf-8') as fOut:
+        fOut.write(sMANIFEST_HEADER + '\n')
+        for sRelPath in sorted(dManifest):
+            iSize, iMtime, sHash = dManifest[sRelPath]
+            fOut.write('%s\t%d\t%d\t%s\n' % (sHash, iSize, iMtime, sRelPath.replace(os.sep, '/')))
+    os.replace(sTempPath, sPath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def buildManifest(sRootDir, iWorkers=iDEFAULT_WORKERS, dCached=None):
+    ''' Hash every file of sRootDir in parallel. Entries of dCached with the same
+        size and modification time are reused without reading the file.
+        Returns relpath -> (size, mtime_ns, hash).
+    '''
+    if dCached is None:
+        dCached = {}
+
+    dFiles, _ = scanTree(sRootDir)
+    for sName in setINTERNAL_FILES:
+        dFiles.pop(sName, None)
+
+    dManifest = {}
+    lToHash = []
+    for sRelPath, (iSize, iMtime) in dFiles.items():
+        tupCached = dCached.get(sRelPath)
+        if tupCached is not None and tupCached[0] == iSize and tupCached[1] == iMtime:
+            dManifest[sRelPath] = tupCached
+        else:
+            lToHash.append(sRelPath)
+
+    # largest files first so one large volume does not finish last on its own
+    lToHash.sort(key=lambda sRelPath: dFiles[sRelPath][0], reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, iWorkers)) as oPool:
+        for sRelPath, sHash in zip(lToHash, oPool.map(lambda sRel: hashFile(os.path.join(sRootDir, sRel)), lToHash)):
+            iSize, iMtime = dFiles[sRelPath]
+            dManifest[sRelPath] = (iSize, iMtime, sHash)
+
+    return dManifest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getSourceManifest(sSourceDir, iWorkers=iDEFAULT_WORKERS):
+    ''' Return the manifest of the source folder, using and refreshing the cached
+        .iq-manifest. A read-only source is hashed without caching.
+    '''
+    sPath = getManifestPath(sSourceDir)
+    dCached = loadManifest(sPath)
+    dManifest = buildManifest(sSourceDir, iWorkers, dCached)
+    if dManifest != dCached:
+        try:
+            saveManifest(dManifest, sPath)
+        except OSError:
+            pass
+    return dManifest
+
+
+##########################################################################
+#
+# VerifyReport
+#
+##########################################################################
+class VerifyReport():
+    ''' Result of verifying a folder against a manifest.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sTargetDir):
+        self.sTargetDir = sTargetDir
+        self.lMissing = []
+        self.lSizeDiffers = []
+        self.lHashDiffers = []
+        self.lExtra = []          # not in the manifest - reported, not an error
+        self.iFilesListed = 0     # manifest files to check - none is an error (wrong or empty source)
+        self.iFilesChecked = 0
+        self.iBytesChecked = 0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isOk(self):
+        return self.iFilesListed > 0 and not (self.lMissing or self.lSizeDiffers or self.lHashDiffers)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getProblems(self):
+        lProblems = [] if self.iFilesListed > 0 else ["the manifest lists no files to verify"]
+        return lProblems +\
+               ["missing : " + sRelPath for sRelPath in self.lMissing] +\
+               ["size differs : " + sRelPath for sRelPath in self.lSizeDiffers] +\
+               ["content differs : " + sRelPath for sRelPath in self.lHashDiffers]
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        if self.iFilesListed == 0:
+            return "nothing verified - the manifest lists no files"
+        sMsg = "%d files (%.1f MB) verified" % (self.iFilesChecked, self.iBytesChecked / 1e6)
+        if not self.isOk():
+            sMsg = sMsg + ", %d missing, %d size differs, %d content differs" %\
+                   (len(self.lMissing), len(self.lSizeDiffers), len(self.lHashDiffers))
+        if self.lExtra:
+            sMsg = sMsg + ", %d extra file(s)" % len(self.lExtra)
+        return sMsg
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def verifyManifest(sTargetDir, dManifest, iWorkers=iDEFAULT_WORKERS, lSkipDirs=None, oProgress=None, oCancelEvent=None):
+    ''' Check that every manifest file is in sTargetDir with the same size and
+        content hash. Files below lSkipDirs (eg. user data) are not checked.
+        Files are hashed by a pool of iWorkers threads; oProgress (CopyProgress)
+        is advanced as they finish.
+
+        Returns a VerifyReport.
+    '''
+    lSkipDirs = lSkipDirs or []
+    oReport = VerifyReport(sTargetDir)
+
+    def _isSkipped(sRelPath):
+        for sDir in lSkipDirs:
+            if sRelPath == sDir or sRelPath.startswith(sDir + os.sep):
+                return True
+        return False
+
+    dTargetFiles, _ = scanTree(sTargetDir)
+    for sName in setINTERNAL_FILES:
+        dTargetFiles.pop(sName, None)
+
+    lToHash = []
+    for sRelPath, (iSize, _, _) in dManifest.items():
+        if _isSkipped(sRelPath):
+            continue
+        oReport.iFilesListed += 1
+        tupTargetStat = dTargetFiles.get(sRelPath)
+        if tupTargetStat is None:
+            oReport.lMissing.append(sRelPath)
+        elif tupTargetStat[0] != iSize:
+            oReport.lSizeDiffers.append(sRelPath)
+        else:
+            lToHash.append(sRelPath)
+    for sRelPath in dTargetFiles:
+        if sRelPath not in dManifest and not _isSkipped(sRelPath):
+            oReport.lExtra.append(sRelPath)
+
+    if oProgress is not None:
+        oProgress.start(len(lToHash), sum(dManifest[sRelPath][0] for sRelPath in lToHash))
+
+    def _check(sRelPath):
+        if oCancelEvent is not None and oCancelEvent.is_set():
+            raise CopyCancelled()
+        sHash = hashFile(os.path.join(sTargetDir, sRelPath))
+        if oProgress is not None:
+            oProgress.addFile(dManifest[sRelPath][0])
+        return sHash
+
+    lToHash.sort(key=lambda sRelPath: dManifest[sRelPath][0], reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, iWorkers)) as oPool:
+        for sRelPath, sHash in zip(lToHash, oPool.map(_check, lToHash)):
+            oReport.iFilesChecked += 1
+            oReport.iBytesChecked += dManifest[sRelPath][0]
+            if sHash != dManifest[sRelPath][2]:
+                oReport.lHashDiffers.append(sRelPath)
+
+    for lPaths in (oReport.lMissing, oReport.lSizeDiffers, oReport.lHashDiffers, oReport.lExtra):
+        lPaths.sort()
+    return oReport
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def verifyInstall(sInstallDir, sSourceDir=None, iWorkers=iDEFAULT_WORKERS, lSkipDirs=None, oRules=None):
+    ''' Verify an existing install against the source manifest (if sSourceDir is
+        given) or against the manifest written into the install.
+        Source files excluded by oRules (the install's InstallRules) are not checked.
+        Returns a VerifyReport, or None if no manifest is available. Raises ValueError
+        if sSourceDir is neither a folder nor a release archive.
+    '''
+    if sSourceDir is not None and os.path.isdir(sSourceDir):
+        dManifest = getSourceManifest(sSourceDir, iWorkers)
+    elif sSourceDir is not None:
+        # imported here - the release archive module imports this one
+        from ImageQuizzerReleaseArchive import ReleaseArchive, isReleaseArchive
+        if not isReleaseArchive(sSourceDir):
+            raise ValueError(str(sSourceDir) + " is neither a project folder nor a release archive")
+        with ReleaseArchive(sSourceDir) as oArchive:
+            dManifest = oArchive.getManifest()
+    if sSourceDir is not None:
+        if oRules is not None:
+            dManifest = oRules.filterFiles(dManifest)
+    else:
+        dManifest = loadManifest(getManifestPath(sInstallDir))
+        if dManifest is None:
+            return None
+    return verifyManifest(sInstallDir, dManifest, iWorkers, lSkipDirs)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runVerify(sInstallDir, sSourceDir=None, iWorkers=iDEFAULT_WORKERS, lSkipDirs=None):
+    ''' Console verify used by the --verify options. Returns the process exit code.
+    '''
+    try:
+        oReport = verifyInstall(sInstallDir, sSourceDir, iWorkers, lSkipDirs)
+    except ValueError as oError:
+        print(str(oError))
+        return 2
+    if oReport is None:
+        print("No manifest found in " + sInstallDir + " - give the source folder with --source")
+        return 2
+
+    for sProblem in oReport.getProblems():
+        print(sProblem)
+    print(oReport.getSummary())
+    return 0 if oReport.isOk() else 1
+
+
+##########################################################################
+##########################################################################
+##########################################################################
+#
+# RUN
+#
+##########################################################################
+##########################################################################
+##########################################################################
+
+
+if __name__ == '__main__':
+
+    oParser = argparse.ArgumentParser(description="Write or verify an Image Quizzer content manifest")
+    oParser.add_argument('folder', help="folder to write the manifest for, or the install folder with --verify")
+    oParser.add_argument('--verify', action='store_true', help="verify the folder instead of writing its manifest")
+    oParser.add_argument('--source', help="verify against the manifest of this source folder or release archive")
+    oParser.add_argument('--workers', type=int, default=iDEFAULT_WORKERS, help="hashing threads")
+    oArgs = oParser.parse_args()
+
+    if oArgs.verify:
+        sys.exit(runVerify(oArgs.folder, oArgs.source, oArgs.workers, lVERIFY_SKIP_DIRS))
+
+    dManifest = getSourceManifest(oArgs.folder, oArgs.workers)
+    print("%d files written to %s" % (len(dManifest), getManifestPath(oArgs.folder)))
@@ -22,12 +22,21 @@
     Usage:      >> cd to download of BainesImageQuizzer project
                 with GUI:
                     >> setup-moduleConnector
-                without GUI:
-                    >> setup-moduleConnector 'path Image Quizzer install' 'path Slicer install'
+                without GUI (Qt is not loaded, errors go to stderr - see ImageQuizzerSetupCLI.py):
+                    >> setup-moduleConnector 'path Image Quizzer install' 'path Slicer install' [--json]
+                resident, connecting whenever a USB holding Image Quizzer is mounted:
+                    >> setup-moduleConnector --watch
 
     Documentation: https://baines-imaging-research-laboratory.github.io/ImageQuizzerDocumentation
 '''
 
+import sys
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+    # run connector without GUI - hand over before Qt is loaded
+    from ImageQuizzerSetupCLI import runConnectorCLI
+    sys.exit(runConnectorCLI(sys.argv[1:]))
+
 from PyQt5 import QtWidgets
 
 from PyQt5.QtWidgets import QApplication
@@ -37,9 +46,13 @@ from PyQt5 import QtGui
 
 
 import sys, os
+import asyncio
 import traceback
-import re
-import fileinput
+
+from ImageQuizzerSlicerSettings import SlicerConnectError, SlicerIniMissingError
+from ImageQuizzerSlicerDiscovery import getDefaultRoots
+from ImageQuizzerAPI import connect
+from ImageQuizzerConnectorSettings import ConnectorSettings, autoConnect, sFROM_CACHE
 
 
 ##########################################################################
@@ -115,6 +128,9 @@ class FormWidget(QWidget):
         qBtnChangeSlicerPath = QtWidgets.QPushButton("Browse")
         qBtnChangeSlicerPath.clicked.connect(self.getSlicerLocationPath)
 
+        self.qChkAllSlicers = QtWidgets.QCheckBox("Also connect every other Slicer found on this USB and PC")
+        self.qChkAllSlicers.setChecked(False)
+
         qLblInstructions = QtWidgets.QLabel("\nConnect module to Slicer if changing PCs\n")
         self.qBtnConnectSlicer = QtWidgets.QPushButton("Connect")
         self.qBtnConnectSlicer.clicked.connect(self.setupConnectModule)
@@ -130,12 +146,16 @@ class FormWidget(QWidget):
         self.qMainLayout.addWidget(self.qLineSlicerPath,4,0)
         self.qMainLayout.addWidget(qBtnChangeSlicerPath,4,1)
 
-        self.qMainLayout.addWidget(qLblInstructions,5,0)
-        self.qMainLayout.addWidget(self.qBtnConnectSlicer,6,0)
+        self.qMainLayout.addWidget(self.qChkAllSlicers,5,0)
+
+        self.qMainLayout.addWidget(qLblInstructions,6,0)
+        self.qMainLayout.addWidget(self.qBtnConnectSlicer,7,0)
 
  
         self.setLayout(self.qMainLayout)
 
+        self.autoConnectModule()
+
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def getModuleLocationPath(self):
@@ -187,9 +207,43 @@ class FormWidget(QWidget):
         self.statusBar.showMessage("")
 
         oAppLogic = ApplicationLogic()
-        bConnected = oAppLogic.connectModuleInSlicer( self.qLineModulePath.text(), self.qLineSlicerPath.text())
+        bConnected = oAppLogic.connectModuleInSlicer( self.qLineModulePath.text(), self.qLineSlicerPath.text(),\
+                                                      self.qChkAllSlicers.isChecked())
         if bConnected:
             self.qBtnConnectSlicer.setText('Connect - Done')
+            self.statusBar.showMessage("Connected %d Slicer settings file(s)" % \
+                                       sum(1 for dIni in oAppLogic.lResults if dIni['ini'] is not None))
+            ConnectorSettings().remember(self.sCurrentDirectory, self.qLineModulePath.text(), self.qLineSlicerPath.text())
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def autoConnectModule(self):
+        ''' On launch, connect with the paths remembered for this USB (whatever its
+            drive letter is now) or found on it, without any dialogs.
+            If that is not possible the user browses and presses Connect as before.
+        '''
+        try:
+            sModulePath, sSlicerPath, sSource, lResults = autoConnect(self.sCurrentDirectory)
+        except Exception as oError:
+            self.statusBar.showMessage("Not connected automatically - " + str(oError).split('\n', 1)[0])
+            return
+
+        if sModulePath is not None:
+            self.sDefaultModulePath = sModulePath
+            self.qLineModulePath.setText(sModulePath)
+        if sSlicerPath is not None:
+            self.sDefaultSlicerPath = sSlicerPath
+            self.qLineSlicerPath.setText(sSlicerPath)
+        if lResults is None:
+            return
+
+        lFailed = [dIni for dIni in lResults if dIni['error']]
+        if lFailed:
+            self.statusBar.showMessage("Not connected automatically - " + lFailed[0]['error'])
+            return
+        self.qBtnConnectSlicer.setText('Connect - Done')
+        self.statusBar.showMessage("Connected automatically (%s) - %d Slicer settings file(s)" %\
+                                   ("remembered paths" if sSource == sFROM_CACHE else "found on this USB",\
+                                    sum(1 for dIni in lResults if dIni['ini'] is not None)))
            
        
 
@@ -201,144 +255,55 @@ class FormWidget(QWidget):
 class ApplicationLogic():
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def connectModuleInSlicer(self, sModulePath, sSlicerPath):
-        ''' Function to add ImageQuizzer module path to Slicer's list of modules 
-            in the Application Settings.
+    def __init__(self):
+        self.lResults = []
 
-            At the time of writing, the ini file is named Slicer-29738.ini .
-            This function is setup to make this name generic in case of future upgrades.
-
-            This ini file is created when the administrator manually connects a module
-            in Slicer's application settings or when extensions are added. 
-
-            This function looks for a previous connection to the module's code path
-            and if it exists it may have the wrong path.
-            It will be removed from the line and new path will be appended to end of line.
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def connectModuleInSlicer(self, sModulePath, sSlicerPath, bAllSlicers=False):
+        ''' Function to add ImageQuizzer module path to Slicer's list of modules 
+            in the Application Settings of every Slicer-xxxx.ini file of every Slicer
+            install at or below sSlicerPath, through the library API (see ImageQuizzerAPI.connect).
+            With bAllSlicers, the stick and the usual Slicer install folders are searched too.
 
+            Errors are reported to the user in a message box.
         '''
+        bModuleUpdated = False
         try:
-            #check that ini file exists
-            bFileFound = False
-            bModuleUpdated = False
-            sMsg = ''
-
-            sSearchDir = os.path.join(sSlicerPath,'NA-MIC')
-            if os.path.exists(sSearchDir):
-                
-                lFiles = os.listdir(sSearchDir)
-                for sFile in lFiles:
-                    if re.match("^Slicer.*ini$",sFile):
-                        bFileFound = True
-                        break
-
-            if bFileFound == False:
-                qMsgBox = QtWidgets.QMessageBox()
-                qMsgBox.setWindowTitle("ERROR!!!")
-                qMsgBox.setText("Cannot connect Image Quizzer module to Slicer.  Slicer-xxxx.ini file is missing.")
-                qMsgBox.setInformativeText('\n  Either: -the location specified for Slicer is incorrect'\
-                                           '\n  ... Or :     -the required Slicer Extensions have not yet been installed.'\
-                                            +'\n\nSee documentation > Getting started'\
-                                            +'\nhttps://baines-imaging-research-laboratory.github.io/ImageQuizzerDocumentation')
-                qMsgBox.exec() 
-                return
-            
+            lRoots = [sSlicerPath]
+            if bAllSlicers:
+                lRoots = lRoots + getDefaultRoots(sModulePath)
+            self.lResults = asyncio.run(connect(sModulePath, lRoots))
+            lFailed = [dIni for dIni in self.lResults if dIni['error']]
+            if lFailed:
+                self.showError("\n".join((dIni['ini'] or dIni['slicer']) + " - " + dIni['error'] for dIni in lFailed))
             else:
+                bModuleUpdated = True
 
-                # file found - update Modules list
-                sSlicerIniPath = os.path.join(sSearchDir, sFile)
-                sImageQuizzerCodePath = os.path.join(sModulePath,'ImageQuizzer','Code').replace('\\','/')
-
-                if os.path.exists(sImageQuizzerCodePath):
-
-                    sLineToFind = "AdditionalPaths="
-                    sSubstringToFind = "ImageQuizzer/Code"
-        
-                    for line in fileinput.FileInput(sSlicerIniPath, inplace=True):
-                        if sLineToFind in line:
-
-                            #remove any existing entries
-                            indSearchStart = 0
-                            while(indSearchStart < len(line)):
-                                iLengthLine = len(line) # for debug
-                                if sSubstringToFind in line:
-
-                                    iStartIndSubstr = line.find(sSubstringToFind, indSearchStart)
-                                    if iStartIndSubstr > -1:
-                                        iEndIndSubstr = iStartIndSubstr + len(sSubstringToFind)
-
-                                        #end of line entry
-                                        if iEndIndSubstr == len(line) -1: # entry at end of line (\n included in length)
-                                            iStartIndOfRemoval = line.rfind(',',0,iStartIndSubstr)
-
-                                            if iStartIndOfRemoval == -1: # no preceding comma - must be the first
-                                                iStartIndOfRemoval = line.rfind('=',0,iStartIndSubstr)
-                                                line = line[0 : iStartIndOfRemoval + 1] + line[iEndIndSubstr :]
-
-                                            else:
-                                                line = line[0 : iStartIndOfRemoval] + line[iEndIndSubstr :]
-
-                                            indSearchStart = len(line)
-
-                                        # not end of line entry
-                                        else: # check if part of longer path
-                                            if line[iEndIndSubstr] == '/':
-                                                indSearchStart = iEndIndSubstr + 1
-
-                                            else: # correct entry
-                                                iStartIndOfRemoval = line.rfind(',',0,iStartIndSubstr)
-                                                if iStartIndOfRemoval == -1: # no preceding comma - must be the first
-                                                    iStartIndOfRemoval = line.rfind('=',0,iStartIndSubstr)
-                                                    line = line[0 : iStartIndOfRemoval + 1] + line[iEndIndSubstr + 1 : ]
-                                                    indSearchStart = iStartIndOfRemoval + 1
-                                                else:
-                                                    line = line[0 : iStartIndOfRemoval] + line[iEndIndSubstr + 1 : ]
-                                                    indSearchStart = iStartIndOfRemoval
-
-                                    else: # not found in (remainder of) search
-                                        indSearchStart = len(line) # end the while loop
-
-                                else:   # not found
-                                    indSearchStart = len(line) # end the while loop
-
-
-
-                            # append to end of line
-                            line = line.rstrip('\n')
-                            if len(line) == len(sLineToFind):
-                                line = line + sImageQuizzerCodePath + '\n'
-                            else:
-                                line = line + ', ' + sImageQuizzerCodePath + '\n'
-
-                            bModuleUpdated = True
-
-                        print(line, end='')
-
-
-                    fileinput.close()
-                    if bModuleUpdated == False:
-                        sMsg = "Problem with Slicer-xxxx.ini file. Reset the location for Slicer application\n"\
-                        + "OR add module manually in Slicer's Applications>Modules settings."\
-                        +'\n\nSee documentation > Getting started'\
-                        +'\nhttps://baines-imaging-research-laboratory.github.io/ImageQuizzerDocumentation'
-
-                        raise
-
-                else:
-                    sMsg = "..\\ImageQuizzer\\Code folder is missing. " + \
-                            "Reset the Image Quizzer location to the installation directory.\n"
-                    raise
-
-        except:
-            tb = traceback.format_exc()
-            sMsg = sMsg + '\n' + tb
+        except SlicerIniMissingError as oError:
+            sText, sInfo = str(oError).split('\n', 1)
             qMsgBox = QtWidgets.QMessageBox()
             qMsgBox.setWindowTitle("ERROR!!!")
-            qMsgBox.setText("Cannot connect Image Quizzer module to Slicer")
-            qMsgBox.setInformativeText(sMsg)
+            qMsgBox.setText(sText)
+            qMsgBox.setInformativeText(sInfo)
             qMsgBox.exec() 
+
+        except SlicerConnectError as oError:
+            self.showError(str(oError))
+
+        except:
+            self.showError(traceback.format_exc())
                                            
         return bModuleUpdated
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def showError(self, sMsg):
+
+        qMsgBox = QtWidgets.QMessageBox()
+        qMsgBox.setWindowTitle("ERROR!!!")
+        qMsgBox.setText("Cannot connect Image Quizzer module to Slicer")
+        qMsgBox.setInformativeText(sMsg)
+        qMsgBox.exec() 
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -357,26 +322,9 @@ class ApplicationLogic():
 
 if __name__ == '__main__':
 
+    # run connector with GUI (with arguments, the command line above has already run)
     app=QApplication(sys.argv)
 
-    if len(sys.argv) == 1:
-        # run connector with GUI
-        IQModuleConnector = ImageQuizzerModuleConnector()
-        IQModuleConnector.show()
-        app.exec()
-
-    elif len(sys.argv) == 3:
-        # run connector without GUI
-        oAppLogic = ApplicationLogic()
-        oAppLogic.connectModuleInSlicer(sys.argv[1],sys.argv[2])
-
-    else:
-        qMsgBox = QtWidgets.QMessageBox()
-        qMsgBox.setWindowTitle("INVALID")
-        qMsgBox.setText("Not enough arguments")
-        qMsgBox.setInformativeText("\nUsage (with gui): ImageQuizerModuleConnector\n" \
-                                   + "Usage ( no gui ): ImageQuizerModuleConnector 'ImageQuizzerModulePath' 'SlicerAppPath'")
-        qMsgBox.exec() 
-
-
-
+    IQModuleConnector = ImageQuizzerModuleConnector()
+    IQModuleConnector.show()
+    app.exec()
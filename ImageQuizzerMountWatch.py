@@ -0,0 +1,212 @@
+'''
+    Watch mode for the Baines Image Quizzer module connector.
+
+    Instead of relying on users to run setup-moduleConnector after plugging in a
+    USB stick, a small resident process waits for new mounts and connects the
+    Image Quizzer install found on a new volume to Slicer (see
+    ImageQuizzerConnectorSettings.autoConnect - the Qt-free logic behind the
+    connector's Connect button).
+
+    Linux:      /proc/self/mounts is watched with poll(); the kernel flags the file
+                (POLLPRI | POLLERR) whenever the mount table changes, so the watcher
+                sleeps in the kernel while idle and wakes as soon as something is
+                mounted. (inotify does not report changes to /proc files.)
+    Otherwise:  the drive letters (Windows) or /Volumes (macOS) are listed every
+                fPOLL_SECONDS - a few system calls per poll.
+
+    Usage:      >> setup-cli watch [--poll SECONDS] [--json]
+                >> setup-moduleConnector --watch
+'''
+
+import os, sys
+import select
+import string
+import threading
+import traceback
+
+from ImageQuizzerConnectorSettings import isModuleDir, autoConnect
+from ImageQuizzerSlicerDiscovery import forgetVolumeId
+
+
+fPOLL_SECONDS = 0.5             # fallback polling interval
+fSETTLE_SECONDS = 0.3           # let the mount finish before reading the volume
+iLAYOUT_DEPTH = 2               # folder levels of a new volume searched for an install
+
+sPROC_MOUNTS = '/proc/self/mounts'
+
+# mounts that never hold a user's files
+setPSEUDO_FS = {'proc', 'sysfs', 'devtmpfs', 'devpts', 'cgroup', 'cgroup2', 'securityfs', 'debugfs',\
+                'tracefs', 'mqueue', 'pstore', 'bpf', 'configfs', 'fusectl', 'hugetlbfs', 'autofs',\
+                'binfmt_misc', 'efivarfs', 'rpc_pipefs', 'nsfs'}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getMountPoints():
+    ''' Set of the mount points (drives on Windows) currently available.
+    '''
+    if os.path.exists(sPROC_MOUNTS):
+        setMounts = set()
+        with open(sPROC_MOUNTS, 'r', encoding='utf-8', errors='surrogateescape') as fIn:
+            for sLine in fIn:
+                lFields = sLine.split()
+                if len(lFields) >= 3 and lFields[2] not in setPSEUDO_FS:
+                    setMounts.add(_unescapeMountPath(lFields[1]))
+        return setMounts
+
+    if os.name == 'nt':
+        import ctypes
+        iMask = ctypes.windll.kernel32.GetLogicalDrives()
+        return {sLetter + ':\\' for iBit, sLetter in enumerate(string.ascii_uppercase) if iMask & (1 << iBit)}
+
+    try:
+        return {os.path.join('/Volumes', sName) for sName in os.listdir('/Volumes')}
+    except OSError:
+        return set()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _unescapeMountPath(sPath):
+    ''' /proc/mounts writes space, tab, newline and backslash as octal escapes (\\040).
+    '''
+    if '\\' not in sPath:
+        return sPath
+    lParts = sPath.split('\\')
+    sResult = lParts[0]
+    for sPart in lParts[1:]:
+        if len(sPart) >= 3 and all(sChar in '01234567' for sChar in sPart[:3]):
+            sResult = sResult + chr(int(sPart[:3], 8)) + sPart[3:]
+        else:
+            sResult = sResult + '\\' + sPart
+    return sResult
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def findModuleOnVolume(sMountPoint, iMaxDepth=iLAYOUT_DEPTH):
+    ''' First Image Quizzer install (a folder with ImageQuizzer/Code) at most
+        iMaxDepth levels below the mount point, or None.
+    '''
+    lLevel = [sMountPoint]
+    for iDepth in range(iMaxDepth + 1):
+        lNextLevel = []
+        for sDir in sorted(lLevel):
+            if isModuleDir(sDir):
+                return sDir
+            try:
+                with os.scandir(sDir) as itEntries:
+                    for oEntry in itEntries:
+                        if oEntry.is_dir(follow_symlinks=False) and not oEntry.name.startswith(('.', '$')):
+                            lNextLevel.append(oEntry.path)
+            except OSError:
+                pass
+        lLevel = lNextLevel
+    return None
+
+
+##########################################################################
+#
+# MountWatcher
+#
+##########################################################################
+class MountWatcher():
+    ''' Calls fnOnMount(mount point) on the watcher's thread for every volume
+        mounted after start. run() blocks until stop() is called from another thread.
+        An exception raised by fnOnMount goes to fnOnError(mount point, exception),
+        or is printed to stderr without one; the watcher keeps running.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, fnOnMount, fPollSeconds=fPOLL_SECONDS, fnOnError=None):
+        self.fnOnMount = fnOnMount
+        self.fnOnError = fnOnError
+        self.fPollSeconds = fPollSeconds
+        self.oStopEvent = threading.Event()
+        self.bUsesPoll = os.path.exists(sPROC_MOUNTS) and hasattr(select, 'poll')
+        self.iWakeRead, self.iWakeWrite = os.pipe() if self.bUsesPoll else (None, None)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def stop(self):
+        self.oStopEvent.set()
+        try:
+            if self.iWakeWrite is not None:
+                os.write(self.iWakeWrite, b'x')
+        except OSError:
+            pass
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        setKnown = getMountPoints()
+        try:
+            if self.bUsesPoll:
+                self._runPoll(setKnown)
+            else:
+                self._runPolling(setKnown)
+        finally:
+            for iFd in (self.iWakeRead, self.iWakeWrite):
+                if iFd is not None:
+                    os.close(iFd)
+            self.iWakeRead = self.iWakeWrite = None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _runPoll(self, setKnown):
+        ''' Sleep in poll() until the kernel flags a mount table change (or stop()).
+        '''
+        with open(sPROC_MOUNTS, 'rb') as fMounts:
+            oPoll = select.poll()
+            oPoll.register(fMounts.fileno(), select.POLLPRI | select.POLLERR)
+            oPoll.register(self.iWakeRead, select.POLLIN)
+            fMounts.read()
+            while not self.oStopEvent.is_set():
+                lEvents = oPoll.poll()
+                if self.oStopEvent.is_set():
+                    break
+                if any(iFd == fMounts.fileno() for iFd, _ in lEvents):
+                    # the event is re-armed by reading the file again
+                    fMounts.seek(0)
+                    fMounts.read()
+                    setKnown = self._checkMounts(setKnown)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _runPolling(self, setKnown):
+        while not self.oStopEvent.wait(self.fPollSeconds):
+            setKnown = self._checkMounts(setKnown)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _checkMounts(self, setKnown):
+        setMounts = getMountPoints()
+        lNew = sorted(setMounts - setKnown)
+        # another stick may be mounted at the same place next
+        for sMountPoint in (setKnown - setMounts) | set(lNew):
+            forgetVolumeId(sMountPoint)
+        if lNew and self.oStopEvent.wait(fSETTLE_SECONDS):
+            return setMounts
+        for sMountPoint in lNew:
+            try:
+                self.fnOnMount(sMountPoint)
+            except Exception as oError:
+                self._reportError(sMountPoint, oError)
+        return setMounts
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _reportError(self, sMountPoint, oError):
+        if self.fnOnError is not None:
+            try:
+                self.fnOnError(sMountPoint, oError)
+                return
+            except Exception:
+                pass
+        try:
+            print("Image Quizzer watch - %s :" % sMountPoint, file=sys.stderr)
+            traceback.print_exception(type(oError), oError, oError.__traceback__, file=sys.stderr)
+        except (OSError, ValueError):
+            pass
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def connectOnMount(sMountPoint):
+    ''' Connect the Image Quizzer install of a newly mounted volume, if it has one.
+        Returns (module path, Slicer path, connectAll results) or None.
+    '''
+    sModulePath = findModuleOnVolume(sMountPoint)
+    if sModulePath is None:
+        return None
+    sModulePath, sSlicerPath, sSource, lResults = autoConnect(sModulePath)
+    if lResults is None:
+        return None
+    return sModulePath, sSlicerPath, lResults
@@ -0,0 +1,218 @@
+'''
+    Performance log for the Baines Image Quizzer setup utilities.
+
+    Every install appends JSON lines to '<install folder>.iq-perf.jsonl', next to
+    the install (the install folder itself is replaced by staged installs):
+
+        {"event": "start", "time": ..., "target": ..., "pid": ...}
+        {"event": "job", <install options>}
+        {"event": "phase", "phase": "walk", "seconds": 0.41, "files": 1200, ...}
+        {"event": "file", "phase": "copy", "path": ..., "bytes": ..., "seconds": ..., "method": ...}
+        {"event": "summary", "status": "ok", "seconds": ..., "phases": {<phase>: {"seconds", "files",
+                             "bytes", "mb_per_s", "files_per_s"}}}
+
+    Phases: preflight, backup_rename, backup_copy and backup_delete (backup on another
+    drive), delete, walk, link, copy, dedup (identical files linked or cloned), sync,
+    flush, verify, swap, preserve, prune, archive (an archive backup, logged in a
+    session of its own when built in the background) and ini_rewrite (module
+    connector). Per-file records are written for copied and extracted files.
+
+    With profiling on (setup-cli install --cprofile, or IQ_CPROFILE=1 for the GUI
+    tools) the install thread also runs under cProfile; the statistics are written
+    to '<install folder>.iq-perf.prof' (read with python -m pstats) and the top
+    functions are added to the log. The copy worker threads are not profiled.
+
+    Records are buffered and appended in batches; a log that cannot be written
+    is silently dropped - it must never fail an install. A log larger than
+    iMAX_LOG_BYTES is moved to '.iq-perf.jsonl.1' when the next install starts.
+
+    This module is imported by the install job, copy engine, release archive and
+    module connector, and is bundled into the setup executables by pyinstaller.
+'''
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+sPERF_LOG_SUFFIX = '.iq-perf.jsonl'
+sPROFILE_SUFFIX = '.iq-perf.prof'
+sPROFILE_ENV = 'IQ_CPROFILE'
+
+iMAX_LOG_BYTES = 20 * 1000 * 1000
+iFLUSH_RECORDS = 512            # buffered records before they are appended
+iPROFILE_TOP = 25               # functions listed in the log
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getPerfLogPath(sInstallDir):
+    return os.path.abspath(sInstallDir).rstrip('\\/') + sPERF_LOG_SUFFIX
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isProfileRequested():
+    ''' True if cProfile is switched on for the GUI tools (IQ_CPROFILE=1).
+    '''
+    return os.environ.get(sPROFILE_ENV, '') not in ('', '0')
+
+
+##########################################################################
+#
+# PerfLog
+#
+##########################################################################
+class PerfLog():
+    ''' Thread-safe JSON-lines timing log. PerfLog() without a path records
+        nothing, so instrumented code does not need to check for a log.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sPath=None, bProfile=False):
+        self.sPath = sPath
+        self.bEnabled = sPath is not None
+        self.bProfile = bProfile and self.bEnabled
+        self.oLock = threading.Lock()
+        self.lPending = []
+        self.bStarted = False
+        self.fStartTime = time.perf_counter()
+        self.dPhases = {}           # phase -> [seconds, files, bytes]
+        self.oProfiler = None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def record(self, sEvent, **dFields):
+        if not self.bEnabled:
+            return
+        dRecord = {'event': sEvent}
+        dRecord.update(dFields)
+        with self.oLock:
+            self._begin(time.perf_counter())
+            self.lPending.append(dRecord)
+            if len(self.lPending) >= iFLUSH_RECORDS:
+                self._flush()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _begin(self, fStartTime):
+        ''' Start a new session of the log with its first record (lock held).
+        '''
+        if self.bStarted:
+            return
+        self.bStarted = True
+        self.fStartTime = fStartTime
+        self.lPending.append({'event': 'start', 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),\
+                              'target': self.sPath[:-len(sPERF_LOG_SUFFIX)], 'pid': os.getpid()})
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @contextmanager
+    def phase(self, sPhase, **dFields):
+        ''' Time the with-block as sPhase. Fields may be added to the yielded dict
+            inside the block ('files' and 'bytes' count towards the summary).
+        '''
+        dFields = dict(dFields)
+        fStart = time.perf_counter()
+        try:
+            yield dFields
+        except BaseException as oError:
+            dFields['error'] = type(oError).__name__
+            raise
+        finally:
+            self.addPhase(sPhase, time.perf_counter() - fStart, **dFields)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def addPhase(self, sPhase, fSeconds, **dFields):
+        if not self.bEnabled:
+            return
+        with self.oLock:
+            self._begin(time.perf_counter() - fSeconds)
+            lTotals = self.dPhases.setdefault(sPhase, [0.0, 0, 0])
+            lTotals[0] += fSeconds
+            lTotals[1] += dFields.get('files', 0)
+            lTotals[2] += dFields.get('bytes', 0)
+        self.record('phase', phase=sPhase, seconds=round(fSeconds, 6), **dFields)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def addFile(self, sPhase, sRelPath, iBytes, fSeconds, sMethod=None):
+        ''' One copied (or extracted) file. Only the phase record counts towards the
+            summary; the per-file records show where the time went.
+        '''
+        if not self.bEnabled:
+            return
+        dFields = {'phase': sPhase, 'path': sRelPath.replace(os.sep, '/'), 'bytes': iBytes,\
+                   'seconds': round(fSeconds, 6)}
+        if sMethod is not None:
+            dFields['method'] = sMethod
+        self.record('file', **dFields)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        ''' phase -> {seconds, files, bytes, mb_per_s, files_per_s}
+        '''
+        dSummary = {}
+        with self.oLock:
+            for sPhase, (fSeconds, iFiles, iBytes) in self.dPhases.items():
+                dPhase = {'seconds': round(fSeconds, 3), 'files': iFiles, 'bytes': iBytes}
+                if fSeconds > 0 and iBytes:
+                    dPhase['mb_per_s'] = round(iBytes / fSeconds / 1e6, 2)
+                if fSeconds > 0 and iFiles:
+                    dPhase['files_per_s'] = round(iFiles / fSeconds, 1)
+                dSummary[sPhase] = dPhase
+        return dSummary
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def startProfiler(self):
+        ''' Profile the calling thread until close() (if profiling is on).
+        '''
+        if not self.bProfile or self.oProfiler is not None:
+            return
+        import cProfile
+        self.oProfiler = cProfile.Profile()
+        self.oProfiler.enable()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _stopProfiler(self):
+        if self.oProfiler is None:
+            return
+        import pstats
+        self.oProfiler.disable()
+        sProfilePath = self.sPath[:-len(sPERF_LOG_SUFFIX)] + sPROFILE_SUFFIX
+        lTop = []
+        try:
+            self.oProfiler.dump_stats(sProfilePath)
+            oStats = pstats.Stats(self.oProfiler)
+            for tupFunc in sorted(oStats.stats, key=lambda tupKey: oStats.stats[tupKey][3], reverse=True)[:iPROFILE_TOP]:
+                iCalls, _, fTotal, fCumulative, _ = oStats.stats[tupFunc]
+                lTop.append({'function': "%s:%d(%s)" % tupFunc, 'calls': iCalls,\
+                             'tottime': round(fTotal, 4), 'cumtime': round(fCumulative, 4)})
+        except OSError:
+            sProfilePath = None
+        self.oProfiler = None
+        self.record('profile', path=sProfilePath, top=lTop)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self, sStatus='ok'):
+        ''' Write the summary and everything still buffered.
+        '''
+        self._stopProfiler()
+        if not self.bEnabled or not self.bStarted:
+            return
+        self.record('summary', status=sStatus, seconds=round(time.perf_counter() - self.fStartTime, 3),\
+                    phases=self.getSummary())
+        with self.oLock:
+            self._flush()
+            self.bStarted = False
+            self.dPhases = {}
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _flush(self):
+        ''' Append the buffered records (called with the lock held).
+        '''
+        if not self.lPending:
+            return
+        lRecords, self.lPending = self.lPending, []
+        try:
+            if lRecords[0]['event'] == 'start' and os.path.isfile(self.sPath) and \
+                    os.path.getsize(self.sPath) > iMAX_LOG_BYTES:
+                os.replace(self.sPath, self.sPath + '.1')
+            with open(self.sPath, 'a', encoding='utf-8') as fOut:
+                fOut.write(''.join(json.dumps(dRecord) + '\n' for dRecord in lRecords))
+        except OSError:
+            self.bEnabled = False
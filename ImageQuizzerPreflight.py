@@ -0,0 +1,566 @@
+'''
+    Pre-flight check for the Baines Image Quizzer install manager.
+
+    Runs before anything destructive (backup rename, removing the old install) and
+    answers three questions about an InstallJob:
+
+        - how much will be written: the source is totalled with a parallel scandir
+          walk (install rules applied), and compared with the existing install,
+          staging folder or snapshot where the job would keep or hard-link files
+          (and with dedup on, duplicates that will be hard-linked are not counted)
+        - does it fit: the bytes needed (less the space freed by removing the old
+          install first, plus slack for partly used allocation blocks) against
+          shutil.disk_usage of the target volume
+        - how long will it take: a short write probe (iPROBE_BYTES of data and
+          iPROBE_FILES small files, fsynced) in the folder the install goes into
+          measures throughput and per-file overhead of the target. The estimate
+          assumes the source reads faster than the target writes.
+
+    Source totals of a folder with a cached content manifest (.iq-manifest, see
+    ImageQuizzerManifest.py) are kept in <user config>/ImageQuizzer/preflight-cache.json,
+    keyed by the source folder, the install rules and the manifest's size and
+    modification time, together with the modification time of every folder walked.
+    A folder's time changes when a file in it is added, removed or replaced, so
+    checking them (one stat per folder, in parallel) catches changes anywhere in
+    the tree, and a full install from an unchanged release skips the walk.
+
+    This module is imported by ImageQuizzerInstallManager.py and ImageQuizzerSetupCLI.py
+    and is bundled into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageQuizzerCopyEngine import setINTERNAL_FILES, hasJournal, findDuplicates, iMTIME_TOLERANCE_NS, iDEFAULT_WORKERS
+from ImageQuizzerManifest import getManifestPath, loadManifest
+from ImageQuizzerReleaseArchive import ReleaseArchive, isReleaseArchive
+from ImageQuizzerBackup import getLatestBackup, getBackupPath, isSameVolume
+from ImageQuizzerInstallJob import getStagingPath
+from ImageQuizzerSlicerDiscovery import getConfigDir
+
+
+sCACHE_NAME = 'preflight-cache.json'
+iCACHE_VERSION = 2
+
+iPROBE_BYTES = 16 * 1024 * 1024     # data written by the throughput probe ...
+fPROBE_SECONDS = 1.0                # ... unless this takes longer
+iPROBE_CHUNK_SIZE = 1024 * 1024
+iPROBE_FILES = 32                   # small files written to measure per-file overhead
+iPROBE_FILE_SIZE = 4096
+
+fSPACE_MARGIN = 0.02                # kept free on top of the estimate ...
+iSPACE_MARGIN_MIN = 1024 * 1024     # ... but at least this much
+iDEFAULT_BLOCK_SIZE = 4096          # allocation block where statvfs is not available
+
+
+##########################################################################
+#
+# WriteProbe
+#
+##########################################################################
+class WriteProbe():
+    ''' Write throughput and per-file overhead measured in a folder of the target.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, fBytesPerSecond, fFileSeconds, bHardLinks):
+        self.fBytesPerSecond = fBytesPerSecond
+        self.fFileSeconds = fFileSeconds
+        self.bHardLinks = bHardLinks
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        return {'write_mb_per_s': round(self.fBytesPerSecond / 1e6, 1),\
+                'file_ms': round(self.fFileSeconds * 1000, 2), 'hard_links': self.bHardLinks}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def probeWriteSpeed(sDir, iBytes=iPROBE_BYTES, fMaxSeconds=fPROBE_SECONDS):
+    ''' Write and fsync a test file of up to iBytes (stopping after fMaxSeconds)
+        and iPROBE_FILES small files in a temporary folder in sDir, try a hard link,
+        then delete everything. Returns a WriteProbe; raises OSError if sDir
+        cannot be written.
+    '''
+    sProbeDir = tempfile.mkdtemp(prefix='.iq-preflight-', dir=sDir)
+    try:
+        # random data - zeros would be compressed by some filesystems
+        yChunk = os.urandom(iPROBE_CHUNK_SIZE)
+        iWritten = 0
+        fStart = time.perf_counter()
+        with open(os.path.join(sProbeDir, 'probe.bin'), 'wb', buffering=0) as fOut:
+            while iWritten < iBytes and time.perf_counter() - fStart < fMaxSeconds:
+                iWritten += fOut.write(yChunk[:iBytes - iWritten])
+            os.fsync(fOut.fileno())
+        fBytesPerSecond = iWritten / max(time.perf_counter() - fStart, 1e-6)
+
+        yFile = yChunk[:iPROBE_FILE_SIZE]
+        lPaths = [os.path.join(sProbeDir, 'f%03d' % i) for i in range(iPROBE_FILES)]
+        fStart = time.perf_counter()
+        for sPath in lPaths:
+            with open(sPath, 'wb') as fOut:
+                fOut.write(yFile)
+        for sPath in lPaths:
+            iFd = os.open(sPath, os.O_RDONLY)
+            try:
+                os.fsync(iFd)
+            except OSError:
+                pass        # Windows cannot fsync a read-only handle - timing is still useful
+            finally:
+                os.close(iFd)
+        fElapsed = time.perf_counter() - fStart
+        fFileSeconds = max(0.0, fElapsed - iPROBE_FILES * iPROBE_FILE_SIZE / fBytesPerSecond) / iPROBE_FILES
+
+        try:
+            os.link(lPaths[0], os.path.join(sProbeDir, 'link'))
+            bHardLinks = True
+        except (OSError, AttributeError, NotImplementedError):
+            bHardLinks = False
+
+        return WriteProbe(fBytesPerSecond, fFileSeconds, bHardLinks)
+
+    finally:
+        shutil.rmtree(sProbeDir, ignore_errors=True)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getExistingAncestor(sPath):
+    ''' sPath, or the nearest folder above it that exists.
+    '''
+    sPath = os.path.abspath(sPath)
+    while not os.path.isdir(sPath):
+        sParent = os.path.dirname(sPath)
+        if sParent == sPath:
+            break
+        sPath = sParent
+    return sPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getBlockSize(sDir):
+    ''' Allocation block of the filesystem holding sDir - every file uses a whole
+        number of blocks (32 KB or more on a large exFAT stick).
+    '''
+    try:
+        return max(os.statvfs(sDir).f_frsize, 512)
+    except (OSError, AttributeError):
+        return iDEFAULT_BLOCK_SIZE
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def scanTreeParallel(sRootDir, oRules=None, iWorkers=iDEFAULT_WORKERS, dDirMtimes=None):
+    ''' relpath -> (size, mtime_ns) of the files under sRootDir, as scanTree
+        (ImageQuizzerCopyEngine) returns them. The folders of each level are listed
+        concurrently by a pool of iWorkers threads; on a USB stick or network share
+        the time goes into waiting for the device, not into Python.
+        The modification time of every folder walked ('' for sRootDir) is added to
+        dDirMtimes, if given.
+    '''
+    if oRules is not None and oRules.isEmpty():
+        oRules = None
+
+    dFiles = {}
+    if not os.path.isdir(sRootDir):
+        return dFiles
+
+    def _listDir(sRelDir):
+        lFiles = []
+        lSubDirs = []
+        iMtime = None
+        try:
+            # before listing - a change while the folder is listed is seen next time
+            iMtime = os.stat(os.path.join(sRootDir, sRelDir)).st_mtime_ns
+            with os.scandir(os.path.join(sRootDir, sRelDir)) as itEntries:
+                for oEntry in itEntries:
+                    sRelPath = os.path.join(sRelDir, oEntry.name)
+                    bIsDir = oEntry.is_dir()
+                    if oRules is not None and oRules.isExcluded(sRelPath, bIsDir):
+                        continue
+                    if bIsDir:
+                        lSubDirs.append(sRelPath)
+                    else:
+                        oStat = oEntry.stat()
+                        lFiles.append((sRelPath, (oStat.st_size, oStat.st_mtime_ns)))
+        except OSError:
+            pass
+        return lFiles, lSubDirs, iMtime
+
+    lLevel = ['']
+    with ThreadPoolExecutor(max_workers=max(1, iWorkers)) as oPool:
+        while lLevel:
+            lNextLevel = []
+            for sRelDir, (lFiles, lSubDirs, iMtime) in zip(lLevel, oPool.map(_listDir, lLevel)):
+                dFiles.update(lFiles)
+                lNextLevel.extend(lSubDirs)
+                if dDirMtimes is not None:
+                    dDirMtimes[sRelDir] = iMtime
+            lLevel = lNextLevel
+    return dFiles
+
+
+##########################################################################
+#
+# SourceTotalsCache
+#
+##########################################################################
+class SourceTotalsCache():
+    ''' (files, bytes) of source folders, valid while the folder's cached content
+        manifest, the modification times of its folders and the install rules are
+        unchanged.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sPath=None):
+        self.sPath = sPath or os.path.join(getConfigDir(), sCACHE_NAME)
+        self.dSources = {}
+        try:
+            with open(self.sPath, 'r', encoding='utf-8') as fIn:
+                dCache = json.load(fIn)
+            if dCache.get('version') == iCACHE_VERSION:
+                self.dSources = dCache.get('sources', {})
+        except (OSError, ValueError):
+            pass
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _getKey(self, sSourceDir, oRules):
+        ''' (source key, rules key, manifest signature) or None if the source has
+            no manifest to tie the totals to.
+        '''
+        try:
+            oManifestStat = os.stat(getManifestPath(sSourceDir))
+            iRootMtime = os.stat(sSourceDir).st_mtime_ns
+        except OSError:
+            return None
+        sPatterns = '\n'.join(('!' if bNegated else '') + sPattern + ('/' if bDirOnly else '')\
+                              for sPattern, _, bNegated, bDirOnly in oRules.lPatterns) if oRules is not None else ''
+        sRulesKey = hashlib.blake2b(sPatterns.encode('utf-8'), digest_size=8).hexdigest()
+        return os.path.abspath(sSourceDir), sRulesKey, [oManifestStat.st_size, oManifestStat.st_mtime_ns, iRootMtime]
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def lookup(self, sSourceDir, oRules, iWorkers=iDEFAULT_WORKERS):
+        tupKey = self._getKey(sSourceDir, oRules)
+        if tupKey is None:
+            return None
+        sSourceKey, sRulesKey, lSignature = tupKey
+        dEntry = self.dSources.get(sSourceKey, {}).get(sRulesKey)
+        if dEntry is None or dEntry.get('manifest') != lSignature:
+            return None
+        if not _isFoldersUnchanged(sSourceDir, dEntry.get('folders'), iWorkers):
+            return None
+        return dEntry['files'], dEntry['bytes']
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def remember(self, sSourceDir, oRules, iFiles, iBytes, dDirMtimes):
+        ''' Store the totals with the folder modification times of the walk that
+            counted them (see scanTreeParallel) and write the cache file; a read-only
+            config folder only loses the cache.
+        '''
+        tupKey = self._getKey(sSourceDir, oRules)
+        if tupKey is None or None in dDirMtimes.values():
+            return
+        sSourceKey, sRulesKey, lSignature = tupKey
+        self.dSources.setdefault(sSourceKey, {})[sRulesKey] = {'manifest': lSignature, 'files': iFiles, 'bytes': iBytes,\
+                                                                'folders': dDirMtimes}
+        try:
+            os.makedirs(os.path.dirname(self.sPath), exist_ok=True)
+            sTempPath = '%s.%d-%d.tmp' % (self.sPath, os.getpid(), threading.get_ident())
+            with open(sTempPath, 'w', encoding='utf-8') as fOut:
+                json.dump({'version': iCACHE_VERSION, 'sources': self.dSources}, fOut, indent=1)
+            os.replace(sTempPath, self.sPath)
+        except OSError:
+            pass
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _isFoldersUnchanged(sRootDir, dDirMtimes, iWorkers):
+    ''' True if every folder of dDirMtimes still has its modification time.
+    '''
+    if not dDirMtimes:
+        return False
+
+    def _getMtime(sRelDir):
+        try:
+            return os.stat(os.path.join(sRootDir, sRelDir)).st_mtime_ns
+        except OSError:
+            return None
+
+    lDirs = list(dDirMtimes)
+    with ThreadPoolExecutor(max_workers=max(1, iWorkers)) as oPool:
+        for sRelDir, iMtime in zip(lDirs, oPool.map(_getMtime, lDirs)):
+            if iMtime != dDirMtimes[sRelDir]:
+                return False
+    return True
+
+
+##########################################################################
+#
+# PreflightReport
+#
+##########################################################################
+class PreflightReport():
+    ''' Result of runPreflight - go/no-go, space and time estimate.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self):
+        self.iSourceFiles = 0
+        self.iSourceBytes = 0
+        self.iFilesToWrite = 0
+        self.iBytesToWrite = 0
+        self.iFilesToLink = 0
+        self.iFilesDeduped = 0      # identical files hard-linked within the install
+        self.iBytesDeduped = 0
+        self.iBytesFreed = 0        # old install removed (or moved to another drive) before the copy starts
+        self.iBackupBytes = 0       # copied to a backup folder on another drive
+        self.iBackupBytesFree = None
+        self.iBytesNeeded = 0
+        self.iBytesFree = None
+        self.oProbe = None
+        self.bFromCache = False
+        self.lProblems = []
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def isGo(self):
+        return not self.lProblems
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getEstimatedSeconds(self):
+        ''' Seconds the copy is expected to take, or None without a write probe.
+        '''
+        if self.oProbe is None:
+            return None
+        return self.iBytesToWrite / max(self.oProbe.fBytesPerSecond, 1.0) +\
+               (self.iFilesToWrite + self.iFilesToLink + self.iFilesDeduped) * self.oProbe.fFileSeconds
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getSummary(self):
+        ''' Short text for the status bar and the confirm message.
+        '''
+        sSummary = "%d files, %s to write" % (self.iFilesToWrite, formatBytes(self.iBytesToWrite))
+        if self.iFilesToLink > 0:
+            sSummary = sSummary + " (%d files hard-linked)" % self.iFilesToLink
+        if self.iFilesDeduped > 0:
+            sSummary = sSummary + " (%d identical files linked, %s saved)" % (self.iFilesDeduped,\
+                                                                              formatBytes(self.iBytesDeduped))
+        if self.iBytesFree is not None:
+            sSummary = sSummary + " - needs %s of %s free" % (formatBytes(self.iBytesNeeded), formatBytes(self.iBytesFree))
+        fSeconds = self.getEstimatedSeconds()
+        if fSeconds is not None:
+            sSummary = sSummary + " - about %s at %.1f MB/s" % (formatDuration(fSeconds), self.oProbe.fBytesPerSecond / 1e6)
+        return sSummary
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def toDict(self):
+        fSeconds = self.getEstimatedSeconds()
+        return {'go': self.isGo(), 'problems': self.lProblems,\
+                'source_files': self.iSourceFiles, 'source_bytes': self.iSourceBytes,\
+                'files_to_write': self.iFilesToWrite, 'bytes_to_write': self.iBytesToWrite,\
+                'files_to_link': self.iFilesToLink, 'files_deduped': self.iFilesDeduped,\
+                'bytes_deduped': self.iBytesDeduped, 'bytes_freed': self.iBytesFreed,\
+                'backup_bytes': self.iBackupBytes, 'backup_bytes_free': self.iBackupBytesFree,\
+                'bytes_needed': self.iBytesNeeded, 'bytes_free': self.iBytesFree,\
+                'estimated_seconds': round(fSeconds, 1) if fSeconds is not None else None,\
+                'probe': self.oProbe.toDict() if self.oProbe is not None else None,\
+                'source_from_cache': self.bFromCache}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def formatBytes(iBytes):
+    for sUnit in ('bytes', 'KB', 'MB', 'GB'):
+        if abs(iBytes) < 1000 or sUnit == 'GB':
+            break
+        iBytes = iBytes / 1000
+    if sUnit == 'bytes':
+        return "%d bytes" % iBytes
+    return "%.1f %s" % (iBytes, sUnit)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def formatDuration(fSeconds):
+    if fSeconds < 60:
+        return "%d s" % max(1, round(fSeconds))
+    iMinutes, iSeconds = divmod(int(round(fSeconds)), 60)
+    if iMinutes < 60:
+        return "%d min %d s" % (iMinutes, iSeconds)
+    return "%d h %d min" % divmod(iMinutes, 60)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getSourceTotals(oJob, oCache=None):
+    ''' (files, bytes, from cache) of everything the job would install.
+    '''
+    if isReleaseArchive(oJob.sSourceDir):
+        dFiles = getSourceFiles(oJob)
+        return len(dFiles), sum(iSize for iSize, _ in dFiles.values()), False
+
+    if oCache is None:
+        oCache = SourceTotalsCache()
+    tupTotals = oCache.lookup(oJob.sSourceDir, oJob.getRules(), oJob.iCopyWorkers)
+    if tupTotals is not None:
+        return tupTotals[0], tupTotals[1], True
+
+    dDirMtimes = {}
+    dFiles = getSourceFiles(oJob, dDirMtimes)
+    iFiles, iBytes = len(dFiles), sum(iSize for iSize, _ in dFiles.values())
+    oCache.remember(oJob.sSourceDir, oJob.getRules(), iFiles, iBytes, dDirMtimes)
+    return iFiles, iBytes, False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getSourceFiles(oJob, dDirMtimes=None):
+    ''' relpath -> (size, mtime_ns) of the source folder or archive, rules applied.
+        For a folder, dDirMtimes is filled as by scanTreeParallel.
+    '''
+    if isReleaseArchive(oJob.sSourceDir):
+        with ReleaseArchive(oJob.sSourceDir) as oArchive:
+            return oJob.getRules().filterFiles(oArchive.getFiles())
+    dFiles = scanTreeParallel(oJob.sSourceDir, oJob.getRules(), oJob.iCopyWorkers, dDirMtimes)
+    for sName in setINTERNAL_FILES:
+        dFiles.pop(sName, None)
+    return dFiles
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getCopyDirs(oJob, bBackup):
+    ''' (folder the job copies into if it already holds files to keep, or None;
+        folder it may hard-link unchanged files from, or None; bytes of the old install
+        removed before copying; bytes of the old install copied to a backup on another
+        drive) - following InstallJob.run, after the backup move if the caller is
+        going to make one.
+    '''
+    sInstallDir = oJob.sInstallDir
+    bResume = not oJob.bIncremental and hasJournal(sInstallDir) and not oJob.bStaged
+    bInstalled = os.path.isdir(sInstallDir) and len(os.listdir(sInstallDir)) > 0
+
+    sLatestBackup = getLatestBackup(sInstallDir, oJob.sBackupRoot)
+    iBytesMoved = 0
+    if bBackup and bInstalled and oJob.bStaged and not oJob.bIncremental:
+        # moved to the backup at the swap - until then it is the newest snapshot, and
+        # one copied to another drive frees nothing during the copy
+        sLatestBackup = sInstallDir
+        if not isSameVolume(sInstallDir, getBackupPath(sInstallDir, sBackupRoot=oJob.sBackupRoot)):
+            dOld = scanTreeParallel(sInstallDir, None, oJob.iCopyWorkers)
+            iBytesMoved = sum(iSize for iSize, _ in dOld.values())
+    elif bBackup and bInstalled and not bResume:
+        if isSameVolume(sInstallDir, getBackupPath(sInstallDir, sBackupRoot=oJob.sBackupRoot)):
+            # renamed to the newest backup before the job runs
+            sLatestBackup = sInstallDir
+        else:
+            # copied to another drive and removed - nothing on the target to link from
+            dOld = scanTreeParallel(sInstallDir, None, oJob.iCopyWorkers)
+            iBytesMoved = sum(iSize for iSize, _ in dOld.values())
+            sLatestBackup = None
+        bInstalled = False
+    sLinkDir = sLatestBackup if oJob.bSnapshot else None
+
+    if oJob.bIncremental or bResume:
+        return (sInstallDir if bInstalled else None), sLinkDir, iBytesMoved, iBytesMoved
+
+    if oJob.bStaged:
+        # the old install is removed after the swap - it frees nothing during the copy
+        sStagingDir = getStagingPath(sInstallDir)
+        if sLinkDir is None and bInstalled:
+            sLinkDir = sInstallDir
+        return (sStagingDir if hasJournal(sStagingDir) else None), sLinkDir, 0, iBytesMoved
+
+    iBytesFreed = iBytesMoved
+    # an archive backup keeps the old install on the target until it has been archived
+    if bInstalled and not oJob.bPreserveUserData and not (oJob.bArchiveBackup and not bBackup):
+        dOld = scanTreeParallel(sInstallDir, None, oJob.iCopyWorkers)
+        iBytesFreed = sum(iSize for iSize, _ in dOld.values())
+    return None, sLinkDir, iBytesFreed, iBytesMoved
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _isSame(tupSourceStat, tupStat):
+    return tupStat is not None and tupStat[0] == tupSourceStat[0] and \
+           abs(tupStat[1] - tupSourceStat[1]) <= iMTIME_TOLERANCE_NS
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _isBelow(sRelPath, lDirs):
+    return any(sRelPath == sDir or sRelPath.startswith(sDir + os.sep) for sDir in lDirs)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runPreflight(oJob, bBackup=False, oProbe=None, oCache=None):
+    ''' Check that the InstallJob fits on its target and estimate how long it takes.
+        bBackup: the existing install is moved to a backup before the job runs,
+        so it is neither removed nor available to keep files from (nor, if the
+        backup is on another drive, to link from - its space is freed instead).
+        A staged install moves it only at the swap and links from it until then.
+        oProbe: WriteProbe of an earlier check of the same target, to skip the probe.
+        Nothing outside a temporary probe folder is written. Returns a PreflightReport.
+    '''
+    with oJob.oPerfLog.phase('preflight') as dPhase:
+        oReport = _runPreflight(oJob, bBackup, oProbe, oCache)
+        dPhase.update(files=oReport.iSourceFiles, bytes=oReport.iSourceBytes, go=oReport.isGo(),\
+                      cached=oReport.bFromCache)
+    return oReport
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _runPreflight(oJob, bBackup, oProbe, oCache):
+    oReport = PreflightReport()
+
+    if not os.path.exists(oJob.sSourceDir):
+        oReport.lProblems.append("Source not found: " + oJob.sSourceDir)
+        return oReport
+
+    sParentDir = getExistingAncestor(os.path.dirname(os.path.abspath(oJob.sInstallDir)))
+    oUsage = shutil.disk_usage(sParentDir)
+    oReport.iBytesFree = oUsage.free
+
+    oReport.oProbe = oProbe
+    if oReport.oProbe is None:
+        try:
+            oReport.oProbe = probeWriteSpeed(sParentDir, min(iPROBE_BYTES, oUsage.free // 4))
+        except OSError as oError:
+            oReport.lProblems.append("Cannot write to " + sParentDir + ": " + (oError.strerror or str(oError)))
+
+    sKeepDir, sLinkDir, oReport.iBytesFreed, oReport.iBackupBytes = _getCopyDirs(oJob, bBackup)
+    if oReport.iBackupBytes > 0:
+        sBackupRoot = os.path.dirname(getBackupPath(oJob.sInstallDir, sBackupRoot=oJob.sBackupRoot))
+        oReport.iBackupBytesFree = shutil.disk_usage(getExistingAncestor(sBackupRoot)).free
+        if oReport.iBackupBytes + iSPACE_MARGIN_MIN > oReport.iBackupBytesFree:
+            oReport.lProblems.append("Not enough free space for the backup in %s: %s needed, %s free" %\
+                                     (sBackupRoot, formatBytes(oReport.iBackupBytes + iSPACE_MARGIN_MIN),\
+                                      formatBytes(oReport.iBackupBytesFree)))
+    if sLinkDir is not None and (oReport.oProbe is None or not oReport.oProbe.bHardLinks):
+        sLinkDir = None
+
+    # duplicates are only counted as saved where they can be hard-linked (a clone is not probed)
+    bDedup = oJob.bDedup and not isReleaseArchive(oJob.sSourceDir) and oReport.oProbe is not None and \
+             oReport.oProbe.bHardLinks
+
+    if sKeepDir is None and sLinkDir is None and not bDedup:
+        # everything is written - the totals are enough
+        oReport.iSourceFiles, oReport.iSourceBytes, oReport.bFromCache = getSourceTotals(oJob, oCache)
+        oReport.iFilesToWrite, oReport.iBytesToWrite = oReport.iSourceFiles, oReport.iSourceBytes
+    else:
+        dSourceFiles = getSourceFiles(oJob)
+        oReport.iSourceFiles = len(dSourceFiles)
+        oReport.iSourceBytes = sum(iSize for iSize, _ in dSourceFiles.values())
+        dKeepFiles = scanTreeParallel(sKeepDir, oJob.getRules(), oJob.iCopyWorkers) if sKeepDir else {}
+        dLinkFiles = scanTreeParallel(sLinkDir, oJob.getRules(), oJob.iCopyWorkers) if sLinkDir else {}
+        setToWrite = set()
+        for sRelPath, tupSourceStat in dSourceFiles.items():
+            if _isSame(tupSourceStat, dKeepFiles.get(sRelPath)):
+                continue
+            if _isSame(tupSourceStat, dLinkFiles.get(sRelPath)) and not _isBelow(sRelPath, oJob.lNO_LINK_DIRS):
+                oReport.iFilesToLink += 1
+                continue
+            setToWrite.add(sRelPath)
+            oReport.iFilesToWrite += 1
+            oReport.iBytesToWrite += tupSourceStat[0]
+
+        if bDedup:
+            # as CopyEngine._planDedup (which also leaves out preserved files that differ)
+            dFiles = {sRelPath: tupStat for sRelPath, tupStat in dSourceFiles.items()\
+                      if not _isBelow(sRelPath, oJob.lNO_LINK_DIRS)}
+            dOriginals = findDuplicates(oJob.sSourceDir, dFiles, setToWrite & set(dFiles),\
+                                        loadManifest(getManifestPath(oJob.sSourceDir)), oJob.iCopyWorkers)
+            oReport.iFilesDeduped = len(dOriginals)
+            oReport.iBytesDeduped = sum(dSourceFiles[sRelPath][0] for sRelPath in dOriginals)
+            oReport.iFilesToWrite -= oReport.iFilesDeduped
+            oReport.iBytesToWrite -= oReport.iBytesDeduped
+
+    # on average half a block is left unused at the end of every file
+    iSlack = oReport.iFilesToWrite * (getBlockSize(sParentDir) // 2)
+    iMargin = max(iSPACE_MARGIN_MIN, int(oReport.iBytesToWrite * fSPACE_MARGIN))
+    oReport.iBytesNeeded = max(0, oReport.iBytesToWrite + iSlack + iMargin - oReport.iBytesFreed)
+    if oReport.iBytesNeeded > oReport.iBytesFree:
+        oReport.lProblems.append("Not enough free space on the target: %s needed, %s free" %\
+                                 (formatBytes(oReport.iBytesNeeded), formatBytes(oReport.iBytesFree)))
+    return oReport
@@ -0,0 +1,413 @@
+'''
+    Release archive source for the Baines Image Quizzer install manager.
+
+    Installs directly from a downloaded release (.zip, .tar.gz, .tgz or .tar)
+    without unzipping it onto the USB stick first. Every member is streamed from
+    the archive into the install folder in fixed-size chunks, so memory use does
+    not depend on the size of the release and every file is written only once.
+
+    A single top-level folder (eg. 'BainesImageQuizzer-main/' in a GitHub download)
+    is stripped from the member names.
+
+    Integrity is checked per member: zip members are checked against their CRC-32
+    as they are read, tar members against their recorded size (and .tar.gz against
+    the gzip CRC at the end of the stream). A member that fails is removed and the
+    extraction stops with ArchiveError.
+
+    Member names that are absolute or climb out of the install folder ('..'), and
+    links or device files, are rejected before anything is written.
+
+    When installing over an existing install, members whose size and modification
+    time match the installed file are skipped, members that are unchanged in a link
+    folder (snapshot or live install) are hard-linked, and installed files that are
+    no longer in the release are removed - the same rules as ImageQuizzerCopyEngine.
+    Extracted files are written as set by the archive's oWritePolicy.
+
+    This module is imported by ImageQuizzerInstallJob.py and is bundled
+    into the 'setup-installManager' executable by pyinstaller.
+'''
+
+import os
+import shutil
+import stat
+import hashlib
+import time
+import tarfile
+import zipfile
+import zlib
+
+from ImageQuizzerCopyEngine import CopyPlan, CopyCancelled, WritePolicy, scanTree, setINTERNAL_FILES, \
+                                  iMTIME_TOLERANCE_NS, iHASH_BUFFER_SIZE
+from ImageQuizzerManifest import loadManifest, saveManifest
+from ImageQuizzerPerfLog import PerfLog
+
+
+lARCHIVE_SUFFIXES = ['.zip', '.tar.gz', '.tgz', '.tar']
+sARCHIVE_MANIFEST_SUFFIX = '.iq-manifest'
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isReleaseArchive(sPath):
+    ''' True if sPath is a release archive file rather than a project folder.
+    '''
+    sPath = str(sPath)
+    return os.path.isfile(sPath) and sPath.lower().endswith(tuple(lARCHIVE_SUFFIXES))
+
+
+##########################################################################
+#
+# ArchiveError
+#
+##########################################################################
+class ArchiveError(Exception):
+    ''' Raised for an unsafe, corrupt or unsupported release archive.
+    '''
+    pass
+
+
+##########################################################################
+#
+# ArchiveMember
+#
+##########################################################################
+class ArchiveMember():
+    ''' One file of the release: install-relative path, size, modification time
+        and the zip/tar entry it is read from.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sRelPath, iSize, iMtimeNs, oInfo):
+        self.sRelPath = sRelPath
+        self.iSize = iSize
+        self.iMtimeNs = iMtimeNs
+        self.oInfo = oInfo
+
+
+##########################################################################
+#
+# ReleaseArchive
+#
+##########################################################################
+class ReleaseArchive():
+    ''' Read-only view of a release archive.
+        Use as a context manager or call close().
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sPath):
+
+        self.sPath = str(sPath)
+        self.oZip = None
+        self.oTar = None
+        self.oPerfLog = PerfLog()      # timings of extractTo (see ImageQuizzerPerfLog)
+        self.oWritePolicy = WritePolicy()
+
+        try:
+            if zipfile.is_zipfile(self.sPath):
+                self.oZip = zipfile.ZipFile(self.sPath)
+            else:
+                # random access mode - members are read in archive order so the
+                # gzip stream is decompressed sequentially
+                self.oTar = tarfile.open(self.sPath, 'r:*')
+        except (OSError, zipfile.BadZipFile, tarfile.TarError) as oError:
+            raise ArchiveError("Cannot open release archive " + self.sPath + " : " + str(oError))
+
+        self.lMembers, self.lDirs = self._readMembers()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __enter__(self):
+        return self
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __exit__(self, *tupExcInfo):
+        self.close()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        if self.oZip is not None:
+            self.oZip.close()
+        if self.oTar is not None:
+            self.oTar.close()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _readMembers(self):
+        ''' List the archive's files and folders with install-relative names.
+            Raises ArchiveError for unsafe members.
+        '''
+        lEntries = []       # (name, bDir, size, mtime_ns, info)
+        if self.oZip is not None:
+            for oInfo in self.oZip.infolist():
+                iMode = (oInfo.external_attr >> 16) & 0xFFFF
+                if stat.S_ISLNK(iMode):
+                    raise ArchiveError("Release archive contains a link : " + oInfo.filename)
+                iMtimeNs = int(time.mktime(oInfo.date_time + (0, 0, -1))) * 1000000000
+                lEntries.append((oInfo.filename, oInfo.is_dir(), oInfo.file_size, iMtimeNs, oInfo))
+        else:
+            for oInfo in self.oTar.getmembers():
+                if not (oInfo.isfile() or oInfo.isdir()):
+                    raise ArchiveError("Release archive contains a link or special file : " + oInfo.name)
+                lEntries.append((oInfo.name, oInfo.isdir(), oInfo.size, int(oInfo.mtime) * 1000000000, oInfo))
+
+        lNames = [_getSafeParts(tupEntry[0]) for tupEntry in lEntries]
+
+        # strip a single top-level folder shared by all members
+        iStrip = 0
+        lFileParts = [lParts for lParts, tupEntry in zip(lNames, lEntries) if lParts and not tupEntry[1]]
+        if lFileParts and all(len(lParts) > 1 for lParts in lFileParts) and \
+                len({lParts[0] for lParts in lNames if lParts}) == 1:
+            iStrip = 1
+
+        lMembers = []
+        setDirs = set()
+        for lParts, (sName, bDir, iSize, iMtimeNs, oInfo) in zip(lNames, lEntries):
+            lParts = lParts[iStrip:]
+            if not lParts:
+                continue
+            sRelPath = os.path.join(*lParts)
+            if sRelPath in setINTERNAL_FILES:
+                continue
+            for iDepth in range(1, len(lParts)):
+                setDirs.add(os.path.join(*lParts[:iDepth]))
+            if bDir:
+                setDirs.add(sRelPath)
+            else:
+                lMembers.append(ArchiveMember(sRelPath, iSize, iMtimeNs, oInfo))
+
+        return lMembers, sorted(setDirs)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getFiles(self):
+        ''' relpath -> (size, mtime_ns) of the release files, as scanTree returns
+            for a folder.
+        '''
+        return {oMember.sRelPath: (oMember.iSize, oMember.iMtimeNs) for oMember in self.lMembers}
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def openMember(self, oMember):
+        if self.oZip is not None:
+            return self.oZip.open(oMember.oInfo)
+        return self.oTar.extractfile(oMember.oInfo)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getManifest(self):
+        ''' Return the content manifest of the release (see ImageQuizzerManifest),
+            cached in '<archive>.iq-manifest' next to the archive. The cache is
+            used if it lists exactly the release's files with the same sizes
+            and modification times.
+        '''
+        sCachePath = self.sPath + sARCHIVE_MANIFEST_SUFFIX
+        dFiles = self.getFiles()
+        dCached = loadManifest(sCachePath)
+        if dCached is not None and len(dCached) == len(dFiles) and \
+                all(dCached.get(sRelPath, (None, None))[:2] == tupStat for sRelPath, tupStat in dFiles.items()):
+            return dCached
+
+        dManifest = {}
+        for oMember in self.lMembers:
+            oHash = hashlib.blake2b()     # same digest as ImageQuizzerCopyEngine.hashFile
+            with self.openMember(oMember) as fIn:
+                _streamMember(oMember, fIn, oHash.update)
+            dManifest[oMember.sRelPath] = (oMember.iSize, oMember.iMtimeNs, oHash.hexdigest())
+        try:
+            saveManifest(dManifest, sCachePath)
+        except OSError:
+            pass    # read-only download folder
+        return dManifest
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def extractTo(self, sTargetDir, sLinkDir=None, lNoLinkDirs=None, lPreserveDirs=None,\
+                  oProgress=None, oCancelEvent=None, oJournal=None, oRules=None):
+        ''' Stream the release into sTargetDir and return a CopyPlan describing
+            what was done. Existing files with the member's size and modification
+            time are kept; files no longer in the release are removed (except
+            below lPreserveDirs, where differing files are reported as conflicts
+            and the user's file is kept). Members excluded by oRules (InstallRules)
+            are not extracted, and excluded target paths are left alone.
+        '''
+        oPlan = CopyPlan(self.sPath, sTargetDir, sLinkDir)
+        lNoLinkDirs = lNoLinkDirs or []
+        lPreserveDirs = lPreserveDirs or []
+
+        lMembers, lDirs = self.lMembers, self.lDirs
+        if oRules is not None and not oRules.isEmpty():
+            lMembers = [oMember for oMember in lMembers if not oRules.isPathExcluded(oMember.sRelPath)]
+            lDirs = [sRelDir for sRelDir in lDirs if not oRules.isPathExcluded(sRelDir, True)]
+
+        with self.oPerfLog.phase('walk', files=len(lMembers)):
+            setExcludedParents = set()
+            dTargetFiles, lTargetDirs = scanTree(sTargetDir, oRules, setExcludedParents)
+            for sName in setINTERNAL_FILES:
+                dTargetFiles.pop(sName, None)
+            dLinkFiles = {}
+            if sLinkDir is not None:
+                dLinkFiles, _ = scanTree(sLinkDir, oRules)
+
+        # stale files and folders of an existing install
+        setReleaseFiles = {oMember.sRelPath for oMember in lMembers}
+        setReleaseDirs = set(lDirs)
+        for sRelPath in sorted(dTargetFiles):
+            if sRelPath not in setReleaseFiles and not _isBelow(sRelPath, lPreserveDirs):
+                oPlan.lFilesToRemove.append(sRelPath)
+        for sRelDir in lTargetDirs:
+            # a folder holding excluded entries is kept - its other files are removed above
+            if sRelDir not in setReleaseDirs and not _isBelow(sRelDir, lPreserveDirs)\
+                    and sRelDir not in setExcludedParents:
+                oPlan.lDirsToRemove.append(sRelDir)
+
+        with self.oPerfLog.phase('delete', files=len(oPlan.lFilesToRemove), dirs=len(oPlan.lDirsToRemove)):
+            for sRelPath in oPlan.lFilesToRemove:
+                _removeFile(os.path.join(sTargetDir, sRelPath))
+            for sRelDir in sorted(oPlan.lDirsToRemove, reverse=True):
+                sPath = os.path.join(sTargetDir, sRelDir)
+                if os.path.isdir(sPath) and not os.path.islink(sPath):
+                    shutil.rmtree(sPath, onerror=_onRemoveError)
+                elif os.path.lexists(sPath):
+                    _removeFile(sPath)
+        for sRelDir in lDirs:
+            os.makedirs(os.path.join(sTargetDir, sRelDir), exist_ok=True)
+
+        # decide per member: keep, conflict, hard-link or extract
+        dMembers = {oMember.sRelPath: oMember for oMember in lMembers}
+        lToExtract = []
+        for oMember in lMembers:
+            tupTarget = dTargetFiles.get(oMember.sRelPath)
+            if tupTarget is not None and _isSame(tupTarget, oMember):
+                oPlan.iFilesUnchanged += 1
+                oPlan.iBytesUnchanged += oMember.iSize
+            elif tupTarget is not None and _isBelow(oMember.sRelPath, lPreserveDirs):
+                oPlan.lConflicts.append(oMember.sRelPath)
+            elif oMember.sRelPath in dLinkFiles and _isSame(dLinkFiles[oMember.sRelPath], oMember) and \
+                    not _isBelow(oMember.sRelPath, lNoLinkDirs):
+                oPlan.lFilesToLink.append((oMember.sRelPath, oMember.iSize))
+            else:
+                if tupTarget is not None:
+                    oPlan.lFilesToReplace.append(oMember.sRelPath)
+                oPlan.lFilesToCopy.append((oMember.sRelPath, oMember.iSize))
+                lToExtract.append(oMember)
+
+        for sRelPath in oPlan.lFilesToReplace:
+            # unlink rather than overwrite - the file may be hard-linked into a snapshot
+            _removeFile(os.path.join(sTargetDir, sRelPath))
+
+        if oJournal is not None:
+            oJournal.open()
+        try:
+            with self.oPerfLog.phase('link') as dPhase:
+                for sRelPath, iSize in oPlan.lFilesToLink:
+                    sTargetPath = os.path.join(sTargetDir, sRelPath)
+                    try:
+                        if os.path.lexists(sTargetPath):
+                            _removeFile(sTargetPath)
+                        os.link(os.path.join(sLinkDir, sRelPath), sTargetPath)
+                        oPlan.iFilesLinked += 1
+                        oPlan.iBytesLinked += iSize
+                    except OSError:
+                        # eg. FAT/exFAT - extract it instead
+                        oPlan.lFilesToCopy.append((sRelPath, iSize))
+                        lToExtract.append(dMembers[sRelPath])
+                dPhase['files'] = oPlan.iFilesLinked
+                dPhase['bytes'] = oPlan.iBytesLinked
+
+            iBytesToExtract = sum(oMember.iSize for oMember in lToExtract)
+            if oProgress is not None:
+                oProgress.start(len(lToExtract), iBytesToExtract)
+
+            with self.oPerfLog.phase('copy', files=len(lToExtract), bytes=iBytesToExtract):
+                for oMember in lToExtract:
+                    self._extractTracked(oPlan, oMember, oProgress, oCancelEvent, oJournal)
+            self.oWritePolicy.flush(oProgress)
+        finally:
+            if oJournal is not None:
+                oJournal.close()
+
+        return oPlan
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _extractTracked(self, oPlan, oMember, oProgress, oCancelEvent, oJournal):
+        ''' Extract one member of the plan, record it and report progress.
+        '''
+        if oCancelEvent is not None and oCancelEvent.is_set():
+            raise CopyCancelled()
+        fStart = time.perf_counter()
+        self._extractMember(oMember, os.path.join(oPlan.sTargetDir, oMember.sRelPath), oCancelEvent)
+        self.oPerfLog.addFile('copy', oMember.sRelPath, oMember.iSize, time.perf_counter() - fStart, 'archive')
+        self.oWritePolicy.fileWritten(os.path.join(oPlan.sTargetDir, oMember.sRelPath), oMember.iSize)
+        oPlan.dCopyMethods[oMember.sRelPath] = 'archive'
+        if oJournal is not None:
+            oJournal.record(oMember.sRelPath, oMember.iSize, oMember.iMtimeNs)
+        if oProgress is not None:
+            oProgress.addFile(oMember.iSize)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _extractMember(self, oMember, sTargetPath, oCancelEvent):
+        ''' Stream one member to sTargetPath in fixed-size chunks and check it.
+            A partial or corrupt file is removed.
+        '''
+        # a write policy buffer collects the chunks into large writes
+        iBuffering = self.oWritePolicy.iBufferSize if self.oWritePolicy.usesOwnCopy() else -1
+        try:
+            with self.openMember(oMember) as fIn, open(sTargetPath, 'wb', buffering=iBuffering) as fOut:
+                _streamMember(oMember, fIn, fOut.write, oCancelEvent)
+            iMtime = oMember.iMtimeNs
+            os.utime(sTargetPath, ns=(iMtime, iMtime))
+        except:
+            if os.path.lexists(sTargetPath):
+                _removeFile(sTargetPath)
+            raise
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _streamMember(oMember, fIn, fnWrite, oCancelEvent=None):
+    ''' Pass the member's data to fnWrite in chunks and check its integrity.
+    '''
+    iRead = 0
+    try:
+        while True:
+            if oCancelEvent is not None and oCancelEvent.is_set():
+                raise CopyCancelled()
+            bytesChunk = fIn.read(iHASH_BUFFER_SIZE)
+            if not bytesChunk:
+                break
+            fnWrite(bytesChunk)
+            iRead += len(bytesChunk)
+    except (zipfile.BadZipFile, zlib.error, EOFError, tarfile.TarError) as oError:
+        raise ArchiveError("Corrupt member in release archive : " + oMember.sRelPath + " (" + str(oError) + ")")
+
+    if iRead != oMember.iSize:
+        raise ArchiveError("Truncated member in release archive : " + oMember.sRelPath +\
+                           " (%d of %d bytes)" % (iRead, oMember.iSize))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getSafeParts(sName):
+    ''' Split an archive member name into path parts.
+        Raises ArchiveError for names that would escape the install folder.
+    '''
+    sName = sName.replace('\\', '/')
+    if sName.startswith('/') or (len(sName) > 1 and sName[1] == ':'):
+        raise ArchiveError("Release archive contains an absolute path : " + sName)
+    lParts = [sPart for sPart in sName.split('/') if sPart not in ('', '.')]
+    if '..' in lParts:
+        raise ArchiveError("Release archive contains a path outside the install folder : " + sName)
+    return lParts
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _isSame(tupStat, oMember):
+    return tupStat[0] == oMember.iSize and abs(tupStat[1] - oMember.iMtimeNs) <= iMTIME_TOLERANCE_NS
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _isBelow(sRelPath, lDirs):
+    for sDir in lDirs:
+        if sRelPath == sDir or sRelPath.startswith(sDir + os.sep):
+            return True
+    return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _removeFile(sPath):
+    try:
+        os.remove(sPath)
+    except PermissionError:
+        os.chmod(sPath, stat.S_IWRITE)
+        os.remove(sPath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _onRemoveError(fnFunc, sPath, tupExcInfo):
+    os.chmod(sPath, stat.S_IWRITE)
+    fnFunc(sPath)
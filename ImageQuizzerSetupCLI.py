@@ -0,0 +1,643 @@
+'''
+    Headless command line for the Baines Image Quizzer setup utilities.
+
+    Runs the install manager and the module connector without a display. PyQt5 is
+    never imported, so the tools start in milliseconds and can be used in scripts,
+    over ssh or on lab machines without a desktop session.
+
+    Packaging:  >> pyinstaller ImageQuizzerSetupCLI.py -n "setup-cli" --onefile
+                (console build - the GUI tools are built with --noconsole and
+                cannot print to the terminal)
+
+    Usage:      >> setup-cli install --source <project folder or release archive> --target <install folder>
+                                     [--backup rename|archive|none] [--backup-dir <folder>] [--snapshot]
+                                     [--keep-backups N] [--dedup]
+                                     [--incremental [--hash]] [--no-staged] [--verify] [--preserve-user-data]
+                                     [--profile code|code+samples|full] [--rules <file>]
+                                     [--backend copytree|parallel|zerocopy] [--workers N]
+                                     [--write-policy default|buffered|batched|flush|removable]
+                                     [--no-preflight | --preflight-only] [--cprofile] [--yes] [--json]
+                >> setup-cli verify <install folder> [--source <project folder or release archive>]
+                                    [--profile code|code+samples|full] [--rules <file>] [--json]
+                >> setup-cli restore <install folder> [--backup-dir <folder>] [--snapshot <name>] [--into <folder>]
+                                     [--overwrite] [--list] [--yes] [--json]
+                >> setup-cli connect [<Image Quizzer install> [<Slicer install or folder>]] [--root <folder>] [--all]
+                                    [--rescan] [--json]
+                >> setup-cli watch [--poll SECONDS] [--json]
+                >> setup-cli fanout --source <project folder> --target <install> --target <install> ...
+                                    [--targets-file <list>] [--slicer <Slicer folder>] [--backup rename|none]
+                                    [--profile code|code+samples|full] [--rules <file>]
+                                    [--yes] [--json]
+
+                The GUI tools hand their command line to this module before loading Qt:
+                >> setup-installManager --source ... --target ...   (same options as 'install')
+                >> setup-installManager --verify <install folder>
+                >> setup-installManager --batch --source ... --target ... --target ...   (as 'fanout')
+                >> setup-moduleConnector <Image Quizzer install> <Slicer install>
+                >> setup-moduleConnector --watch   (as 'watch')
+
+    Exit codes: 0 success, 1 failed (or install differs from the release, or does
+                not fit on the target), 2 invalid arguments, 3 not confirmed or cancelled.
+'''
+
+import sys, os
+import argparse
+import json
+import threading
+import time
+import traceback
+
+# the copy engine, archive and manifest modules are imported by the commands
+# that need them, so that 'connect' and '--help' start as fast as possible
+from ImageQuizzerSlicerSettings import SlicerConnectError
+from ImageQuizzerSetupOptions import lCOPY_BACKENDS, iDEFAULT_WORKERS, lWRITE_POLICIES, sDEFAULT_PROFILE,\
+                                     sBACKUP_RENAME, sBACKUP_NONE, lBACKUP_MODES
+
+
+iEXIT_OK = 0
+iEXIT_FAILED = 1
+iEXIT_USAGE = 2
+iEXIT_ABORTED = 3
+
+fPROGRESS_INTERVAL = 0.5        # seconds between progress lines
+iMAX_PROBLEMS_SHOWN = 20        # verify differences listed without --json
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def buildParser():
+
+    oParser = argparse.ArgumentParser(prog='setup-cli', description="Baines Image Quizzer setup without a GUI")
+    oSubParsers = oParser.add_subparsers(dest='command', required=True)
+
+    oInstall = oSubParsers.add_parser('install', help="install or update Image Quizzer")
+    oInstall.add_argument('--source', default=os.getcwd(),\
+                          help="project folder or release archive (default: current folder)")
+    oInstall.add_argument('--target', required=True, help="install folder")
+    oInstall.add_argument('--backup', choices=lBACKUP_MODES, default=sBACKUP_RENAME,\
+                          help="rename an existing install to <install>.BAK-<date> first (default; skipped with"\
+                          " --incremental), add its Inputs"\
+                          " and Outputs to the compressed archive <install>.iq-archive once the new install is in"\
+                          " place, or replace it")
+    oInstall.add_argument('--backup-dir', help="keep the backups in this folder (eg. on the local disk) instead of next"\
+                          " to the install; a backup on another drive is copied, checked and then removed from"\
+                          " the target")
+    oInstall.add_argument('--snapshot', action='store_true', help="hard-link files unchanged since the newest backup")
+    oInstall.add_argument('--dedup', action='store_true', help="write files with identical contents once and"\
+                          " hard-link (or clone) the copies in other folders")
+    oInstall.add_argument('--keep-backups', type=int, default=0, help="backups (and archive snapshots) to keep"\
+                          " (0 = all)")
+    oInstall.add_argument('--incremental', action='store_true', help="copy only new or changed files, updating the"\
+                          " install in place (no .BAK backup - use --backup archive to keep Inputs and Outputs)")
+    oInstall.add_argument('--hash', action='store_true', help="with --incremental, compare files by content hash"\
+                          " instead of size and modification time")
+    oInstall.add_argument('--no-staged', action='store_true', help="copy in place instead of staging and swapping")
+    oInstall.add_argument('--verify', action='store_true', help="hash the install against the source")
+    oInstall.add_argument('--preserve-user-data', action='store_true',\
+                          help="move Inputs and Outputs of the existing install into the new install")
+    oInstall.add_argument('--profile', default=sDEFAULT_PROFILE, help="what to install: 'code', 'code+samples'"\
+                          " (default) or 'full', or a profile of the rules file")
+    oInstall.add_argument('--rules', help="rules file with gitignore-style patterns (default: .iq-install-rules"\
+                          " in the project folder)")
+    oInstall.add_argument('--backend', choices=lCOPY_BACKENDS, default=lCOPY_BACKENDS[0], help="copy backend")
+    oInstall.add_argument('--workers', type=int, default=iDEFAULT_WORKERS, help="threads for the parallel backends")
+    oInstall.add_argument('--write-policy', choices=lWRITE_POLICIES, default=lWRITE_POLICIES[0], help="how files are"\
+                          " written: 'removable' uses large writes, syncs in batches and flushes at the end, so"\
+                          " a USB stick can be ejected straight away")
+    oInstall.add_argument('--cprofile', action='store_true', help="run the install under cProfile (statistics"\
+                          " written next to the install)")
+    oInstall.add_argument('--no-preflight', action='store_true', help="skip the free space and write speed check")
+    oInstall.add_argument('--preflight-only', action='store_true', help="only check free space and estimate the"\
+                          " install time")
+    oInstall.add_argument('--yes', '-y', action='store_true', help="do not ask for confirmation")
+    oInstall.add_argument('--json', action='store_true', help="print the result as JSON")
+
+    oVerify = oSubParsers.add_parser('verify', help="check an existing install without copying")
+    oVerify.add_argument('target', help="install folder")
+    oVerify.add_argument('--source', help="project folder or release archive to compare with (default: manifest"\
+                         " in the install)")
+    oVerify.add_argument('--profile', default=sDEFAULT_PROFILE, help="install profile the install was made with"\
+                         " (with --source)")
+    oVerify.add_argument('--rules', help="rules file the install was made with (with --source; default:"\
+                         " .iq-install-rules in the project folder)")
+    oVerify.add_argument('--workers', type=int, default=iDEFAULT_WORKERS, help="hashing threads")
+    oVerify.add_argument('--json', action='store_true', help="print the result as JSON")
+
+    oRestore = oSubParsers.add_parser('restore', help="restore Inputs and Outputs from an archive backup")
+    oRestore.add_argument('target', help="install folder the archive was made of")
+    oRestore.add_argument('--backup-dir', help="folder holding the archive (default: next to the install)")
+    oRestore.add_argument('--snapshot', help="snapshot to restore (default: the newest - see --list)")
+    oRestore.add_argument('--into', help="folder to restore into (default: the install folder)")
+    oRestore.add_argument('--overwrite', action='store_true', help="replace existing files that differ from the"\
+                          " snapshot (by default they are kept and listed)")
+    oRestore.add_argument('--list', action='store_true', help="list the snapshots of the archive")
+    oRestore.add_argument('--workers', type=int, default=iDEFAULT_WORKERS, help="threads writing files")
+    oRestore.add_argument('--yes', '-y', action='store_true', help="do not ask for confirmation")
+    oRestore.add_argument('--json', action='store_true', help="print the result as JSON")
+
+    oConnect = oSubParsers.add_parser('connect', help="add Image Quizzer to Slicer's module paths")
+    oConnect.add_argument('module', nargs='?', help="Image Quizzer install folder (default: the paths remembered"\
+                          " for this USB, or found next to the current folder)")
+    oConnect.add_argument('slicer', nargs='?', help="Slicer install, or a folder holding several Slicer installs")
+    oConnect.add_argument('--root', action='append', default=[], help="also search this folder for Slicer installs")
+    oConnect.add_argument('--all', action='store_true', help="also search the stick and the usual Slicer install folders"\
+                          " (the default when no Slicer folder is given)")
+    oConnect.add_argument('--rescan', action='store_true', help="search again instead of using the cached Slicer index")
+    oConnect.add_argument('--json', action='store_true', help="print the result as JSON")
+
+    oWatch = oSubParsers.add_parser('watch', help="stay resident and connect Image Quizzer whenever a USB stick"\
+                                    " holding it is mounted")
+    oWatch.add_argument('--poll', type=float, default=0.5, help="seconds between checks where mounts cannot be"\
+                        " watched (Windows, macOS)")
+    oWatch.add_argument('--json', action='store_true', help="print one JSON line per connect")
+
+    oFanOut = oSubParsers.add_parser('fanout', help="install onto many USB sticks, reading the source once")
+    oFanOut.add_argument('--source', default=os.getcwd(), help="project folder (default: current folder)")
+    oFanOut.add_argument('--target', action='append', default=[], help="install folder (repeat for each stick)")
+    oFanOut.add_argument('--targets-file', help="file listing install folders, one per line"\
+                         " (optionally followed by a tab and the Slicer folder)")
+    oFanOut.add_argument('--slicer', help="Slicer folder to connect each install to; a relative path is taken"\
+                         " next to each install, eg. 'Slicer 4.11.20210226'")
+    oFanOut.add_argument('--profile', default=sDEFAULT_PROFILE, help="what to install: 'code', 'code+samples'"\
+                         " (default) or 'full', or a profile of the rules file")
+    oFanOut.add_argument('--rules', help="rules file with gitignore-style patterns")
+    oFanOut.add_argument('--backup', choices=[sBACKUP_RENAME, sBACKUP_NONE], default=sBACKUP_RENAME,\
+                         help="rename existing installs to <install>.BAK-<date> (default) or replace them")
+    oFanOut.add_argument('--yes', '-y', action='store_true', help="do not ask for confirmation")
+    oFanOut.add_argument('--json', action='store_true', help="print the result as JSON")
+
+    return oParser
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def main(lArgs=None):
+    ''' Run one command and return the exit code.
+    '''
+    oParser = buildParser()
+    try:
+        oArgs = oParser.parse_args(lArgs)
+    except SystemExit as oExit:
+        return oExit.code
+
+    dCommands = {'install': runInstall, 'verify': runVerify, 'restore': runRestore, 'connect': runConnect,\
+                 'fanout': runFanOut, 'watch': runWatch}
+    try:
+        return dCommands[oArgs.command](oArgs)
+    except Exception as oError:
+        dResult = {'command': oArgs.command, 'status': 'error', 'message': str(oError),\
+                   'traceback': traceback.format_exc()}
+        _report(oArgs, dResult, dResult['traceback'])
+        return iEXIT_FAILED
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runInstallerCLI(lArgs):
+    ''' Command line of setup-installManager: '--verify <install>', '--batch' followed
+        by the 'fanout' options, or the 'install' options.
+    '''
+    if lArgs and lArgs[0] == '--verify':
+        return main(['verify'] + lArgs[1:])
+    if lArgs and lArgs[0] == '--batch':
+        return main(['fanout'] + lArgs[1:])
+    return main(['install'] + lArgs)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runConnectorCLI(lArgs):
+    ''' Command line of setup-moduleConnector: <Image Quizzer install> <Slicer install>,
+        or '--watch' to stay resident and connect on every mount.
+    '''
+    if lArgs[0] == '--watch':
+        return main(['watch'] + lArgs[1:])
+    return main(['connect'] + lArgs)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runInstall(oArgs):
+
+    import asyncio
+    from contextlib import aclosing
+    from ImageQuizzerAPI import makeInstallJob, jobEvents, sEVENT_PROGRESS, sEVENT_ARCHIVING, sEVENT_DONE
+    from ImageQuizzerInstallJob import hasInterruptedInstall
+    from ImageQuizzerPreflight import runPreflight
+
+    oRules = _loadRules(oArgs)
+    if oRules is None:
+        return iEXIT_USAGE
+
+    sInstallDir = os.path.abspath(oArgs.target)
+    bResume = hasInterruptedInstall(sInstallDir, not oArgs.no_staged) and not oArgs.incremental
+    bExisting = os.path.isdir(sInstallDir) and len(os.listdir(sInstallDir)) > 0
+
+    # the same job as an install through the library API
+    oJob, bBackup = makeInstallJob(oArgs.source, sInstallDir, oArgs.backup, bIncremental=oArgs.incremental,\
+                                   bCompareHash=oArgs.hash, sCopyBackend=oArgs.backend, iCopyWorkers=oArgs.workers,\
+                                   sWritePolicy=oArgs.write_policy, bSnapshot=oArgs.snapshot, bDedup=oArgs.dedup,\
+                                   iKeepBackups=oArgs.keep_backups, sBackupRoot=oArgs.backup_dir,\
+                                   bPreserveUserData=oArgs.preserve_user_data, bStaged=not oArgs.no_staged,\
+                                   bVerify=oArgs.verify, sProfile=oArgs.profile, sRulesFile=oArgs.rules)
+    oJob.oRules = oRules
+    oJob.oPerfLog.bProfile = oJob.oPerfLog.bProfile or oArgs.cprofile
+
+    # before anything is renamed or removed
+    oPreflight = None
+    if not oArgs.no_preflight or oArgs.preflight_only:
+        oPreflight = runPreflight(oJob, bBackup)
+        dPreflight = oPreflight.toDict()
+        if not oPreflight.isGo():
+            sMsg = "Pre-flight check failed - " + "; ".join(oPreflight.lProblems)
+            _report(oArgs, {'command': 'install', 'status': 'error', 'message': sMsg, 'preflight': dPreflight}, sMsg)
+            return iEXIT_FAILED
+        sMsg = "Pre-flight: " + oPreflight.getSummary()
+        if oArgs.preflight_only:
+            _report(oArgs, {'command': 'install', 'status': 'ok', 'message': sMsg, 'preflight': dPreflight}, sMsg)
+            return iEXIT_OK
+        if not oArgs.json:
+            print(sMsg, file=sys.stderr)
+
+    if not _confirm(oArgs, "Install Image Quizzer from " + oArgs.source + " into " + sInstallDir +\
+                    (" (existing install will be replaced)" if bExisting and not oArgs.incremental else "") + "?"):
+        _report(oArgs, {'command': 'install', 'status': 'aborted', 'message': "Not confirmed"}, "Not confirmed")
+        return iEXIT_ABORTED
+
+    oPrinter = _ProgressPrinter(oArgs.json)
+
+    async def _install():
+        async with aclosing(jobEvents(oJob, bPreflight=False)) as itEvents:
+            async for oEvent in itEvents:
+                if oEvent.sKind == sEVENT_PROGRESS:
+                    oPrinter(oEvent)
+                elif oEvent.sKind == sEVENT_ARCHIVING and not oArgs.json:
+                    # the archive backup is built once the new install is in place
+                    print("Archiving Inputs and Outputs of the previous install ...", file=sys.stderr, flush=True)
+                elif oEvent.sKind == sEVENT_DONE:
+                    return oEvent.oResult
+
+    def _cancel():
+        oJob.cancel()
+        if oJob.oArchiveTask is not None:
+            oJob.oArchiveTask.cancel()
+
+    oResult = _runInThread(lambda: asyncio.run(_install()), _cancel, 'iq-install')
+    dResult = oResult.toDict()
+    if oPreflight is not None:
+        dResult['preflight'] = oPreflight.toDict()
+    dResult['resumed'] = bResume
+    _report(oArgs, dResult, oResult.sMessage)
+
+    if oResult.sStatus == 'cancelled':
+        return iEXIT_ABORTED
+    if oResult.sStatus == 'failed':
+        return iEXIT_FAILED
+    return iEXIT_OK
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runVerify(oArgs):
+
+    from ImageQuizzerManifest import verifyInstall, lVERIFY_SKIP_DIRS
+
+    # files left out by the install's profile are not expected in the install
+    oRules = None
+    if oArgs.source is not None:
+        oRules = _loadRules(oArgs)
+        if oRules is None:
+            return iEXIT_USAGE
+
+    try:
+        oReport = verifyInstall(oArgs.target, oArgs.source, oArgs.workers, lVERIFY_SKIP_DIRS, oRules)
+    except ValueError as oError:
+        _report(oArgs, {'command': 'verify', 'status': 'error', 'message': str(oError)}, str(oError))
+        return iEXIT_USAGE
+    if oReport is None:
+        sMsg = "No manifest found in " + oArgs.target + " - give the source folder with --source"
+        _report(oArgs, {'command': 'verify', 'status': 'error', 'message': sMsg}, sMsg)
+        return iEXIT_USAGE
+
+    dResult = {'command': 'verify', 'status': 'ok' if oReport.isOk() else 'differs',\
+               'message': oReport.getSummary(), 'target': oArgs.target,\
+               'missing': oReport.lMissing, 'size_differs': oReport.lSizeDiffers,\
+               'content_differs': oReport.lHashDiffers, 'extra': oReport.lExtra}
+    lProblems = oReport.getProblems()
+    if len(lProblems) > iMAX_PROBLEMS_SHOWN:
+        lProblems = lProblems[:iMAX_PROBLEMS_SHOWN] + ["... %d more" % (len(lProblems) - iMAX_PROBLEMS_SHOWN)]
+    _report(oArgs, dResult, "\n".join(lProblems + [oReport.getSummary()]))
+    return iEXIT_OK if oReport.isOk() else iEXIT_FAILED
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runRestore(oArgs):
+
+    from ImageQuizzerArchiveStore import ArchiveStore, ArchiveStoreError, getStorePath
+    from ImageQuizzerCopyEngine import CopyCancelled
+
+    oStore = ArchiveStore(getStorePath(oArgs.target, oArgs.backup_dir), oArgs.workers)
+    lSnapshots = oStore.listSnapshots()
+
+    if oArgs.list:
+        lListed = []
+        for sName in lSnapshots:
+            try:
+                dFiles = oStore.loadSnapshot(sName)['files']
+                lListed.append({'snapshot': sName, 'files': len(dFiles),\
+                                'bytes': sum(lEntry[0] for lEntry in dFiles.values())})
+            except ArchiveStoreError as oError:
+                lListed.append({'snapshot': sName, 'error': str(oError)})
+        iChunks, iStoredBytes = oStore.getStoredBytes()
+        sMsg = "%d snapshot(s) in %s - %d chunks, %.1f MB stored" % (len(lSnapshots), oStore.sStorePath, iChunks,\
+                                                                   iStoredBytes / 1e6)
+        lLines = [dSnapshot['snapshot'] + ("   %d files   %.1f MB" % (dSnapshot['files'], dSnapshot['bytes'] / 1e6)\
+                                           if 'error' not in dSnapshot else "   " + dSnapshot['error'])\
+                  for dSnapshot in lListed]
+        _report(oArgs, {'command': 'restore', 'status': 'ok', 'message': sMsg, 'store': oStore.sStorePath,\
+                        'snapshots': lListed, 'stored_bytes': iStoredBytes}, "\n".join(lLines + [sMsg]))
+        return iEXIT_OK
+
+    sName = oArgs.snapshot or (lSnapshots[-1] if lSnapshots else None)
+    if sName is None or sName not in lSnapshots:
+        sMsg = ("No snapshot '%s'" % sName if sName else "No archive snapshots") + " in " + oStore.sStorePath
+        _report(oArgs, {'command': 'restore', 'status': 'error', 'message': sMsg}, sMsg)
+        return iEXIT_USAGE
+
+    sTargetDir = os.path.abspath(oArgs.into or oArgs.target)
+    if not _confirm(oArgs, "Restore archive snapshot " + sName + " into " + sTargetDir +\
+                    (" (replacing files that differ)" if oArgs.overwrite else "") + "?"):
+        _report(oArgs, {'command': 'restore', 'status': 'aborted', 'message': "Not confirmed"}, "Not confirmed")
+        return iEXIT_ABORTED
+
+    try:
+        oResult = _runInThread(lambda: oStore.restore(sTargetDir, sName, oArgs.overwrite), oStore.cancel, 'iq-restore')
+    except CopyCancelled:
+        _report(oArgs, {'command': 'restore', 'status': 'cancelled', 'message': "Restore cancelled"}, "Restore cancelled")
+        return iEXIT_ABORTED
+    except ArchiveStoreError as oError:
+        _report(oArgs, {'command': 'restore', 'status': 'failed', 'message': str(oError)}, str(oError))
+        return iEXIT_FAILED
+
+    dResult = {'command': 'restore', 'status': 'ok', 'message': oResult.getSummary()}
+    dResult.update(oResult.toDict())
+    lConflicts = oResult.lConflicts
+    if len(lConflicts) > iMAX_PROBLEMS_SHOWN:
+        lConflicts = lConflicts[:iMAX_PROBLEMS_SHOWN] + ["... %d more" % (len(lConflicts) - iMAX_PROBLEMS_SHOWN)]
+    _report(oArgs, dResult, "\n".join(["kept (differs) : " + sPath for sPath in lConflicts] + [oResult.getSummary()]))
+    return iEXIT_OK
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runConnect(oArgs):
+
+    from ImageQuizzerSlicerDiscovery import connectAll, getDefaultRoots
+    from ImageQuizzerConnectorSettings import autoConnect
+
+    try:
+        if oArgs.module is None:
+            _, _, _, lResults = autoConnect(os.getcwd())
+            if lResults is None:
+                sMsg = "No remembered or nearby Image Quizzer and Slicer installs - give the Image Quizzer install folder"
+                _report(oArgs, {'command': 'connect', 'status': 'error', 'message': sMsg}, sMsg)
+                return iEXIT_USAGE
+        else:
+            lRoots = ([oArgs.slicer] if oArgs.slicer else []) + oArgs.root
+            if oArgs.all or not lRoots:
+                lRoots = lRoots + getDefaultRoots(oArgs.module)
+            lResults = connectAll(oArgs.module, lRoots, oArgs.rescan)
+    except SlicerConnectError as oError:
+        _report(oArgs, {'command': 'connect', 'status': 'error', 'message': str(oError)}, str(oError))
+        return iEXIT_FAILED
+
+    lLines = []
+    for dIni in lResults:
+        if dIni['error']:
+            lLines.append("failed    " + (dIni['ini'] or dIni['slicer']) + " - " + dIni['error'])
+        elif dIni['skipped']:
+            lLines.append("skipped   " + dIni['slicer'] + " - " + dIni['skipped'])
+        elif dIni['changed']:
+            lLines.append("connected " + dIni['ini'])
+        else:
+            lLines.append("unchanged " + dIni['ini'])
+
+    lFailed = [dIni for dIni in lResults if dIni['error']]
+    lSkipped = [dIni for dIni in lResults if dIni['skipped']]
+    iConnected = len(lResults) - len(lFailed) - len(lSkipped)
+    bChanged = any(dIni['changed'] for dIni in lResults)
+    if bChanged:
+        sMsg = "Image Quizzer connected to Slicer - %d settings file(s)" % iConnected
+    else:
+        sMsg = "Image Quizzer already connected to Slicer - %d settings file(s)" % iConnected
+    if lFailed:
+        sMsg = sMsg + ", %d failed" % len(lFailed)
+    if lSkipped:
+        sMsg = sMsg + ", %d Slicer install(s) skipped" % len(lSkipped)
+    dResult = {'command': 'connect', 'status': 'failed' if lFailed else 'ok', 'message': sMsg,\
+               'changed': bChanged, 'inis': lResults}
+    _report(oArgs, dResult, "\n".join(lLines + [sMsg]))
+    return iEXIT_FAILED if lFailed else iEXIT_OK
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runWatch(oArgs):
+
+    from ImageQuizzerMountWatch import MountWatcher, connectOnMount
+
+    def _printEvent(dEvent):
+        if oArgs.json:
+            print(json.dumps(dEvent), flush=True)
+        else:
+            print(time.strftime('%H:%M:%S ') + dEvent['message'], flush=True,\
+                  file=sys.stdout if dEvent['status'] == 'ok' else sys.stderr)
+
+    def _onMount(sMountPoint):
+        tupConnected = connectOnMount(sMountPoint)
+        if tupConnected is None:
+            return
+        dEvent = {'command': 'watch', 'mount': sMountPoint, 'status': 'ok', 'message': None, 'inis': []}
+        sModulePath, sSlicerPath, dEvent['inis'] = tupConnected
+        lFailed = [dIni for dIni in dEvent['inis'] if dIni['error']]
+        if lFailed:
+            dEvent['status'] = 'failed'
+            dEvent['message'] = sModulePath + " : " + lFailed[0]['error']
+        else:
+            iConnected = sum(1 for dIni in dEvent['inis'] if dIni['ini'] is not None)
+            dEvent['message'] = "%s connected to Slicer - %d settings file(s)" % (sModulePath, iConnected)
+        _printEvent(dEvent)
+
+    def _onError(sMountPoint, oError):
+        # connect errors (SlicerConnectError, ini missing, ...) and anything unexpected
+        dEvent = {'command': 'watch', 'mount': sMountPoint, 'status': 'failed',\
+                  'message': sMountPoint + " : " + str(oError).split('\n', 1)[0], 'inis': []}
+        if not isinstance(oError, (SlicerConnectError, OSError)):
+            dEvent['traceback'] = ''.join(traceback.format_exception(type(oError), oError, oError.__traceback__))
+        _printEvent(dEvent)
+
+    oWatcher = MountWatcher(_onMount, oArgs.poll, _onError)
+    if not oArgs.json:
+        print("Watching for USB sticks (%s) - Ctrl-C to stop" %\
+              ("mount table" if oWatcher.bUsesPoll else "every %.1f s" % oArgs.poll), file=sys.stderr, flush=True)
+    _runInThread(oWatcher.run, oWatcher.stop, 'iq-watch')
+    return iEXIT_OK
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def runFanOut(oArgs):
+
+    from ImageQuizzerFanOut import FanOut, FanOutTarget, readTargetsFile, getSlicerDir
+
+    oRules = _loadRules(oArgs)
+    if oRules is None:
+        return iEXIT_USAGE
+
+    lTargets = [FanOutTarget(sTarget, getSlicerDir(sTarget, oArgs.slicer)) for sTarget in oArgs.target]
+    if oArgs.targets_file:
+        lTargets.extend(readTargetsFile(oArgs.targets_file, oArgs.slicer))
+    if not lTargets:
+        _report(oArgs, {'command': 'fanout', 'status': 'error', 'message': "No targets given"}, "No targets given")
+        return iEXIT_USAGE
+
+    if not _confirm(oArgs, "Install Image Quizzer from " + oArgs.source + " onto %d targets?" % len(lTargets)):
+        _report(oArgs, {'command': 'fanout', 'status': 'aborted', 'message': "Not confirmed"}, "Not confirmed")
+        return iEXIT_ABORTED
+
+    oFanOut = FanOut(oArgs.source, lTargets, _FanOutPrinter(oArgs.json))
+    oFanOut.bBackup = oArgs.backup == sBACKUP_RENAME
+    oFanOut.oRules = oRules
+
+    fStart = time.perf_counter()
+    _runInThread(oFanOut.run, oFanOut.cancel, 'iq-fanout')
+
+    lResults = [oTarget.getResult() for oTarget in lTargets]
+    bAllDone = all(dTarget['status'] == 'done' for dTarget in lResults)
+    sMsg = "Fan-out install : " + oFanOut.getSummary()
+    dResult = {'command': 'fanout', 'status': 'ok' if bAllDone else 'failed', 'message': sMsg,\
+               'source': oArgs.source, 'seconds': round(time.perf_counter() - fStart, 3), 'targets': lResults}
+
+    lLines = ["%-10s %s%s" % (dTarget['status'], dTarget['target'],\
+                              (" - " + dTarget['error']) if dTarget['error'] else "") for dTarget in lResults]
+    _report(oArgs, dResult, "\n".join(lLines + [sMsg]))
+
+    if oFanOut.oCancelEvent.is_set():
+        return iEXIT_ABORTED
+    return iEXIT_OK if bAllDone else iEXIT_FAILED
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _runInThread(fnRun, fnCancel, sName):
+    ''' Call fnRun on a worker thread; Ctrl-C calls fnCancel instead of killing
+        the main thread part way through a file. Returns fnRun's result and
+        re-raises its exception.
+    '''
+    dOutcome = {}
+    oDone = threading.Event()
+
+    def _work():
+        try:
+            dOutcome['result'] = fnRun()
+        except BaseException as oError:
+            dOutcome['error'] = oError
+        finally:
+            oDone.set()
+
+    # waits on an Event - a Ctrl-C that interrupts Thread.join can leave the
+    # thread reported as finished while it is still running
+    oThread = threading.Thread(target=_work, name=sName)
+    oThread.start()
+    while not oDone.is_set():
+        try:
+            oDone.wait(0.2)
+        except KeyboardInterrupt:
+            fnCancel()
+    oThread.join()
+
+    if 'error' in dOutcome:
+        raise dOutcome['error']
+    return dOutcome.get('result')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _loadRules(oArgs):
+    ''' InstallRules for --profile and --rules, or None (reported) if they are invalid.
+    '''
+    from ImageQuizzerInstallRules import loadRules
+
+    try:
+        return loadRules(oArgs.source, oArgs.profile, oArgs.rules)
+    except (ValueError, OSError) as oError:
+        _report(oArgs, {'command': oArgs.command, 'status': 'error', 'message': str(oError)}, str(oError))
+        return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _confirm(oArgs, sQuestion):
+    ''' Ask on the terminal unless --yes was given. Without a terminal the
+        answer is no, so scripts must pass --yes.
+    '''
+    if oArgs.yes:
+        return True
+    if not sys.stdin or not sys.stdin.isatty():
+        return False
+    sAnswer = input(sQuestion + " [y/N] ")
+    return sAnswer.strip().lower() in ('y', 'yes')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _report(oArgs, dResult, sText):
+    if getattr(oArgs, 'json', False):
+        print(json.dumps(dResult, indent=2))
+    elif dResult.get('status') in ('ok', 'cancelled'):
+        print(sText)
+    else:
+        print(sText, file=sys.stderr)
+
+
+##########################################################################
+#
+# _ProgressPrinter
+#
+##########################################################################
+class _ProgressPrinter():
+    ''' Writes the status line of an install's progress events to stderr at most
+        every fPROGRESS_INTERVAL seconds (not with --json, and only on a terminal).
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, bJson):
+        self.bEnabled = not bJson and sys.stderr is not None and sys.stderr.isatty()
+        self.fLast = 0.0
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, oEvent):
+        if not self.bEnabled:
+            return
+        fNow = time.monotonic()
+        if fNow - self.fLast < fPROGRESS_INTERVAL and oEvent.iFilesDone < oEvent.iFilesTotal:
+            return
+        self.fLast = fNow
+        sys.stderr.write('\r' + oEvent.sText + '   ')
+        if oEvent.iFilesDone >= oEvent.iFilesTotal:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+
+
+##########################################################################
+#
+# _FanOutPrinter
+#
+##########################################################################
+class _FanOutPrinter(_ProgressPrinter):
+    ''' FanOut progress callback: source files read and the state of the targets.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __call__(self, oFanOut):
+        if not self.bEnabled:
+            return
+        fNow = time.monotonic()
+        bLast = oFanOut.iFilesRead >= len(oFanOut.lFiles)
+        if fNow - self.fLast < fPROGRESS_INTERVAL and not bLast:
+            return
+        self.fLast = fNow
+        iDetached = sum(1 for oTarget in oFanOut.lTargets if oTarget.bDetached)
+        sys.stderr.write('\r%d/%d files read - %s%s   ' % (oFanOut.iFilesRead, len(oFanOut.lFiles), oFanOut.getSummary(),\
+                                                        (", %d detached" % iDetached) if iDetached else ""))
+        if bLast:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+
+
+##########################################################################
+##########################################################################
+##########################################################################
+#
+# RUN
+#
+##########################################################################
+##########################################################################
+##########################################################################
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
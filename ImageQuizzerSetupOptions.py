@@ -0,0 +1,38 @@
+'''
+    Install option values for the Baines Image Quizzer setup utilities.
+
+    The copy backends, write policies, install profiles and backup modes, in one
+    module without imports, so that the headless command line can build its
+    argument parser without loading the copy engine (see ImageQuizzerSetupCLI.py).
+    ImageQuizzerCopyEngine, ImageQuizzerInstallRules and ImageQuizzerAPI import
+    their values from here.
+
+    This module is bundled into the setup executables by pyinstaller.
+'''
+
+
+sBACKEND_COPYTREE = 'copytree'
+sBACKEND_PARALLEL = 'parallel'
+sBACKEND_ZEROCOPY = 'zerocopy'
+lCOPY_BACKENDS = [sBACKEND_COPYTREE, sBACKEND_PARALLEL, sBACKEND_ZEROCOPY]
+
+iDEFAULT_WORKERS = 8
+
+sPOLICY_DEFAULT = 'default'
+sPOLICY_BUFFERED = 'buffered'
+sPOLICY_BATCHED = 'batched'
+sPOLICY_FLUSH = 'flush'
+sPOLICY_REMOVABLE = 'removable'
+lWRITE_POLICIES = [sPOLICY_DEFAULT, sPOLICY_BUFFERED, sPOLICY_BATCHED, sPOLICY_FLUSH, sPOLICY_REMOVABLE]
+
+sPROFILE_CODE = 'code'
+sPROFILE_CODE_SAMPLES = 'code+samples'
+sPROFILE_FULL = 'full'
+lPROFILES = [sPROFILE_CODE, sPROFILE_CODE_SAMPLES, sPROFILE_FULL]
+sDEFAULT_PROFILE = sPROFILE_CODE_SAMPLES
+
+# what happens to an existing install
+sBACKUP_RENAME = 'rename'
+sBACKUP_ARCHIVE = 'archive'
+sBACKUP_NONE = 'none'
+lBACKUP_MODES = [sBACKUP_RENAME, sBACKUP_ARCHIVE, sBACKUP_NONE]
@@ -0,0 +1,399 @@
+'''
+    Slicer install discovery for the Baines Image Quizzer module connector.
+
+    USB sticks and lab PCs often carry several Slicer versions, and an install
+    that was upgraded in place may hold more than one NA-MIC/Slicer-xxxx.ini .
+    This module finds every Slicer install below a set of candidate roots and
+    connects Image Quizzer to every settings file in one pass.
+
+    The walk lists one level of folders at a time, the folders of a level being
+    scanned in parallel (os.scandir on a pool of threads - directory listings on
+    USB sticks and network drives are latency bound). A folder that is a Slicer
+    install is not descended into, nor are symbolic links or system folders.
+
+    The result is cached in a small JSON index in the user's config folder,
+    keyed by volume identity (see getVolumeId - not the drive letter, which changes
+    from PC to PC) and by the root's path on that volume. A later run re-walks a root only if the root folder's
+    modification time changed or a cached install disappeared; otherwise only
+    the NA-MIC folder of each cached install is listed again. A Slicer install
+    added deeper down is picked up with rescan.
+
+    connectAll times the discovery and each ini rewrite in the performance log
+    next to the Image Quizzer install (see ImageQuizzerPerfLog.py).
+
+    This module is used by ImageQuizzerModuleConnector.py and the 'connect'
+    command of ImageQuizzerSetupCLI.py and must not import PyQt5.
+'''
+
+import os, sys
+import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageQuizzerSlicerSettings import findSlicerInis, getCheckedCodePath, connectIni, \
+                                       SlicerConnectError, SlicerIniMissingError, sINI_MISSING_MSG
+from ImageQuizzerPerfLog import PerfLog, getPerfLogPath
+
+
+sINDEX_NAME = 'slicer-index.json'
+iINDEX_VERSION = 2
+
+sVOLUME_ID_NAME = '.iq-volume-id'     # marker file in the root of a stick
+_dVolumeIds = {}                      # (mount point, st_dev) -> volume id, for this process
+
+iDEFAULT_DEPTH = 3              # folder levels below a root that are searched
+iWALK_WORKERS = 8
+
+# never searched for Slicer installs
+setSKIP_DIRS = {'$RECYCLE.BIN', 'System Volume Information', 'Windows', 'ProgramData',\
+                '.git', '.Trash', '.cache', '__pycache__', 'node_modules',\
+                'proc', 'sys', 'dev', 'run'}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getConfigDir():
+    ''' Per-user folder for Image Quizzer settings.
+    '''
+    if os.name == 'nt':
+        sBase = os.environ.get('APPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        sBase = os.path.join(os.path.expanduser('~'), 'Library', 'Application Support')
+    else:
+        sBase = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(sBase, 'ImageQuizzer')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getIndexPath():
+    return os.path.join(getConfigDir(), sINDEX_NAME)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getVolume(sPath):
+    ''' Mount point (drive on Windows) holding sPath.
+    '''
+    sPath = os.path.abspath(sPath)
+    if os.name == 'nt':
+        sDrive = os.path.splitdrive(sPath)[0]
+        return sDrive + os.sep if sDrive else os.sep
+    while not os.path.ismount(sPath):
+        sParent = os.path.dirname(sPath)
+        if sParent == sPath:
+            break
+        sPath = sParent
+    return sPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getVolumeId(sVolume):
+    ''' Identity of the volume mounted at sVolume that survives a change of drive
+        letter or mount point:
+            - the UUID in the volume's .iq-volume-id marker file,
+            - else the volume serial number (Windows) or the file system UUID (Linux),
+            - else a new marker file is written (not on the system volume),
+            - else the mount point itself.
+        Results are cached for the life of the process, by mount point and device;
+        a resident process calls forgetVolumeId when a volume is removed, as the
+        next stick at that mount point may get the same device number.
+    '''
+    sVolume = os.path.abspath(sVolume)
+    try:
+        tupKey = (sVolume, os.stat(sVolume).st_dev)
+    except OSError:
+        tupKey = (sVolume, None)
+    if tupKey in _dVolumeIds:
+        return _dVolumeIds[tupKey]
+
+    sMarkerPath = os.path.join(sVolume, sVOLUME_ID_NAME)
+    sId = None
+    try:
+        with open(sMarkerPath, 'r', encoding='utf-8') as fIn:
+            sId = 'uuid:' + str(uuid.UUID(fIn.read().strip()))
+    except (OSError, ValueError):
+        pass
+
+    if sId is None:
+        sId = _getSystemVolumeId(sVolume)
+
+    if sId is None and not _isSystemVolume(sVolume):
+        oUuid = uuid.uuid4()
+        try:
+            with open(sMarkerPath, 'x', encoding='utf-8') as fOut:
+                fOut.write(str(oUuid) + '\n')
+            sId = 'uuid:' + str(oUuid)
+        except OSError:
+            pass
+
+    if sId is None:
+        sId = 'path:' + sVolume
+    _dVolumeIds[tupKey] = sId
+    return sId
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def forgetVolumeId(sVolume):
+    ''' Drop the cached identity of the volume(s) mounted at sVolume.
+    '''
+    sVolume = os.path.abspath(sVolume)
+    for tupKey in [tupKey for tupKey in _dVolumeIds if tupKey[0] == sVolume]:
+        _dVolumeIds.pop(tupKey, None)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getSystemVolumeId(sVolume):
+    ''' Serial number (Windows) or file system UUID (Linux) of the volume, or None.
+    '''
+    if os.name == 'nt':
+        try:
+            import ctypes
+            iSerial = ctypes.c_uint32()
+            if ctypes.windll.kernel32.GetVolumeInformationW(ctypes.c_wchar_p(sVolume), None, 0,\
+                                                            ctypes.byref(iSerial), None, None, None, 0):
+                return 'serial:%08X' % iSerial.value
+        except (OSError, AttributeError):
+            pass
+        return None
+
+    sByUuidDir = '/dev/disk/by-uuid'
+    try:
+        iDevice = os.stat(sVolume).st_dev
+        for sUuid in os.listdir(sByUuidDir):
+            if os.stat(os.path.join(sByUuidDir, sUuid)).st_rdev == iDevice:
+                return 'fsuuid:' + sUuid
+    except OSError:
+        pass
+    return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _isSystemVolume(sVolume):
+    if os.name == 'nt':
+        return os.path.splitdrive(sVolume)[0].upper() == os.environ.get('SystemDrive', 'C:').upper()
+    return sVolume == os.sep
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getDefaultRoots(sModulePath=None):
+    ''' Folders searched when no Slicer location is given: the folder holding the
+        Image Quizzer install (ie. the stick) and the usual per-user and system
+        install folders of Slicer.
+    '''
+    lRoots = []
+    if sModulePath:
+        lRoots.append(os.path.dirname(os.path.abspath(sModulePath)))
+    if os.name == 'nt':
+        for sVar in ('LOCALAPPDATA', 'ProgramFiles'):
+            if os.environ.get(sVar):
+                lRoots.append(os.path.join(os.environ[sVar], 'NA-MIC') if sVar == 'LOCALAPPDATA' else os.environ[sVar])
+    elif sys.platform == 'darwin':
+        lRoots.append('/Applications')
+    else:
+        lRoots.extend([os.path.expanduser('~'), '/opt'])
+    return [sRoot for sRoot in lRoots if os.path.isdir(sRoot)]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isSlicerInstall(sDir, setNames=None):
+    ''' A Slicer install has a NA-MIC settings folder or the Slicer launcher
+        next to a 'bin' folder. setNames (the folder's entries) avoids a listing.
+    '''
+    if setNames is None:
+        try:
+            setNames = set(os.listdir(sDir))
+        except OSError:
+            return False
+    if 'NA-MIC' in setNames:
+        return True
+    return 'bin' in setNames and ('Slicer.exe' in setNames or 'Slicer' in setNames)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def walkForSlicer(sRoot, iMaxDepth=iDEFAULT_DEPTH, iWorkers=iWALK_WORKERS):
+    ''' Return the Slicer install folders at or below sRoot (sorted).
+    '''
+    def _scan(sDir):
+        ''' Returns (is a Slicer install, sub folders to search).
+        '''
+        setNames = set()
+        lSubDirs = []
+        try:
+            with os.scandir(sDir) as itEntries:
+                for oEntry in itEntries:
+                    setNames.add(oEntry.name)
+                    try:
+                        if oEntry.is_dir(follow_symlinks=False) and oEntry.name not in setSKIP_DIRS:
+                            lSubDirs.append(oEntry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            return False, []
+        if isSlicerInstall(sDir, setNames):
+            return True, []
+        return False, lSubDirs
+
+    lInstalls = []
+    lLevel = [os.path.abspath(sRoot)]
+    with ThreadPoolExecutor(max_workers=max(1, iWorkers)) as oPool:
+        for iDepth in range(iMaxDepth + 1):
+            lNextLevel = []
+            for sDir, (bSlicer, lSubDirs) in zip(lLevel, oPool.map(_scan, lLevel)):
+                if bSlicer:
+                    lInstalls.append(sDir)
+                elif iDepth < iMaxDepth:
+                    lNextLevel.extend(lSubDirs)
+            lLevel = lNextLevel
+            if not lLevel:
+                break
+    return sorted(lInstalls)
+
+
+##########################################################################
+#
+# SlicerIndex
+#
+##########################################################################
+class SlicerIndex():
+    ''' Cache of the Slicer installs found below each searched root.
+
+        { 'version': 2,
+          'volumes': { <volume id>: { <root relative to volume>:
+                                       { 'mtime': <root mtime ns>, 'depth': <depth searched>,
+                                         'installs': [<install relative to volume>, ...] } } } }
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sPath=None):
+        self.sPath = sPath or getIndexPath()
+        self.dVolumes = {}
+        self.bChanged = False
+        try:
+            with open(self.sPath, 'r', encoding='utf-8') as fIn:
+                dIndex = json.load(fIn)
+            if dIndex.get('version') == iINDEX_VERSION:
+                self.dVolumes = dIndex.get('volumes', {})
+        except (OSError, ValueError):
+            pass
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def findInstalls(self, sRoot, bRescan=False, iMaxDepth=iDEFAULT_DEPTH, iWorkers=iWALK_WORKERS):
+        ''' Slicer install folders below sRoot, from the index if it is still valid.
+        '''
+        sRoot = os.path.abspath(sRoot)
+        sVolume = getVolume(sRoot)
+        sVolumeId = getVolumeId(sVolume)
+        sRelRoot = os.path.relpath(sRoot, sVolume)
+        try:
+            iMtime = os.stat(sRoot).st_mtime_ns
+        except OSError:
+            return []
+
+        dEntry = self.dVolumes.get(sVolumeId, {}).get(sRelRoot)
+        if not bRescan and dEntry is not None and dEntry.get('mtime') == iMtime and dEntry.get('depth', 0) >= iMaxDepth:
+            lInstalls = [os.path.join(sVolume, sRelPath) for sRelPath in dEntry.get('installs', [])]
+            if all(os.path.isdir(sInstall) for sInstall in lInstalls):
+                return lInstalls
+
+        lInstalls = walkForSlicer(sRoot, iMaxDepth, iWorkers)
+        self.dVolumes.setdefault(sVolumeId, {})[sRelRoot] = {'mtime': iMtime, 'depth': iMaxDepth,\
+                        'installs': [os.path.relpath(sInstall, sVolume) for sInstall in lInstalls]}
+        self.bChanged = True
+        return lInstalls
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def save(self):
+        ''' Write the index if it changed. A read-only config folder only loses the cache.
+        '''
+        if not self.bChanged:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.sPath), exist_ok=True)
+            sTempPath = '%s.%d-%d.tmp' % (self.sPath, os.getpid(), threading.get_ident())
+            with open(sTempPath, 'w', encoding='utf-8') as fOut:
+                json.dump({'version': iINDEX_VERSION, 'volumes': self.dVolumes}, fOut, indent=1)
+            os.replace(sTempPath, self.sPath)
+            self.bChanged = False
+        except OSError:
+            pass
+
+
+##########################################################################
+#
+# IniLocks
+#
+##########################################################################
+class IniLocks():
+    ''' One lock per Slicer-xxxx.ini file, for connects running on several threads.
+        connectIni reads, edits and replaces the file - two connects of the same
+        file at once would lose one of the edits.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self):
+        self.oLock = threading.Lock()
+        self.dLocks = {}
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get(self, sIniPath):
+        ''' The lock of sIniPath (the same lock for every path of the same file).
+        '''
+        sKey = os.path.normcase(os.path.realpath(sIniPath))
+        with self.oLock:
+            return self.dLocks.setdefault(sKey, threading.Lock())
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def discoverSlicerInstalls(lRoots, bRescan=False, iMaxDepth=iDEFAULT_DEPTH, oIndex=None):
+    ''' Slicer install folders below all lRoots, without duplicates, in root order.
+    '''
+    if oIndex is None:
+        oIndex = SlicerIndex()
+
+    lInstalls = []
+    setSeen = set()
+    for sRoot in lRoots:
+        for sInstall in oIndex.findInstalls(sRoot, bRescan, iMaxDepth):
+            sKey = os.path.normcase(os.path.realpath(sInstall))
+            if sKey not in setSeen:
+                setSeen.add(sKey)
+                lInstalls.append(sInstall)
+    oIndex.save()
+    return lInstalls
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def connectAll(sModulePath, lRoots, bRescan=False, iMaxDepth=iDEFAULT_DEPTH, oIndex=None, oIniLocks=None):
+    ''' Connect the Image Quizzer install to every Slicer-xxxx.ini of every Slicer
+        install found below lRoots.
+
+        Returns a list of { 'slicer', 'ini', 'changed', 'error', 'skipped' }, one per
+        ini file. An install without an ini file (Slicer never started) gets one entry
+        with 'ini' None and the reason in 'skipped' - it is not an error, as long as
+        another install was connected.
+        Raises SlicerConnectError if the Image Quizzer code folder is missing and
+        SlicerIniMissingError if no ini file was found at all.
+        oIniLocks (an IniLocks shared by the callers) serializes the rewrite of each
+        ini file with the other threads connecting it.
+    '''
+    sImageQuizzerCodePath = getCheckedCodePath(sModulePath)
+    oPerfLog = PerfLog(getPerfLogPath(sModulePath))
+
+    lResults = []
+    try:
+        with oPerfLog.phase('walk') as dPhase:
+            lInstalls = discoverSlicerInstalls(lRoots, bRescan, iMaxDepth, oIndex)
+            dPhase['installs'] = len(lInstalls)
+
+        for sInstall in lInstalls:
+            lIniPaths = findSlicerInis(sInstall)
+            if not lIniPaths:
+                lResults.append({'slicer': sInstall, 'ini': None, 'changed': False, 'error': None,\
+                                 'skipped': "Slicer-xxxx.ini file is missing - the Slicer Extensions are not installed"})
+            for sIniPath in lIniPaths:
+                dResult = {'slicer': sInstall, 'ini': sIniPath, 'changed': False, 'error': None, 'skipped': None}
+                with oPerfLog.phase('ini_rewrite', ini=sIniPath) as dPhase:
+                    try:
+                        if oIniLocks is None:
+                            dResult['changed'] = connectIni(sImageQuizzerCodePath, sIniPath)
+                        else:
+                            with oIniLocks.get(sIniPath):
+                                dResult['changed'] = connectIni(sImageQuizzerCodePath, sIniPath)
+                    except (SlicerConnectError, OSError) as oError:
+                        dResult['error'] = str(oError).split('\n', 1)[0]
+                    dPhase.update(files=1, changed=dResult['changed'], failed=dResult['error'] is not None)
+                lResults.append(dResult)
+    finally:
+        bConnected = any(dResult['ini'] is not None for dResult in lResults)
+        oPerfLog.close('error' if any(dResult['error'] for dResult in lResults) or not bConnected else 'ok')
+
+    if not bConnected:
+        raise SlicerIniMissingError(sINI_MISSING_MSG)
+    return lResults
@@ -0,0 +1,287 @@
+'''
+    Slicer settings for the Baines Image Quizzer setup utilities.
+
+    Qt-free core of ImageQuizzerModuleConnector: finds Slicer's NA-MIC Slicer-xxxx.ini
+    file and adds the Image Quizzer code folder to the Modules AdditionalPaths entry,
+    replacing any previous entry (eg. with another USB drive letter).
+
+    The AdditionalPaths value is parsed once into a list of entries (AdditionalPaths),
+    old Image Quizzer entries are dropped, duplicates removed and the new entry
+    appended. The ini file is rewritten through a temporary file and an atomic
+    rename, and not at all if the entry is already correct. All other lines are
+    kept byte for byte.
+
+    It is shared by the connector GUI and the headless command line (ImageQuizzerSetupCLI.py),
+    which must not import PyQt5.
+'''
+
+import os
+import re
+import tempfile
+
+
+sDOCUMENTATION_URL = 'https://baines-imaging-research-laboratory.github.io/ImageQuizzerDocumentation'
+
+sMODULES_SECTION = "[Modules]"
+sADDITIONAL_PATHS_KEY = "AdditionalPaths="
+sCODE_SUBSTRING = "ImageQuizzer/Code"
+
+sINI_MISSING_MSG = "Cannot connect Image Quizzer module to Slicer.  Slicer-xxxx.ini file is missing."\
+                   + '\n\n  Either: -the location specified for Slicer is incorrect'\
+                   + '\n  ... Or :     -the required Slicer Extensions have not yet been installed.'\
+                   + '\n\nSee documentation > Getting started'\
+                   + '\n' + sDOCUMENTATION_URL
+
+
+##########################################################################
+#
+# SlicerConnectError
+#
+##########################################################################
+class SlicerConnectError(Exception):
+    ''' Raised when the module cannot be connected; the message is meant for the user.
+    '''
+    pass
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class SlicerIniMissingError(SlicerConnectError):
+    ''' No Slicer-xxxx.ini file in <Slicer>/NA-MIC.
+    '''
+    pass
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def findSlicerInis(sSlicerPath):
+    ''' Return the paths of all Slicer-xxxx.ini files of the Slicer install (sorted).
+
+        At the time of writing, the ini file is named Slicer-29738.ini .
+        The name is matched generically in case of future upgrades; an install
+        that was upgraded in place may hold more than one.
+    '''
+    sSearchDir = os.path.join(sSlicerPath,'NA-MIC')
+    lIniPaths = []
+    if os.path.isdir(sSearchDir):
+        for sFile in sorted(os.listdir(sSearchDir)):
+            if re.match("^Slicer.*ini$",sFile):
+                lIniPaths.append(os.path.join(sSearchDir, sFile))
+    return lIniPaths
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def findSlicerIni(sSlicerPath):
+    ''' Return the path of the (first) Slicer-xxxx.ini file of the Slicer install, or None.
+    '''
+    lIniPaths = findSlicerInis(sSlicerPath)
+    return lIniPaths[0] if lIniPaths else None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getImageQuizzerCodePath(sModulePath):
+    ''' Code folder of the Image Quizzer install, with forward slashes as Slicer stores it.
+    '''
+    return os.path.join(sModulePath,'ImageQuizzer','Code').replace('\\','/')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def connectModule(sModulePath, sSlicerPath):
+    ''' Add the Image Quizzer code path to Slicer's list of modules in the
+        Application Settings.
+
+        This ini file is created when the administrator manually connects a module
+        in Slicer's application settings or when extensions are added.
+
+        A previous connection to the module's code path may have the wrong path.
+        It is removed and the new path is appended to the end of the list.
+
+        Returns (path of the ini file, True if the file was changed).
+        Raises SlicerConnectError (SlicerIniMissingError) with a message for the user.
+    '''
+    sSlicerIniPath = findSlicerIni(sSlicerPath)
+    if sSlicerIniPath is None:
+        raise SlicerIniMissingError(sINI_MISSING_MSG)
+
+    return sSlicerIniPath, connectIni(getCheckedCodePath(sModulePath), sSlicerIniPath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def getCheckedCodePath(sModulePath):
+    ''' Image Quizzer code path to connect; raises SlicerConnectError if the folder is missing.
+    '''
+    sImageQuizzerCodePath = getImageQuizzerCodePath(sModulePath)
+    if not os.path.exists(sImageQuizzerCodePath):
+        raise SlicerConnectError("..\\ImageQuizzer\\Code folder is missing. " + \
+                                 "Reset the Image Quizzer location to the installation directory.\n")
+    return sImageQuizzerCodePath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def connectIni(sImageQuizzerCodePath, sSlicerIniPath):
+    ''' Replace any Image Quizzer entry of the ini file's AdditionalPaths with
+        sImageQuizzerCodePath. Returns True if the file was changed.
+    '''
+    oIni = SlicerIni(sSlicerIniPath)
+    oPaths = oIni.getAdditionalPaths()
+    if oPaths is None:
+        raise SlicerConnectError("Problem with Slicer-xxxx.ini file. Reset the location for Slicer application\n"\
+                                 + "OR add module manually in Slicer's Applications>Modules settings."\
+                                 + '\n\nSee documentation > Getting started'\
+                                 + '\n' + sDOCUMENTATION_URL)
+
+    oPaths.removeImageQuizzer()
+    oPaths.add(sImageQuizzerCodePath)
+    oIni.setAdditionalPaths(oPaths)
+    return oIni.save()
+
+
+##########################################################################
+#
+# AdditionalPaths
+#
+##########################################################################
+class AdditionalPaths():
+    ''' The comma separated module path list of Slicer's AdditionalPaths setting.
+        Entries are kept as written (quoted entries stay quoted); comparisons use
+        the normalized form (forward slashes, no trailing slash, case folded on
+        Windows).
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sValue=''):
+        self.lEntries = []
+        self.setKeys = set()
+        for sEntry in _splitList(sValue):
+            self.add(sEntry)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add(self, sEntry):
+        ''' Append sEntry unless it is already in the list. Returns True if added.
+        '''
+        sKey = _getKey(sEntry)
+        if sKey == '' or sKey in self.setKeys:
+            return False
+        self.lEntries.append(sEntry.strip())
+        self.setKeys.add(sKey)
+        return True
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def removeImageQuizzer(self):
+        ''' Remove every entry that is an Image Quizzer code folder (any drive or
+            location). Paths below such a folder (ImageQuizzer/Code/...) are other
+            modules and are kept.
+        '''
+        self.lEntries = [sEntry for sEntry in self.lEntries if not isImageQuizzerCodePath(sEntry)]
+        self.setKeys = {_getKey(sEntry) for sEntry in self.lEntries}
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def format(self):
+        return ', '.join(self.lEntries)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def isImageQuizzerCodePath(sEntry):
+    sPath = _normalize(sEntry)
+    return sPath == sCODE_SUBSTRING or sPath.endswith('/' + sCODE_SUBSTRING)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _normalize(sEntry):
+    sPath = sEntry.strip()
+    if len(sPath) >= 2 and sPath[0] == '"' and sPath[-1] == '"':
+        sPath = sPath[1:-1]
+    sPath = sPath.replace('\\','/')
+    while len(sPath) > 1 and sPath.endswith('/'):
+        sPath = sPath[:-1]
+    return sPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _getKey(sEntry):
+    sPath = _normalize(sEntry)
+    if os.name == 'nt':
+        sPath = sPath.casefold()
+    return sPath
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _splitList(sValue):
+    ''' Split a QSettings list value on commas outside double quotes - one pass.
+    '''
+    lEntries = []
+    lChars = []
+    bQuoted = False
+    for sChar in sValue:
+        if sChar == '"':
+            bQuoted = not bQuoted
+        elif sChar == ',' and not bQuoted:
+            lEntries.append(''.join(lChars).strip())
+            lChars = []
+            continue
+        lChars.append(sChar)
+    lEntries.append(''.join(lChars).strip())
+    return [sEntry for sEntry in lEntries if sEntry != '']
+
+
+##########################################################################
+#
+# SlicerIni
+#
+##########################################################################
+class SlicerIni():
+    ''' Minimal line-preserving model of the Slicer-xxxx.ini file: only the
+        AdditionalPaths line is interpreted, every other line is written back as read.
+    '''
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, sPath):
+        self.sPath = sPath
+        with open(sPath, 'r', encoding='utf-8', errors='surrogateescape', newline='') as fIn:
+            self.sOriginal = fIn.read()
+        self.lLines = self.sOriginal.splitlines(keepends=True)
+        self.iPathsLine = self._findAdditionalPaths()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _findAdditionalPaths(self):
+        ''' Index of the AdditionalPaths line - in the [Modules] section if there is
+            one, otherwise the first such line anywhere - or None.
+        '''
+        iFirst = None
+        sSection = None
+        for iLine, sLine in enumerate(self.lLines):
+            sStripped = sLine.strip()
+            if sStripped.startswith('[') and sStripped.endswith(']'):
+                sSection = sStripped
+            elif sStripped.startswith(sADDITIONAL_PATHS_KEY):
+                if sSection == sMODULES_SECTION:
+                    return iLine
+                if iFirst is None:
+                    iFirst = iLine
+        return iFirst
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def getAdditionalPaths(self):
+        if self.iPathsLine is None:
+            return None
+        sLine = self.lLines[self.iPathsLine].rstrip('\r\n')
+        return AdditionalPaths(sLine.split('=', 1)[1])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def setAdditionalPaths(self, oPaths):
+        sLine = self.lLines[self.iPathsLine]
+        sEnding = sLine[len(sLine.rstrip('\r\n')):]
+        sIndent = sLine[:len(sLine) - len(sLine.lstrip())]
+        self.lLines[self.iPathsLine] = sIndent + sADDITIONAL_PATHS_KEY + oPaths.format() + sEnding
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def save(self):
+        ''' Write the file if it changed, through a temporary file in the same folder
+            and an atomic rename so Slicer never reads a half-written file.
+            Returns True if the file was written.
+        '''
+        sContent = ''.join(self.lLines)
+        if sContent == self.sOriginal:
+            return False
+
+        sDir = os.path.dirname(os.path.abspath(self.sPath))
+        iHandle, sTempPath = tempfile.mkstemp(prefix='.' + os.path.basename(self.sPath) + '.', dir=sDir)
+        try:
+            with os.fdopen(iHandle, 'w', encoding='utf-8', errors='surrogateescape', newline='') as fOut:
+                fOut.write(sContent)
+                fOut.flush()
+                os.fsync(fOut.fileno())
+            os.replace(sTempPath, self.sPath)
+        except:
+            if os.path.exists(sTempPath):
+                os.remove(sTempPath)
+            raise
+        self.sOriginal = sContent
+        return True
@@ -0,0 +1,141 @@
+'''
+    Tests for ImageQuizzerSlicerSettings: parsing and rewriting the AdditionalPaths
+    list and connecting the module in a Slicer-xxxx.ini file.
+
+    Usage:      >> python -m pytest test_ImageQuizzerSlicerSettings.py
+                >> python -m unittest test_ImageQuizzerSlicerSettings
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ImageQuizzerSlicerSettings import AdditionalPaths, SlicerIni, connectIni, connectModule, \
+                                      SlicerIniMissingError
+
+
+sOLD_CODE_PATH = 'E:/ImageQuizzer/Code'
+sOTHER_MODULE = 'C:/Slicer Modules/Other, with comma'
+
+sINI_TEMPLATE = '[General]\r\nlanguage=en_US\r\n\r\n[Modules]\r\nAdditionalPaths=%s\r\nHomeModule=Welcome\r\n'
+
+
+##########################################################################
+#
+# TestAdditionalPaths
+#
+##########################################################################
+class TestAdditionalPaths(unittest.TestCase):
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_parseQuotedFirstEntry(self):
+        oPaths = AdditionalPaths('"%s", %s' % (sOTHER_MODULE, sOLD_CODE_PATH))
+        self.assertEqual(oPaths.lEntries, ['"%s"' % sOTHER_MODULE, sOLD_CODE_PATH])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_parseQuotedLastEntry(self):
+        oPaths = AdditionalPaths('%s, "%s"' % (sOLD_CODE_PATH, sOTHER_MODULE))
+        self.assertEqual(oPaths.lEntries, [sOLD_CODE_PATH, '"%s"' % sOTHER_MODULE])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_formatKeepsQuotes(self):
+        sValue = '"%s", %s, "D:/Quoted/ImageQuizzer/Code"' % (sOTHER_MODULE, 'C:/Plain')
+        self.assertEqual(AdditionalPaths(sValue).format(), sValue)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_duplicatesDropped(self):
+        oPaths = AdditionalPaths('C:/Modules/A, C:\\Modules\\A\\, "C:/Modules/A"')
+        self.assertEqual(oPaths.lEntries, ['C:/Modules/A'])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_removeImageQuizzer(self):
+        oPaths = AdditionalPaths('"F:/ImageQuizzer/Code/", %s, "%s", E:\\ImageQuizzer\\Code'\
+                                 % (sOLD_CODE_PATH, sOTHER_MODULE))
+        oPaths.removeImageQuizzer()
+        self.assertEqual(oPaths.lEntries, ['"%s"' % sOTHER_MODULE])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_removeKeepsNestedModules(self):
+        # a module below an Image Quizzer code folder is another module
+        sNested = 'E:/ImageQuizzer/Code/Extensions/Helper'
+        oPaths = AdditionalPaths('%s, "%s"' % (sOLD_CODE_PATH, sNested))
+        oPaths.removeImageQuizzer()
+        self.assertEqual(oPaths.lEntries, ['"%s"' % sNested])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_emptyValue(self):
+        oPaths = AdditionalPaths('')
+        self.assertEqual(oPaths.lEntries, [])
+        self.assertTrue(oPaths.add('G:/ImageQuizzer/Code'))
+        self.assertEqual(oPaths.format(), 'G:/ImageQuizzer/Code')
+
+
+##########################################################################
+#
+# TestSlicerIni
+#
+##########################################################################
+class TestSlicerIni(unittest.TestCase):
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def setUp(self):
+        self.sTempDir = tempfile.mkdtemp(prefix='iq-test-')
+        self.sModuleDir = os.path.join(self.sTempDir, 'Module')
+        os.makedirs(os.path.join(self.sModuleDir, 'ImageQuizzer', 'Code'))
+        self.sSlicerDir = os.path.join(self.sTempDir, 'Slicer')
+        os.makedirs(os.path.join(self.sSlicerDir, 'NA-MIC'))
+        self.sIniPath = os.path.join(self.sSlicerDir, 'NA-MIC', 'Slicer-29738.ini')
+        self.sCodePath = os.path.join(self.sModuleDir, 'ImageQuizzer', 'Code').replace('\\', '/')
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def tearDown(self):
+        shutil.rmtree(self.sTempDir)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _writeIni(self, sAdditionalPaths):
+        with open(self.sIniPath, 'w', encoding='utf-8', newline='') as fOut:
+            fOut.write(sINI_TEMPLATE % sAdditionalPaths)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _readIni(self):
+        with open(self.sIniPath, 'r', encoding='utf-8', newline='') as fIn:
+            return fIn.read()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_connectReplacesOldEntry(self):
+        self._writeIni('"%s", %s' % (sOTHER_MODULE, sOLD_CODE_PATH))
+
+        sIniPath, bChanged = connectModule(self.sModuleDir, self.sSlicerDir)
+
+        self.assertEqual(sIniPath, self.sIniPath)
+        self.assertTrue(bChanged)
+        self.assertEqual(self._readIni(), sINI_TEMPLATE % ('"%s", %s' % (sOTHER_MODULE, self.sCodePath)))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_connectUnchangedIsNoOp(self):
+        self._writeIni('"%s", %s' % (sOTHER_MODULE, self.sCodePath))
+        iMtime = os.stat(self.sIniPath).st_mtime_ns
+        iInode = os.stat(self.sIniPath).st_ino
+
+        self.assertFalse(connectIni(self.sCodePath, self.sIniPath))
+
+        self.assertEqual(os.stat(self.sIniPath).st_mtime_ns, iMtime)
+        self.assertEqual(os.stat(self.sIniPath).st_ino, iInode)
+        self.assertEqual(os.listdir(os.path.dirname(self.sIniPath)), [os.path.basename(self.sIniPath)])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_otherLinesKept(self):
+        self._writeIni('')
+        connectIni(self.sCodePath, self.sIniPath)
+        self.assertEqual(self._readIni(), sINI_TEMPLATE % self.sCodePath)
+        self.assertEqual(SlicerIni(self.sIniPath).getAdditionalPaths().lEntries, [self.sCodePath])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_missingIni(self):
+        with self.assertRaises(SlicerIniMissingError):
+            connectModule(self.sModuleDir, self.sSlicerDir)
+
+
+if __name__ == '__main__':
+    unittest.main()